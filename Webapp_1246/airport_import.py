@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Imports
+import csv
+import json
+import database
+from validation import AIRPORT_FIELDS, clean_airport_field
+
+################################################################################
+# Bulk airport import
+#   - Reads CSV (with a name,iatacode,city,country header) or JSON Lines
+#     one row at a time, so the whole file is never held in memory
+#   - Rows are checked with the same rules as the Add Airport form and loaded
+#     in chunks, one transaction per chunk, through database.bulk_insert_airports()
+#   - Returns a report with a line number and reason for every rejected row
+################################################################################
+
+FIELDS = AIRPORT_FIELDS
+DEFAULT_CHUNK_SIZE = 1000
+
+# Stop collecting error messages after this many, the counts stay exact
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(filename):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(textfile, fmt):
+    """Yield (lineno, dict or None, error) for every record in the file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(textfile)
+        missing = [f for f in FIELDS if f not in (reader.fieldnames or [])]
+        if missing:
+            yield 1, None, f"CSV header is missing: {', '.join(missing)}"
+            return
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'jsonl':
+        for lineno, line in enumerate(textfile, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield lineno, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield lineno, None, "Expected a JSON object"
+                continue
+            yield lineno, record, None
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def clean_row(record):
+    '''
+    Normalise one record the way the Add Airport form does.
+    Returns ((name, iatacode, city, country), None) or (None, error).
+    '''
+    values = []
+    for field in FIELDS:
+        value, error = clean_airport_field(field, record.get(field))
+        if error is not None:
+            return None, error
+        values.append(value)
+    return tuple(values), None
+
+
+def import_airports(textfile, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Validate and load every airport in textfile.
+    Returns {'rows': n, 'inserted': n, 'rejected': n, 'errors': [(lineno, message)]}.
+    A chunk that fails as a whole is rolled back and all of its rows are
+    reported; chunks before and after it are kept.
+    '''
+    report = {'rows': 0, 'inserted': 0, 'rejected': 0, 'errors': []}
+
+    def reject(lineno, message):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append((lineno, message))
+
+    def flush(chunk):
+        result = database.bulk_insert_airports(chunk)
+        if isinstance(result, dict):
+            report['inserted'] += result['inserted']
+            for lineno, fields in result['conflicts']:
+                reject(lineno, 'An airport with this ' + ' and '.join(
+                    'IATA code' if f == 'iatacode' else f for f in fields) + ' already exists.')
+        else:
+            for row in chunk:
+                reject(row[0], f'Not loaded: {result}')
+
+    # names and codes seen earlier in this file, the database is checked per chunk
+    seen_names = set()
+    seen_codes = set()
+    chunk = []
+    for lineno, record, error in read_rows(textfile, fmt):
+        report['rows'] += 1
+        if error is None:
+            row, error = clean_row(record)
+        if error is None and row[0].casefold() in seen_names:
+            error = 'Duplicate airport name earlier in the file.'
+        if error is None and row[1] in seen_codes:
+            error = 'Duplicate IATA code earlier in the file.'
+        if error is not None:
+            reject(lineno, error)
+            continue
+
+        seen_names.add(row[0].casefold())
+        seen_codes.add(row[1])
+        chunk.append((lineno,) + row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    report['errors'].sort()
+    return report
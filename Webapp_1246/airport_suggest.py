@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Imports
+import bisect
+import threading
+import database
+
+################################################################################
+# Airport type-ahead
+#   - A prefix index over the airport catalogue: every airport is listed
+#     under its IATA code, its name, each later word of its name and its
+#     city, all casefolded, in one sorted list
+#   - A prefix lookup is two binary searches into that list, so it costs
+#     O(log n) plus at most MAX_SCAN matches, however many airports there are
+#   - The index is rebuilt when the catalogue snapshot changes (after a
+#     write or when the snapshot expires), never per request
+################################################################################
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# A one letter prefix can match most of the index; only this many entries
+# are ranked, so the cost of a lookup stays bounded
+MAX_SCAN = 2000
+
+# Where a match was found, lower sorts first
+RANK_CODE, RANK_NAME, RANK_WORD, RANK_CITY = range(4)
+
+
+class PrefixIndex:
+
+    def __init__(self, airports):
+        entries = []
+        for airport in airports:
+            airportid, name, iatacode, city = airport[0], airport[1], airport[2], airport[3]
+            entries.append((iatacode.strip().casefold(), RANK_CODE, airportid))
+            name = name.strip().casefold()
+            entries.append((name, RANK_NAME, airportid))
+            words = name.split()
+            for i in range(1, len(words)):
+                entries.append((" ".join(words[i:]), RANK_WORD, airportid))
+            entries.append((city.strip().casefold(), RANK_CITY, airportid))
+        entries.sort()
+        self.keys = [e[0] for e in entries]
+        self.entries = entries
+
+    def search(self, prefix, limit):
+        '''
+        Airport ids whose code, name, a word of the name or city start with
+        prefix; exact code matches first, then name, word and city matches.
+        '''
+        prefix = " ".join(prefix.casefold().split())
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, prefix)
+        # every key starting with prefix sorts below prefix + the last code point
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start, min(len(self.keys), start + MAX_SCAN))
+        best = {}
+        for key, rank, airportid in self.entries[start:end]:
+            if rank == RANK_CODE and key != prefix:
+                rank = RANK_NAME
+            order = (rank, len(key), key)
+            if airportid not in best or order < best[airportid]:
+                best[airportid] = order
+        return sorted(best, key=best.get)[:limit]
+
+
+# (snapshot, index) for the snapshot the index was built from
+_index = (None, None)
+_index_lock = threading.Lock()
+
+
+def _current_index():
+    global _index
+    snap = database.airport_catalogue.snapshot()
+    if snap is None:
+        return None, None
+    built_for, index = _index
+    if built_for is snap:
+        return snap, index
+    with _index_lock:
+        built_for, index = _index
+        if built_for is not snap:
+            index = PrefixIndex(snap.airports)
+            _index = (snap, index)
+    return snap, index
+
+
+def suggest(prefix, limit=DEFAULT_LIMIT):
+    '''
+    Up to limit airports matching what was typed so far.
+    Returns a list of catalogue rows, or None if the catalogue is unavailable.
+    '''
+    limit = max(1, min(limit, MAX_LIMIT))
+    snap, index = _current_index()
+    if index is None:
+        return None
+    return [snap.by_id[airportid] for airportid in index.search(prefix, limit)]
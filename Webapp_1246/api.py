@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# Imports
+from flask import Blueprint, request, session, jsonify
+import database
+import http_cache
+from validation import AIRPORT_FIELDS
+
+################################################################################
+# JSON API, version 1 (/api/v1)
+#   - For programs that sync airports and users, over the same database.py
+#     functions as the pages. Needs a logged in session; anything but GET
+#     needs an administrator, and a JSON body sent as application/json
+#   - Batches of up to MAX_BATCH airports: GET many by IATA code in one
+#     query, PATCH many and DELETE many each in one transaction, all or
+#     nothing
+#   - ?fields=iatacode,name picks the columns returned, ?format=rows sends
+#     {"fields": [...], "rows": [[...], ...]} instead of one object per row
+#   - GETs answer 304 like the pages do (http_cache.py)
+#   - Passwords are never returned
+################################################################################
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+# Most airports, users or patches handled by one request
+MAX_BATCH = 1000
+DEFAULT_LIMIT = 100
+
+AIRPORT_COLUMNS = ('airportid',) + AIRPORT_FIELDS
+USER_COLUMNS = database.USER_PUBLIC_COLUMNS
+
+
+class ApiError(Exception):
+    """Answered as {"error": message, **extra} with the given status."""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.extra = extra
+
+
+@api_v1.errorhandler(ApiError)
+def api_error(error):
+    return jsonify(error=error.message, **error.extra), error.status
+
+
+@api_v1.before_request
+def check_session():
+    if not session.get('logged_in'):
+        raise ApiError(401, 'Not logged in.')
+    if request.method not in ('GET', 'HEAD') and session.get('isadmin') != True:
+        raise ApiError(403, 'Only administrators can change data.')
+
+
+#####################################################
+##  Request and response helpers
+#####################################################
+
+def _split(values):
+    # "SYD,MEL" or a repeated parameter (or a JSON list), each value once, in order
+    items = []
+    for value in values:
+        items.extend(part.strip() for part in str(value).split(','))
+    items = list(dict.fromkeys(item for item in items if item))
+    if len(items) > MAX_BATCH:
+        raise ApiError(400, f'At most {MAX_BATCH} at a time.')
+    return items
+
+
+def _fields(allowed):
+    requested = request.args.get('fields')
+    if not requested:
+        return allowed
+    fields = tuple(_split([requested]))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ApiError(400, f"Unknown fields: {', '.join(unknown)}", allowed=list(allowed))
+    return fields
+
+
+def _limit():
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, MAX_BATCH))
+
+
+def _value(value):
+    # the char columns come back padded with spaces
+    return value.strip() if isinstance(value, str) else value
+
+
+def _record(row, fields):
+    return {field: _value(row[field]) for field in fields}
+
+
+def _listing(rows, fields, **extra):
+    '''
+    rows as the body of a response: {"items": [{...}, ...]}, or with
+    ?format=rows {"fields": [...], "rows": [[...], ...]}; extra is added.
+    '''
+    shape = request.args.get('format', 'objects')
+    if shape == 'rows':
+        body = {'fields': list(fields), 'rows': [[_value(row[field]) for field in fields] for row in rows]}
+    elif shape == 'objects':
+        body = {'items': [_record(row, fields) for row in rows]}
+    else:
+        raise ApiError(400, 'format must be objects or rows.')
+    body.update(extra)
+    return jsonify(body)
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Expected a JSON object sent as application/json.')
+    return body
+
+
+def _failed(result):
+    # database.py answers None or an error string when it could not run
+    if result is None or isinstance(result, str):
+        raise ApiError(503, result or 'The database is not available right now.')
+    return result
+
+
+#####################################################
+##  Airports
+#####################################################
+
+@api_v1.route('/airports', methods=['GET'])
+@http_cache.conditional('airports')
+def get_airports():
+    '''
+    ?codes=SYD,MEL: those airports, and the codes not found.
+    Otherwise a page of airports by airportid: ?after=<airportid>&limit=<n>.
+    '''
+    fields = _fields(AIRPORT_COLUMNS)
+    codes = _split(request.args.getlist('codes'))
+    if codes:
+        codes = [code.upper() for code in codes]
+        found = _failed(database.get_airports_by_iatacodes(codes))
+        return _listing([found[code] for code in codes if code in found], fields,
+                        missing=[code for code in codes if code not in found])
+
+    limit = _limit()
+    airports, _, has_next = _failed(database.get_airports_page(after=request.args.get('after', type=int),
+                                                               limit=limit))
+    return _listing(airports, fields, next_after=airports[-1][0] if has_next else None)
+
+
+@api_v1.route('/airports/<iatacode>', methods=['GET'])
+@http_cache.conditional('airports')
+def get_airport(iatacode):
+    airport = _failed(database.get_airports_by_iatacodes([iatacode])).get(iatacode.strip().upper())
+    if airport is None:
+        raise ApiError(404, f'No airport with IATA code {iatacode}.')
+    return jsonify(_record(airport, _fields(AIRPORT_COLUMNS)))
+
+
+@api_v1.route('/airports', methods=['PATCH'])
+def patch_airports():
+    '''
+    Body {"patches": [{"iatacode": "SYD", "set": {"city": "Sydney"}}, ...]},
+    applied in order in one transaction. If one of them can not be made,
+    none are: 400 for invalid values, 404 for an unknown airport, 409 for a
+    name or code already in use.
+    '''
+    # everything that can be refused is checked before anything is written
+    fields = _fields(AIRPORT_COLUMNS)
+    patches = _json_body().get('patches')
+    if not isinstance(patches, list) or not patches:
+        raise ApiError(400, 'Expected "patches": a list of {"iatacode": ..., "set": {...}}.')
+    if len(patches) > MAX_BATCH:
+        raise ApiError(400, f'At most {MAX_BATCH} at a time.')
+    changes = []
+    for index, patch in enumerate(patches):
+        if not isinstance(patch, dict) or not patch.get('iatacode') or not isinstance(patch.get('set'), dict):
+            raise ApiError(400, f'patches[{index}] needs "iatacode" and a "set" object.', index=index)
+        changes.append((patch['iatacode'], patch['set']))
+
+    result = _failed(database.patch_airports(changes))
+    if not result['committed']:
+        for index, outcome in enumerate(result['results']):
+            if outcome['errors']:
+                raise ApiError(400, '; '.join(outcome['errors']), index=index, iatacode=outcome['iatacode'])
+        for index, outcome in enumerate(result['results']):
+            if not outcome['found']:
+                raise ApiError(404, f"No airport with IATA code {outcome['iatacode']}; nothing was changed.",
+                               index=index, iatacode=outcome['iatacode'])
+            if outcome['conflicts']:
+                raise ApiError(409, f"An airport with this {' and '.join(outcome['conflicts'])} already exists; "
+                               "nothing was changed.", index=index, iatacode=outcome['iatacode'],
+                               conflicts=outcome['conflicts'])
+        raise ApiError(400, 'Nothing to change.')
+
+    items = []
+    for outcome in result['results']:
+        item = {'iatacode': outcome['iatacode'], 'changed': outcome['airport'] is not None}
+        if outcome['airport'] is not None:
+            item['airport'] = _record(outcome['airport'], fields)
+        if outcome['unchanged']:
+            item['unchanged'] = outcome['unchanged']
+        items.append(item)
+    return jsonify(results=items)
+
+
+@api_v1.route('/airports', methods=['DELETE'])
+def delete_airports():
+    '''
+    Body {"iatacodes": ["SYD", ...]} (or ?codes=SYD,MEL): deletes them and
+    their past flights in one transaction. Nothing is deleted if one of
+    them is unknown (404) or still has upcoming flights (409).
+    '''
+    codes = request.args.getlist('codes')
+    if not codes:
+        codes = _json_body().get('iatacodes')
+        if not isinstance(codes, list):
+            raise ApiError(400, 'Expected "iatacodes": a list of IATA codes.')
+    codes = [code.upper() for code in _split(codes)]
+    if not codes:
+        raise ApiError(400, 'No IATA codes given.')
+
+    result = _failed(database.delete_airports(codes, all_or_nothing=True))
+    if not result['committed']:
+        status = 409 if result['blocked'] else 404
+        raise ApiError(status, 'Nothing was deleted.', blocked=result['blocked'], missing=result['missing'])
+    return jsonify(deleted=[{'iatacode': iatacode, 'airportid': airport_id, 'flights_removed': flights_removed}
+                            for iatacode, airport_id, flights_removed in result['deleted']])
+
+
+#####################################################
+##  Users
+#####################################################
+
+@api_v1.route('/users', methods=['GET'])
+@http_cache.conditional('users')
+def get_users():
+    '''
+    ?ids=a,b: those users, and the ids not found.
+    Otherwise a page of users by userid: ?after=<userid>&limit=<n>.
+    '''
+    fields = _fields(USER_COLUMNS)
+    ids = _split(request.args.getlist('ids'))
+    if ids:
+        users = _failed(database.get_users_by_ids(ids))
+        seen = {_value(user['userid']) for user in users}
+        return _listing(users, fields, missing=[userid for userid in ids if userid not in seen])
+
+    users, has_more = _failed(database.get_users_page(after=request.args.get('after'), limit=_limit()))
+    return _listing(users, fields, next_after=_value(users[-1]['userid']) if has_more else None)
+
+
+@api_v1.route('/users/<userid>', methods=['GET'])
+@http_cache.conditional('users')
+def get_user(userid):
+    users = _failed(database.get_users_by_ids([userid]))
+    if not users:
+        raise ApiError(404, f'No user with id {userid}.')
+    return jsonify(_record(users[0], _fields(USER_COLUMNS)))
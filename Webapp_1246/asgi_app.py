@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# Async serving mode:
+#   hypercorn asgi_app:application --bind 0.0.0.0:<port>
+# or simply
+#   python3 asgi_app.py
+import asyncio
+import functools
+import logging
+import time
+import quart
+from quart import Quart, request, session, redirect, url_for, flash, render_template, abort, Response
+from quart import make_response, get_flashed_messages
+from quart.sessions import SessionInterface
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from markupsafe import Markup
+import async_database
+import fragments
+import http_cache
+import metrics
+import routes
+import sessions
+from routes import encode_cursor, decode_cursor
+from settings import get_settings, configure_logging
+
+################################################################################
+# ASGI application
+#   - The read-only pages (user lists, airport pages, summary) and the login
+#     are served by async handlers on async_database.py, so many slow queries
+#     can be waited on at once without a thread each
+#   - Every other route (the forms that write, imports, exports) is passed
+#     to the existing Flask app in routes.py, run on the server's thread pool
+#   - Both apps share the sessions (the same store, see sessions.py), the
+#     templates and the in-process caches
+################################################################################
+
+log = logging.getLogger('airline.asgi')
+
+class QuartServerSessionInterface(sessions.ServerSessionStorage, SessionInterface):
+    """The server side sessions of routes.app, for Quart; the store is
+    blocking (SQLite), so it is used from a thread."""
+
+    async def open_session(self, app, request):
+        return await asyncio.to_thread(self.load_session, app, request)
+
+    async def save_session(self, app, session, response):
+        if response is None:
+            return
+        try:
+            await asyncio.to_thread(self.store_session, app, session, response)
+        except Exception:
+            log.exception("Could not save session")
+
+
+app = Quart(__name__)
+app.secret_key = routes.app.secret_key
+app.session_interface = QuartServerSessionInterface()
+app.config['SESSION_COOKIE_SAMESITE'] = routes.app.config['SESSION_COOKIE_SAMESITE']
+
+
+@app.before_serving
+async def startup():
+    await async_database.open_pool()
+
+@app.after_serving
+async def shutdown():
+    await async_database.close_pool()
+
+
+def conditional(*kinds):
+    """http_cache.conditional() for the async views."""
+    def decorate(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if not http_cache.cacheable(request, session):
+                return await view(*args, **kwargs)
+            etag, last_modified = http_cache.page_etag(kinds, session)
+            if http_cache.is_fresh(request, etag):
+                return http_cache.add_validators(Response('', status=304), etag, last_modified)
+            response = await make_response(await view(*args, **kwargs))
+            if response.status_code == 200 and not get_flashed_messages():
+                http_cache.add_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorate
+
+
+#####################################################
+##  Metrics
+#####################################################
+
+@app.before_request
+async def start_request_timer():
+    quart.g.request_start = time.perf_counter()
+
+@app.after_request
+async def record_request_time(response):
+    start = quart.g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.http_requests.record((route, request.method), time.perf_counter() - start,
+                                     error=response.status_code >= 500)
+    return response
+
+@app.route('/metrics')
+async def show_metrics():
+    config = get_settings()
+    if not config.metrics_enabled:
+        abort(404)
+    if config.metrics_local_only and request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+#####################################################
+##  INDEX and login
+#####################################################
+
+@app.route('/')
+async def index():
+    if 'logged_in' not in session or not session['logged_in']:
+        return redirect(url_for('login'))
+    page = {'title': 'Welcome', 'username': routes.dbuser}
+    return await render_template('welcome.html', session=session, page=page)
+
+@app.route('/login', methods=['POST', 'GET'])
+async def login():
+    page = {'title': 'Login', 'dbuser': routes.dbuser}
+    if request.method == 'POST':
+        form = await request.form
+        val = await async_database.check_login(form['userid'], form['password'])
+        if val is None or len(val) < 1:
+            await flash('There was an error logging you in')
+            return redirect(url_for('login'))
+        log.debug("Logged in %s", form['userid'])
+        session.regenerate()
+        session['name'] = val[0]['firstname']
+        session['userid'] = form['userid']
+        session['logged_in'] = True
+        session['userroleid'] = val[0]['userroleid']
+        session['rolename'] = val[0]['rolename']
+        session['isadmin'] = val[0]['isadmin']
+        return redirect(url_for('index'))
+    if 'logged_in' in session and session['logged_in'] == True:
+        return redirect(url_for('index'))
+    return await render_template('index.html', page=page)
+
+@app.route('/logout')
+async def logout():
+    session.clear()
+    await flash('You have been logged out')
+    return redirect(url_for('index'))
+
+
+#####################################################
+##  Users
+#####################################################
+
+@app.route('/users')
+@conditional('users')
+async def list_users():
+    # the same fragment cache as routes.list_users()
+    async def build():
+        users = await async_database.list_users()
+        if users is None:
+            return None
+        return Markup(await render_template('users_table.html', session=session, users=users)), None
+    table = await fragments.cached_async('users_table', ('users',), build, session.get('isadmin') == True)
+    if table is None:
+        await flash('Error, there are no rows in users')
+    return await render_template('list_users.html', page={'title': 'List Contents of users'},
+                                 session=session, users=[], users_table=table and table[0])
+
+@app.route('/users/<userid>')
+async def list_single_users(userid):
+    users = await async_database.list_users_equifilter("userid", userid)
+    if users is None or len(users) == 0:
+        users = []
+        await flash('Error, there are no rows in users that match the attribute "userid" for the value ' + userid)
+    return await render_template('list_users.html', page={'title': 'List Single userid for users'},
+                                 session=session, users=users)
+
+@app.route('/consolidated/users')
+@conditional('users')
+async def list_consolidated_users():
+    async def build():
+        users = await async_database.list_consolidated_users()
+        if users is None:
+            return None
+        return Markup(await render_template('consolidated_users_table.html', session=session, users=users)), None
+    table = await fragments.cached_async('consolidated_users_table', ('users',), build,
+                                         session.get('isadmin') == True)
+    if table is None:
+        await flash('Error, there are no rows in users_userroles_listdict')
+    return await render_template('list_consolidated_users.html',
+                                 page={'title': 'List Contents of Users join Userroles'},
+                                 session=session, users=[], users_table=table and table[0])
+
+@app.route('/user_stats')
+@conditional('users')
+async def list_user_stats():
+    stats = await async_database.list_user_stats()
+    if stats is None:
+        stats = []
+        await flash('Error, there are no rows in user_stats')
+    return await render_template('list_user_stats.html', page={'title': 'User Stats'},
+                                 session=session, users=stats)
+
+
+#####################################################
+##  Airports
+#####################################################
+
+@app.route('/airports', methods=['GET'])
+@conditional('airports')
+async def list_airports():
+    limit = 50
+    current_page = request.args.get('page', 1, type=int)
+    exact = request.args.get('exact', 0, type=int) == 1
+    last = request.args.get('last', 0, type=int) == 1
+    try:
+        after = decode_cursor(request.args.get('after'))
+        before = decode_cursor(request.args.get('before'))
+    except ValueError as e:
+        await flash(str(e))
+        return redirect(url_for('list_airports'))
+
+    # as routes.list_airports(), the rendered page of rows is cached
+    async def build():
+        result = await async_database.get_airports_page(after=after, before=before, last=last, limit=limit)
+        if result is None or isinstance(result, str):
+            return None
+        airports, has_prev, has_next = result
+        bounds = (airports[0][0], airports[-1][0]) if airports else None
+        return (Markup(await render_template('airports_table.html', airports=airports)),
+                (bounds, has_prev, has_next))
+
+    # the page and the count do not depend on each other, ask for both at once
+    table, count = await asyncio.gather(
+        fragments.cached_async('airports_table', ('airports',), build, after, before, last, limit),
+        async_database.get_airport_count(exact=exact))
+
+    if table is None:
+        await flash('Error fetching airports. Please try again.')
+        return await render_template('list_airports.html', airports=[],
+                                     page={'title': 'View Airports', 'current_page': 1, 'total_airports': 0,
+                                           'total_pages': 1, 'exact': True},
+                                     session=session)
+    airports_table, (bounds, has_prev, has_next) = table
+    if count is None:
+        await flash('Error fetching total count of airports. Please try again.')
+        count = (0, False)
+    total_airports, is_exact = count
+
+    total_pages = max(1, (total_airports // limit) + (1 if total_airports % limit > 0 else 0))
+    if last:
+        current_page = total_pages
+    current_page = max(1, current_page)
+
+    page = {'title': 'View Airports', 'current_page': current_page, 'total_airports': total_airports,
+            'total_pages': total_pages, 'exact': is_exact}
+    if bounds:
+        if has_prev:
+            page['prev_url'] = url_for('list_airports', before=encode_cursor(bounds[0]),
+                                       page=max(1, current_page - 1))
+        if has_next:
+            page['next_url'] = url_for('list_airports', after=encode_cursor(bounds[1]),
+                                       page=current_page + 1)
+    return await render_template('list_airports.html', airports_table=airports_table, page=page,
+                                 session=session)
+
+@app.route('/airports/get_airport_by_id/', methods=['GET', 'POST'])
+async def get_airport_by_id():
+    airport_data = None
+    if request.method == 'POST':
+        airport_id = (await request.form).get('airportid')
+        airport_data = await async_database.get_airport_by_id(airport_id)
+        if not airport_data:
+            await flash(f'Aiport with id: {airport_id} does not exist.')
+    return await render_template('get_airport_by_id.html', page={'title': 'Get Airport By Id'},
+                                 airport=airport_data, session=session)
+
+@app.route('/airports/get_summary')
+@conditional('airports')
+async def get_summary():
+    data = await async_database.airport_summary()
+    if data is None or isinstance(data, str):
+        await flash(f'Error retrieving the airport summary: {data or "Failed to connect to the database."}')
+        return await render_template('airport_summary.html', page={'title': 'Airport Summary'},
+                                     airport=[], session=session), 503
+    return await render_template('airport_summary.html', page={'title': 'Airport Summary'},
+                                 airport=data, session=session)
+
+
+#####################################################
+##  Everything else goes to the Flask app
+#####################################################
+
+async def _served_by_flask():
+    # never called, requests for these endpoints are routed to routes.app
+    abort(404)
+
+# Register the remaining Flask rules under the same endpoint names so that
+# url_for() in the templates works for every page
+for rule in routes.app.url_map.iter_rules():
+    if rule.endpoint not in app.view_functions and rule.endpoint != 'static':
+        app.add_url_rule(rule.rule, rule.endpoint, _served_by_flask, methods=rule.methods)
+
+_flask_app = AsyncioWSGIMiddleware(routes.app)
+_flask_adapter = routes.app.url_map.bind('')
+
+
+def _async_endpoint(scope):
+    try:
+        endpoint, _ = _flask_adapter.match(scope['path'], method=scope['method'])
+    except Exception:
+        # unknown path or redirect, let Quart answer it
+        return True
+    view = app.view_functions.get(endpoint)
+    return view is not None and view is not _served_by_flask
+
+
+async def application(scope, receive, send):
+    """The ASGI entry point: async pages on Quart, the rest on Flask."""
+    if scope['type'] == 'http' and not _async_endpoint(scope):
+        return await _flask_app(scope, receive, send)
+    return await app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    configure_logging()
+    config = Config()
+    config.bind = [f"0.0.0.0:{routes.portchoice}"]
+    print("-"*70)
+    print("Async mode: Please open your browser to: http://127.0.0.1:" + routes.portchoice + "/")
+    print("-"*70)
+    asyncio.run(serve(application, config))
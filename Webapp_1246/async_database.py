@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Imports
+import asyncio
+import logging
+import time
+import asyncpg
+import database
+from hashing import check_password, HashingBusy, HashingTimeout
+from metrics import timed, register_gauge
+from settings import get_settings
+
+################################################################################
+# Async database access, used by asgi_app.py
+#   - The same queries as database.py, on asyncpg instead of pg8000, so a
+#     slow query waits on the event loop instead of holding a thread
+#   - One asyncpg pool per event loop, sized by the [POOL] settings; it is
+#     opened when the server starts and closed when it stops
+#   - Results are asyncpg Records, which index by position and by column
+#     name like database.Row, so the same templates render them
+#   - Functions report failures the same way as database.py: None or an
+#     error string
+################################################################################
+
+logger = logging.getLogger('airline.async_database')
+
+_pool = None
+
+
+async def open_pool():
+    """Create the pool on the running event loop. Called at server start up."""
+    global _pool
+    if _pool is None:
+        config = get_settings()
+        options = config.pool_options()
+        _pool = await asyncpg.create_pool(
+            host=config.db_host, port=config.db_port, database=config.db_name,
+            user=config.db_user, password=config.db_password,
+            min_size=options['minsize'], max_size=options['maxsize'],
+            max_inactive_connection_lifetime=options['idle_timeout'],
+            timeout=options['timeout'],
+            server_settings={'search_path': 'airline'})
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+def _pool_stats():
+    if _pool is None:
+        return {}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {'in_use': size - idle, 'idle': idle}
+
+register_gauge('airline_async_db_pool_connections', 'Connections in the asyncpg pool', _pool_stats)
+
+
+async def fetch(sql, *args):
+    """All rows of a query. Failing and slow statements are logged like database.TimedCursor."""
+    pool = await open_pool()
+    start = time.perf_counter()
+    try:
+        return await pool.fetch(sql, *args)
+    except Exception as e:
+        elapsed = (time.perf_counter() - start) * 1000
+        # parameters may hold passwords, they are only logged when debugging
+        logger.error("Query failed after %.1f ms: %s (%s)", elapsed,
+                     database.SqlText(sql, args if database.query_debug_enabled() else None), e)
+        raise
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed >= get_settings().log_slow_query_ms:
+            logger.warning("Slow query (%.1f ms): %s", elapsed, database.SqlText(sql))
+        if database.query_debug_enabled():
+            database.sql_logger.info("SQL (%.1f ms): %s", elapsed, database.SqlText(sql, args))
+
+
+async def has_schema_feature(name):
+    """As database.has_schema_feature(), sharing its cache."""
+    cached = database._schema_feature_cache.get(name)
+    if cached is not None and time.monotonic() - cached[1] < get_settings().cache_catalogue_ttl:
+        return cached[0]
+    rows = await fetch(database.SCHEMA_FEATURES[name])
+    present = rows[0][0]
+    database._schema_feature_cache[name] = (present, time.monotonic())
+    return present
+
+
+###############
+# Login       #
+###############
+
+@timed
+async def check_login(username, password):
+    '''
+    Check Login given a username and password, as database.check_login().
+    '''
+    try:
+        result = await fetch("SELECT * FROM Users WHERE userid = $1", username)
+    except Exception:
+        logger.exception("Error Invalid Login")
+        return None
+    if not result:
+        logger.debug("User not found: %s", username)
+        return None
+
+    user_data = result[0]
+    role = None
+    for item in await list_userroles() or []:
+        if item['userroleid'] == user_data['userroleid']:
+            role = item
+    if role is None:
+        logger.error("User %s has unknown userroleid %s", username, user_data['userroleid'])
+        return None
+
+    # check_password() blocks on the hashing pool, wait for it off the loop
+    try:
+        matches = await asyncio.to_thread(check_password, password, user_data['password'])
+    except (HashingBusy, HashingTimeout) as e:
+        logger.warning("Login for %s was not checked: %s", username, e)
+        return None
+    except Exception:
+        logger.exception("Error Invalid Login")
+        return None
+
+    if not matches:
+        logger.debug("Invalid password for %s", username)
+        return None
+    columns = tuple(user_data.keys()) + tuple(role.keys())
+    return [database.row_class(columns)(tuple(user_data.values()) + tuple(role.values()))]
+
+
+########################
+# Users                #
+########################
+
+@timed
+async def list_users():
+    try:
+        return await fetch("SELECT * FROM users")
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+
+@timed
+async def list_userroles():
+    # shares database.py's role cache, filled by whichever side asks first
+    cached = database._userroles_cache
+    if cached is not None and time.monotonic() - cached[1] < get_settings().cache_role_ttl:
+        return cached[0]
+    try:
+        rows = await fetch("SELECT * FROM userroles")
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+    database._userroles_cache = (rows, time.monotonic())
+    return rows
+
+@timed
+async def list_users_equifilter(attributename, filterval):
+    if attributename.lower().strip() not in database.ALLOWED_ATTRIBUTES:
+        logger.warning("Invalid attribute name: %s", attributename)
+        return None
+    try:
+        return await fetch(f"SELECT * FROM users WHERE {attributename} = $1", filterval)
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+
+@timed
+async def list_consolidated_users():
+    try:
+        return await fetch("""SELECT *
+                FROM users
+                    JOIN userroles
+                    ON (users.userroleid = userroles.userroleid)""")
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+
+@timed
+async def list_user_stats():
+    try:
+        if await has_schema_feature('summary_tables'):
+            return await fetch("""SELECT userroleid, users as count
+                    FROM airline.user_role_counts
+                        ORDER BY userroleid ASC""")
+        return await fetch("""SELECT userroleid, COUNT(*) as count
+                FROM users
+                    GROUP BY userroleid
+                    ORDER BY userroleid ASC""")
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+
+
+########################
+# Airports             #
+########################
+
+@timed
+async def get_airports_page(after=None, before=None, last=False, limit=50):
+    '''
+    One page of airports by airportid, see database.get_airports_page().
+    Returns (airports, has_prev, has_next), or an error string.
+    '''
+    try:
+        if after is not None:
+            airports = await fetch("""SELECT airportid, name, iatacode, city, country FROM airports
+                     WHERE airportid > $1 ORDER BY airportid LIMIT $2""", after, limit + 1)
+        elif before is not None:
+            airports = await fetch("""SELECT airportid, name, iatacode, city, country FROM airports
+                     WHERE airportid < $1 ORDER BY airportid DESC LIMIT $2""", before, limit + 1)
+        elif last:
+            airports = await fetch("""SELECT airportid, name, iatacode, city, country FROM airports
+                     ORDER BY airportid DESC LIMIT $1""", limit + 1)
+        else:
+            airports = await fetch("""SELECT airportid, name, iatacode, city, country FROM airports
+                     ORDER BY airportid LIMIT $1""", limit + 1)
+    except asyncpg.PostgresError:
+        return f"Database Error"
+    except Exception:
+        return f"Unexpected error fetching airports"
+
+    more = len(airports) > limit
+    airports = airports[:limit]
+    if before is not None or last:
+        airports.reverse()
+        return airports, more, not last
+    return airports, after is not None, more
+
+@timed
+async def get_airport_count(exact=False):
+    '''
+    Number of airports as (count, is_exact), sharing database.py's cache.
+    '''
+    cached = database._cached_airport_count(exact)
+    if cached is not None:
+        return cached
+    shared_version = database._airports_version()
+    try:
+        count = None
+        if not exact:
+            rows = await fetch("SELECT reltuples::bigint FROM pg_class WHERE oid = 'airline.airports'::regclass")
+            count = rows[0][0]
+            if count is not None and count <= 0:
+                count = None
+        is_exact = count is None
+        if count is None:
+            rows = await fetch("SELECT COUNT(*) FROM airline.airports")
+            count = rows[0][0]
+    except Exception:
+        logger.exception("Error fetching airports")
+        return None
+    database._airport_count_cache[exact] = (count, is_exact, time.monotonic(), shared_version)
+    return count, is_exact
+
+@timed
+async def get_airport_by_id(airport_id):
+    # A catalogue that is already loaded answers without a query; loading it
+    # is blocking work, so that is left to the sync side
+    snap = database.airport_catalogue.current()
+    if snap is not None:
+        try:
+            airport = snap.by_id.get(int(airport_id))
+        except (TypeError, ValueError):
+            airport = None
+        if airport is not None:
+            return airport
+    try:
+        rows = await fetch("SELECT airportid, name, iatacode, city, country FROM airports WHERE airportid = $1",
+                           int(airport_id))
+    except (TypeError, ValueError):
+        return None
+    except Exception:
+        logger.exception("Error fetching airport by ID")
+        return None
+    return rows[0] if rows else None
+
+@timed
+async def airport_summary():
+    try:
+        if await has_schema_feature('summary_tables'):
+            return await fetch("""SELECT country, airports AS count FROM airline.airport_country_counts
+            ORDER BY airports DESC""")
+        return await fetch("""SELECT country, COUNT(country) FROM airline.airports
+        GROUP BY country ORDER BY COUNT(*) DESC""")
+    except Exception:
+        return f"Error retrieving summary max"
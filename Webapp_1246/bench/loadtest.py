@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# Load test, run from the Webapp_1246 folder against a running app:
+#   python3 -m bench.loadtest --sessions 16 --duration 60
+#   python3 -m bench.loadtest --compare bench/results/<earlier run>.json
+import argparse
+import configparser
+import datetime
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from bench.seed import DEFAULT_WORKDIR, city_name, iata_code
+
+################################################################################
+# Load test
+#   - Each simulated session logs in with its own cookies, then keeps
+#     picking an operation from MIX (airport pages, searches, an update, a
+#     removal) until the time is up, like a user clicking through the site
+#   - Every operation (one to three requests) is timed on its own; redirects
+#     are not followed, so a form post is measured without the page it
+#     redirects to
+#   - Results (requests per second and latency percentiles per operation)
+#     are written as JSON together with the git commit, so runs of two
+#     versions can be compared with --compare
+#   - Removals only pick airports from the session's own share of the ids,
+#     sessions never race each other for the same airport
+################################################################################
+
+DEFAULT_RESULTS = os.path.join('bench', 'results')
+
+# operation -> relative weight
+MIX = {
+    'airports_first_page': 20,
+    'airports_next_pages': 20,
+    'airports_last_page': 5,
+    'airport_summary': 5,
+    'search_airports': 15,
+    'search_users': 10,
+    'suggest_airports': 15,
+    'update_airport': 7,
+    'remove_airport': 3,
+}
+
+# How many pages airports_next_pages follows
+NEXT_PAGES = 3
+
+PERCENTILES = (50, 90, 95, 99)
+
+# a slower p95 than this (percent) is reported as a regression by --compare
+REGRESSION_PERCENT = 10.0
+
+# The app can only address airports with three letter codes
+MAX_CODED_AIRPORT = 26 ** 3
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Session:
+    """One simulated user: a cookie jar and the numbers it has to pick from."""
+
+    def __init__(self, base_url, seed, index, sessions, rng, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.seed = seed
+        self.rng = rng
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+        # this session's share of the airports it may remove
+        coded = min(seed['airports'], MAX_CODED_AIRPORT)
+        share = max(1, coded // sessions)
+        self.removable = list(range(index * share + 1, min(coded, (index + 1) * share) + 1))
+        rng.shuffle(self.removable)
+
+    def request(self, path, data=None):
+        '''
+        One request, returns (status, Location header, body). Redirects and
+        4xx answers come back as their status, only 5xx and network errors
+        raise.
+        '''
+        body = None if data is None else urllib.parse.urlencode(data, doseq=True).encode()
+        req = urllib.request.Request(self.base_url + path, data=body)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.headers.get('Location'), response.read()
+        except urllib.error.HTTPError as e:
+            if e.code >= 500:
+                raise
+            return e.code, e.headers.get('Location'), e.read()
+
+    def login(self):
+        userid = f"user{self.rng.randint(1, self.seed['users'])}"
+        status, location, _ = self.request('/login', {'userid': userid, 'password': self.seed['password']})
+        if status != 302 or location is None or location.rstrip('/').endswith('/login'):
+            raise RuntimeError(f"login as {userid} failed ({status})")
+
+    def random_airport(self):
+        return self.rng.randint(1, min(self.seed['airports'], MAX_CODED_AIRPORT))
+
+    # The operations, named as in MIX
+
+    def airports_first_page(self):
+        self.request('/airports')
+
+    def airports_next_pages(self):
+        # follows the Next link the page itself offers
+        path = '/airports'
+        for page in range(NEXT_PAGES):
+            _, _, body = self.request(path)
+            path = _next_link(body)
+            if path is None:
+                break
+
+    def airports_last_page(self):
+        self.request('/airports?last=1')
+
+    def airport_summary(self):
+        self.request('/airports/get_summary')
+
+    def search_airports(self):
+        term = self.rng.choice([city_name(self.random_airport()),
+                                f"Airport {self.random_airport()}",
+                                iata_code(self.random_airport())])
+        self.request('/airports/search?' + urllib.parse.urlencode({'q': term}))
+
+    def search_users(self):
+        term = self.rng.choice(['smith', 'olivia', 'nguy', f"user{self.rng.randint(1, self.seed['users'])}"])
+        self.request('/users/search?' + urllib.parse.urlencode({'searchfield': 'any', 'searchterm': term}))
+
+    def suggest_airports(self):
+        # what the type-ahead asks while a code or name is typed
+        name = f"bench airport {self.random_airport()}"
+        self.request('/api/airports/suggest?' + urllib.parse.urlencode({'q': name[:self.rng.randint(1, len(name))]}))
+
+    def update_airport(self):
+        code = iata_code(self.random_airport())
+        self.request('/airports/update_city/', {'iatacode': code})
+        # moves the airport to another of the seeded cities
+        self.request('/airports/update_city/',
+                     {'iatacode': code, 'new_city': city_name(self.rng.randint(1, self.seed['airports']))})
+
+    def remove_airport(self):
+        if not self.removable:
+            return False
+        code = iata_code(self.removable.pop())
+        # the confirmation page, then the removal (refused if it has upcoming flights)
+        self.request('/airports/remove/', {'iatacode': code})
+        self.request('/airports/remove/final/', {'iatacode': code})
+
+
+def _next_link(body):
+    # the href of the pagination's Next link, if there is one
+    text = body.decode('utf-8', 'replace')
+    at = text.find('>Next')
+    if at < 0:
+        return None
+    start = text.rfind('href="', 0, at)
+    if start < 0:
+        return None
+    start += len('href="')
+    return text[start:text.find('"', start)].replace('&amp;', '&')
+
+
+class Recorder:
+    """Latencies and errors per operation, shared by the session threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.error_samples = []
+
+    def record(self, operation, seconds, error=None):
+        with self.lock:
+            if error is None:
+                self.latencies.setdefault(operation, []).append(seconds)
+            else:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+                if len(self.error_samples) < 20:
+                    self.error_samples.append(f"{operation}: {error}")
+
+
+def run_session(base_url, seed, index, sessions, args, recorder, deadline):
+    rng = random.Random(args.random_seed * 1000 + index)
+    session = Session(base_url, seed, index, sessions, rng, args.timeout)
+    start = time.perf_counter()
+    try:
+        session.login()
+        recorder.record('login', time.perf_counter() - start)
+    except Exception as e:
+        recorder.record('login', time.perf_counter() - start, error=e)
+        return
+    operations = list(MIX)
+    weights = [MIX[op] for op in operations]
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        start = time.perf_counter()
+        try:
+            # False: nothing left to do, e.g. no airports left to remove
+            if getattr(session, operation)() is not False:
+                recorder.record(operation, time.perf_counter() - start)
+        except Exception as e:
+            recorder.record(operation, time.perf_counter() - start, error=e)
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+def percentile(ordered, p):
+    # nearest rank
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarise(recorder, elapsed):
+    operations = {}
+    for operation in sorted(set(recorder.latencies) | set(recorder.errors)):
+        times = sorted(recorder.latencies.get(operation, []))
+        stats = {
+            'count': len(times),
+            'errors': recorder.errors.get(operation, 0),
+            'per_second': round(len(times) / elapsed, 2),
+        }
+        if times:
+            stats['mean_ms'] = round(sum(times) / len(times) * 1000, 2)
+            for p in PERCENTILES:
+                stats[f'p{p}_ms'] = round(percentile(times, p) * 1000, 2)
+            stats['max_ms'] = round(times[-1] * 1000, 2)
+        operations[operation] = stats
+    every = sorted(t for times in recorder.latencies.values() for t in times)
+    total = {
+        'count': len(every),
+        'errors': sum(recorder.errors.values()),
+        'per_second': round(len(every) / elapsed, 2),
+    }
+    for p in PERCENTILES:
+        if every:
+            total[f'p{p}_ms'] = round(percentile(every, p) * 1000, 2)
+    return operations, total
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    '''
+    Print each operation's throughput and p95 against an earlier result.
+    Returns the operations whose p95 got more than REGRESSION_PERCENT slower.
+    '''
+    regressions = []
+    print(f"{'operation':22s} {'ops/s':>17s} {'p95 ms':>20s}")
+    for operation, stats in new['operations'].items():
+        before = old['operations'].get(operation)
+        if before is None or 'p95_ms' not in stats or 'p95_ms' not in before:
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        flag = ''
+        if change > REGRESSION_PERCENT:
+            flag = '  SLOWER'
+            regressions.append(operation)
+        print(f"{operation:22s} {before['per_second']:7.1f} -> {stats['per_second']:6.1f} "
+              f"{before['p95_ms']:8.1f} -> {stats['p95_ms']:8.1f} ({change:+.0f}%){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive the running web app with concurrent sessions')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR,
+                        help=f'written by bench.seed, holds seed.json and config.ini, default {DEFAULT_WORKDIR}')
+    parser.add_argument('--url', help='the app, default http://127.0.0.1:<[FLASK] port of the workdir config.ini>')
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to run for')
+    parser.add_argument('--think-time', type=float, default=0.0, help='average pause between operations, seconds')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds before a request counts as failed')
+    parser.add_argument('--random-seed', type=int, default=1246, help='same seed, same sequence of operations')
+    parser.add_argument('--label', help='free text stored with the results, e.g. the server mode')
+    parser.add_argument('--output', help=f'result file, default {DEFAULT_RESULTS}/<time>-<commit>.json')
+    parser.add_argument('--compare', help='an earlier result file to compare this run with')
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.workdir, 'seed.json')) as f:
+        seed = json.load(f)
+    base_url = args.url
+    if base_url is None:
+        config = configparser.ConfigParser()
+        config.read(os.path.join(args.workdir, 'config.ini'))
+        base_url = f"http://127.0.0.1:{config.get('FLASK', 'port')}"
+
+    print(f"{args.sessions} sessions for {args.duration:.0f}s against {base_url} "
+          f"({seed['airports']} airports, {seed['users']} users, {seed['flights']} flights)")
+    recorder = Recorder()
+    started_at = datetime.datetime.now()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_session, daemon=True,
+                                args=(base_url, seed, i, args.sessions, args, recorder, deadline))
+               for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    operations, total = summarise(recorder, elapsed)
+    commit = git_commit()
+    result = {
+        'commit': commit,
+        'label': args.label,
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'url': base_url,
+        'sessions': args.sessions,
+        'duration_s': round(elapsed, 2),
+        'think_time_s': args.think_time,
+        'random_seed': args.random_seed,
+        'data': {key: seed[key] for key in ('airports', 'users', 'flights', 'migrated')},
+        'total': total,
+        'operations': operations,
+        'error_samples': recorder.error_samples,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS, f"{started_at:%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    for operation, stats in operations.items():
+        print(f"{operation:22s} {stats['count']:7d} ok {stats['errors']:5d} errors  "
+              f"{stats['per_second']:7.1f}/s  p50 {stats.get('p50_ms', 0):7.1f} ms  p95 {stats.get('p95_ms', 0):7.1f} ms")
+    print(f"{'total':22s} {total['count']:7d} ok {total['errors']:5d} errors  {total['per_second']:7.1f}/s")
+    for sample in recorder.error_samples:
+        print("  error:", sample)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result)
+        if regressions:
+            print(f"p95 more than {REGRESSION_PERCENT:.0f}% slower: {', '.join(regressions)}")
+            return 1
+    return 1 if total['errors'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
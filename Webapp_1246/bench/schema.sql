@@ -0,0 +1,34 @@
+-- The parts of the airline schema the web app uses, for the benchmark
+-- database created by bench/seed.py. Not for the real database.
+CREATE SCHEMA airline;
+
+CREATE TABLE airline.userroles (
+    userroleid integer PRIMARY KEY,
+    rolename varchar(50) NOT NULL,
+    isadmin boolean NOT NULL DEFAULT false
+);
+
+CREATE TABLE airline.users (
+    userid varchar(50) PRIMARY KEY,
+    firstname varchar(100) NOT NULL,
+    lastname varchar(100) NOT NULL,
+    userroleid integer NOT NULL REFERENCES airline.userroles (userroleid),
+    password varchar(100) NOT NULL
+);
+
+CREATE TABLE airline.airports (
+    airportid integer PRIMARY KEY,
+    name varchar(100) NOT NULL,
+    iatacode varchar(8) NOT NULL,
+    city varchar(100) NOT NULL,
+    country varchar(100) NOT NULL
+);
+
+CREATE TABLE airline.flights (
+    flightid integer PRIMARY KEY,
+    flightnum varchar(20) NOT NULL,
+    departureairportid integer NOT NULL REFERENCES airline.airports (airportid),
+    arrivalairportid integer NOT NULL REFERENCES airline.airports (airportid),
+    departuretime timestamp NOT NULL,
+    arrivaltime timestamp NOT NULL
+);
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# Benchmark database, run from the Webapp_1246 folder:
+#   python3 -m bench.seed --scale 100000
+# then start the app on it and run bench.loadtest, see the readme
+import argparse
+import configparser
+import json
+import os
+import time
+import pg8000
+import migrations
+from hashing import hash_password_now
+from settings import CONFIG_FILE, get_settings, request_reload
+
+################################################################################
+# Benchmark data
+#   - Creates a throwaway database next to the real one (same server and
+#     login from config.ini), loads bench/schema.sql and fills it with
+#     synthetic users, airports and flights, 10 thousand to 10 million rows
+#   - Rows are generated by the database server (generate_series), so even
+#     the largest scale loads without sending every row over the connection
+#   - The data only depends on the scale: two runs at the same scale get
+#     the same rows, so their results can be compared
+#   - Writes <workdir>/config.ini pointing at the new database and
+#     <workdir>/seed.json describing it for bench.loadtest
+################################################################################
+
+DEFAULT_DATABASE = 'airline_bench'
+DEFAULT_WORKDIR = os.path.join('bench', 'run')
+BENCH_PASSWORD = 'bench'
+
+FIRST_NAMES = ['Olivia', 'Noah', 'Amelia', 'Jack', 'Isla', 'William', 'Mia', 'Oliver',
+               'Ava', 'Leo', 'Grace', 'Henry', 'Chloe', 'Lucas', 'Zoe', 'Thomas']
+LAST_NAMES = ['Smith', 'Jones', 'Williams', 'Brown', 'Wilson', 'Taylor', 'Nguyen', 'Johnson',
+              'Martin', 'White', 'Anderson', 'Walker', 'Thompson', 'Lee', 'Harris', 'Ryan']
+COUNTRIES = ['Australia', 'New Zealand', 'United States', 'Canada', 'United Kingdom', 'France',
+             'Germany', 'Japan', 'China', 'India', 'Indonesia', 'Singapore', 'Brazil', 'Mexico',
+             'South Africa', 'Spain', 'Italy', 'Chile', 'Argentina', 'Fiji']
+
+# One city per this many airports, so a city search matches a handful
+AIRPORTS_PER_CITY = 10
+
+# Flights are spread over the last two years and the next 30 days; the
+# ones still to come block removing their airports, as in real data
+FLIGHT_WINDOW_DAYS = 760
+FUTURE_DAYS = 30
+
+
+def iata_code(airportid):
+    '''
+    The IATA code bench airports get: airport 1 is AAA, 2 is AAB and so on.
+    The first 17576 have real looking three letter codes, later ones are
+    longer (the app can not pick those, they only pad the table).
+    '''
+    n = airportid - 1
+    letters = ''
+    while n or len(letters) < 3:
+        letters = chr(65 + n % 26) + letters
+        n //= 26
+    return letters
+
+
+def city_name(airportid):
+    '''
+    The city of a bench airport: airports 1-9 are in City Aaa, 10-19 in
+    City Aab and so on. Letters only, so the update pages accept them too.
+    '''
+    return 'City ' + iata_code(airportid // AIRPORTS_PER_CITY + 1).title()
+
+
+# The same as iata_code(), run by the server
+IATA_CODE_FUNCTION = """
+CREATE FUNCTION pg_temp.bench_code(id bigint) RETURNS text LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    n bigint := id - 1;
+    letters text := '';
+BEGIN
+    WHILE n > 0 OR length(letters) < 3 LOOP
+        letters := chr(65 + mod(n, 26)::int) || letters;
+        n := n / 26;
+    END LOOP;
+    RETURN letters;
+END $$"""
+
+
+def sql_array(values):
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def _connect(config, database):
+    return pg8000.connect(database=database, user=config.db_user, password=config.db_password,
+                          host=config.db_host, port=config.db_port)
+
+
+def recreate_database(config, name):
+    # CREATE / DROP DATABASE can not run in a transaction
+    conn = _connect(config, 'postgres')
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        cur.close()
+        conn.close()
+
+
+def load_data(config, name, users, airports, flights, hash_rounds, progress):
+    conn = _connect(config, name)
+    cur = conn.cursor()
+    try:
+        with open(os.path.join(os.path.dirname(__file__), 'schema.sql')) as f:
+            cur.execute(f.read())
+        cur.execute(IATA_CODE_FUNCTION)
+
+        progress('userroles', 2)
+        cur.execute("""INSERT INTO airline.userroles (userroleid, rolename, isadmin)
+                       VALUES (1, 'Admin', true), (2, 'Viewer', false)""")
+
+        # Every bench user has the same password; one hash is enough
+        hashed = hash_password_now(BENCH_PASSWORD, hash_rounds)
+        progress('users', users)
+        cur.execute(f"""
+            INSERT INTO airline.users (userid, firstname, lastname, userroleid, password)
+            SELECT 'user' || g,
+                   ({sql_array(FIRST_NAMES)})[1 + mod(g, {len(FIRST_NAMES)})],
+                   ({sql_array(LAST_NAMES)})[1 + mod(g / {len(FIRST_NAMES)}, {len(LAST_NAMES)})] || mod(g, 97),
+                   CASE WHEN mod(g, 10) = 0 THEN 1 ELSE 2 END,
+                   %s
+            FROM generate_series(1::bigint, {users}) g""", (hashed,))
+
+        progress('airports', airports)
+        cur.execute(f"""
+            INSERT INTO airline.airports (airportid, name, iatacode, city, country)
+            SELECT g,
+                   'Bench Airport ' || g,
+                   pg_temp.bench_code(g),
+                   'City ' || initcap(pg_temp.bench_code(g / {AIRPORTS_PER_CITY} + 1)),
+                   ({sql_array(COUNTRIES)})[1 + mod(g, {len(COUNTRIES)})]
+            FROM generate_series(1::bigint, {airports}) g""")
+
+        progress('flights', flights)
+        cur.execute(f"""
+            INSERT INTO airline.flights (flightid, flightnum, departureairportid, arrivalairportid,
+                                         departuretime, arrivaltime)
+            SELECT g, 'BA' || g, dep, 1 + mod(dep + mod(g * 31, {airports - 1}), {airports}),
+                   t, t + interval '1 hour' * (1 + mod(g, 12))
+            FROM (SELECT g,
+                         1 + mod(g * 7919, {airports}) AS dep,
+                         date_trunc('minute', LOCALTIMESTAMP)
+                           - interval '1 day' * {FLIGHT_WINDOW_DAYS - FUTURE_DAYS}
+                           + interval '1 minute' * mod(g * 104729, {FLIGHT_WINDOW_DAYS * 24 * 60}) AS t
+                  FROM generate_series(1::bigint, {flights}) g) f""")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    # planner statistics for the new rows, outside a transaction
+    conn = _connect(config, name)
+    conn.autocommit = True
+    try:
+        conn.cursor().execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def write_workdir(workdir, name, description):
+    '''
+    A copy of config.ini pointing at the bench database, so the app (and
+    manage.py) can be started from workdir against it.
+    '''
+    os.makedirs(workdir, exist_ok=True)
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    config['DATABASE']['database'] = name
+    with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+        config.write(f)
+    with open(os.path.join(workdir, 'seed.json'), 'w') as f:
+        json.dump(description, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create and fill the benchmark database')
+    parser.add_argument('--scale', type=int, default=10000,
+                        help='airports and users to create (default 10000), flights are 5 times that')
+    parser.add_argument('--airports', type=int, help='override the number of airports')
+    parser.add_argument('--users', type=int, help='override the number of users')
+    parser.add_argument('--flights', type=int, help='override the number of flights')
+    parser.add_argument('--database', default=DEFAULT_DATABASE,
+                        help=f'database to (re)create, default {DEFAULT_DATABASE}')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR,
+                        help=f'where config.ini and seed.json for the run go, default {DEFAULT_WORKDIR}')
+    parser.add_argument('--hash-rounds', type=int, help='bcrypt cost of the user passwords, default [LOGIN] hash_rounds')
+    parser.add_argument('--no-migrate', action='store_true',
+                        help='leave out the schema migrations (indexes, summary tables)')
+    args = parser.parse_args(argv)
+
+    config = get_settings()
+    if args.database == config.db_name:
+        parser.error(f"{args.database} is the database in {CONFIG_FILE}, it would be dropped")
+    airports = args.airports or args.scale
+    users = args.users or args.scale
+    flights = args.flights if args.flights is not None else args.scale * 5
+    if airports < 2 or users < 1 or flights < 0:
+        parser.error("need at least 2 airports and 1 user")
+
+    start = time.perf_counter()
+
+    def progress(table, rows):
+        print(f"[{time.perf_counter() - start:7.1f}s] {table}: {rows} rows")
+
+    print(f"Recreating database {args.database}")
+    recreate_database(config, args.database)
+    load_data(config, args.database, users, airports, flights,
+              args.hash_rounds or config.hash_rounds, progress)
+    write_workdir(args.workdir, args.database, {
+        'database': args.database,
+        'users': users,
+        'airports': airports,
+        'flights': flights,
+        'password': BENCH_PASSWORD,
+        'migrated': not args.no_migrate,
+        'seeded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+
+    if not args.no_migrate:
+        # migrations connects through config.ini, use the one just written
+        os.chdir(args.workdir)
+        # the settings cache still holds the config.ini read at start up
+        request_reload()
+        if get_settings().db_name != args.database:
+            print(f"{args.workdir}/{CONFIG_FILE} does not point at {args.database}, not migrating")
+            return 1
+        try:
+            migrations.migrate(progress=lambda version, name, statement:
+                               print(f"[{time.perf_counter() - start:7.1f}s] migration {version}: {name}"))
+        except migrations.MigrationError as e:
+            print(e)
+            return 1
+    print(f"Done in {time.perf_counter() - start:.1f}s. Start the app from {args.workdir}, "
+          f"then run: python3 -m bench.loadtest --workdir {args.workdir}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
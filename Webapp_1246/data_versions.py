@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Imports
+import multiprocessing
+import time
+from settings import get_settings
+
+################################################################################
+# Data versions
+#   - One counter per kind of data, bumped by every function in database.py
+#     that writes it; pages built from that data are unchanged for as long
+#     as its counter is (see http_cache.py)
+#   - The counters live in shared memory made when this module is imported.
+#     gunicorn imports the app before forking (preload_app), so all of its
+#     workers share them and see each other's writes
+#   - Writes made by other programs (manage.py, psql) are not counted;
+#     stamp() also changes every [CACHE] catalogue_ttl seconds so those show
+#     up as late as the airport catalogue would
+################################################################################
+
+KINDS = ('airports', 'users')
+
+_counters = {kind: multiprocessing.Value('q', 0) for kind in KINDS}
+# when each kind last changed, for Last-Modified; start up counts as a change
+_changed_at = {kind: multiprocessing.Value('d', time.time()) for kind in KINDS}
+
+
+def bump(kind):
+    """Record that kind was written."""
+    counter = _counters[kind]
+    with counter.get_lock():
+        counter.value += 1
+        _changed_at[kind].value = time.time()
+
+
+def current(kinds):
+    '''
+    The versions of kinds and the last time any of them changed.
+    Returns ((version, ...), changed_at).
+    '''
+    return (tuple(_counters[kind].value for kind in kinds),
+            max(_changed_at[kind].value for kind in kinds))
+
+
+def stamp(kinds):
+    """What anything cached from kinds of data is keyed by: their versions and the catalogue_ttl period."""
+    versions, _ = current(kinds)
+    return versions + (int(time.time() // max(1.0, get_settings().cache_catalogue_ttl)),)
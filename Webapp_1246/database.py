@@ -1,68 +1,326 @@
 #!/usr/bin/env python3
 # Imports
 import pg8000
-import configparser
-import sys
-import bcrypt
-from datetime import datetime
+import atexit
+import collections
+import contextlib
+import csv
+import functools
+import io
+import logging
+import operator
+import threading
+import time
+import data_versions
+from settings import get_settings, on_reload
+from metrics import timed, register_gauge
+from validation import AIRPORT_FIELDS, clean_airport_field
+from hashing import check_password, hash_password, HashingBusy, HashingTimeout
+
+logger = logging.getLogger('airline.database')
+# statements logged because query debugging was switched on
+sql_logger = logging.getLogger('airline.sql')
 
 #  Common Functions
+##     open_connection()
+##     ConnectionPool, get_pool(), close_pool()
 ##     database_connect()
+##     Row, fetch_rows(cursor), fetch_row(cursor)
 ##     dictfetchall(cursor,sqltext,params)
 ##     dictfetchone(cursor,sqltext,params)
-##     print_sql_string(inputstring, params)
+##     stream_rows(sqltext,params,batch_size)
+##     log_sql(sqltext, params)
+##     debug_queries()
 
 
 ################################################################################
 # Connect to the database
-#   - This function reads the config file and tries to connect
-#   - This is the main "connection" function used to set up our connection
+#   - This function takes the settings from config.ini and tries to connect
+#   - It is only used by the connection pool below to open new connections,
+#     everything else borrows a connection through database_connect()
 ################################################################################
 
-def database_connect():
-    # Read the config file
-    config = configparser.ConfigParser()
-    config.read('config.ini')
+def open_connection():
+    # The settings are read from config.ini once and cached
+    config = get_settings()
 
-    # Create a connection to the database
-    connection = None
+    '''
+    This is doing a couple of things in the back
+    what it is doing is:
 
-    # choose a connection target, you can use the default or
-    # use a different set of credentials that are setup for localhost or winhost
-    connectiontarget = 'DATABASE'
-    try:
-        '''
-        This is doing a couple of things in the back
-        what it is doing is:
-
-        connect(database='y2?i2120_unikey',
-            host='awsprddbs4836.shared.sydney.edu.au,
-            password='password_from_config',
-            user='y2?i2120_unikey')
-        '''
-        targetdb = ""
-        if ('database' in config[connectiontarget]):
-            targetdb = config[connectiontarget]['database']
-        else:
-            targetdb = config[connectiontarget]['user']
-
-        connection = pg8000.connect(database=targetdb,
-                                    user=config[connectiontarget]['user'],
-                                    password=config[connectiontarget]['password'],
-                                    host=config[connectiontarget]['host'],
-                                    port=int(config[connectiontarget]['port']))
-        connection.run("SET SCHEMA 'airline';")
+    connect(database='y2?i2120_unikey',
+        host='awsprddbs4836.shared.sydney.edu.au,
+        password='password_from_config',
+        user='y2?i2120_unikey')
+    '''
+    connection = pg8000.connect(database=config.db_name,
+                                user=config.db_user,
+                                password=config.db_password,
+                                host=config.db_host,
+                                port=config.db_port)
+    # The schema only has to be set once per connection. Commit straight away
+    # so a later rollback by one of the borrowers can not undo it.
+    connection.run("SET SCHEMA 'airline';")
+    connection.commit()
+    return connection
+
+
+################################################################################
+# Connection pool
+#   - Opening a connection (TCP + auth + SET SCHEMA) costs far more than most
+#     of our queries, so connections are kept open and handed out again
+#   - database_connect() borrows a connection, calling close() on it gives
+#     it back to the pool instead of closing the socket
+################################################################################
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class PooledConnection:
+    """
+    A borrowed connection. Behaves like the pg8000 connection it wraps,
+    except that close() gives it back to the pool.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def close(self):
+        # closing twice must not return the same connection twice
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    def cursor(self):
+        # every statement run through the pool is timed, see TimedCursor
+        if self._raw is None:
+            raise pg8000.InterfaceError("connection has been returned to the pool")
+        return TimedCursor(self._raw.cursor())
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise pg8000.InterfaceError("connection has been returned to the pool")
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pg8000 connections.
+
+    minsize      - connections kept open even when idle
+    maxsize      - hard limit on open connections, borrowers wait beyond it
+    idle_timeout - seconds an idle connection (above minsize) is kept around
+    check_after  - connections idle for longer than this are pinged on checkout
+    timeout      - seconds to wait for a free connection before giving up
+    """
+
+    def __init__(self, connect, minsize=1, maxsize=10, idle_timeout=300,
+                 check_after=30, timeout=10):
+        if minsize < 0 or maxsize < 1 or minsize > maxsize:
+            raise ValueError(f"invalid pool size min={minsize} max={maxsize}")
+        self._connect = connect
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+        # idle connections as (connection, time it was returned), the most
+        # recently used on the right so busy connections stay warm
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def fill(self):
+        """Open connections until minsize of them exist."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minsize:
+                    return
+                self._size += 1
+            try:
+                raw = self._connect()
+            except Exception:
+                self._forget()
+                raise
+            with self._cond:
+                self._idle.append((raw, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            raw = None
+            idle_since = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise pg8000.InterfaceError("connection pool is closed")
+                    self._reap_idle()
+                    if self._idle:
+                        raw, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxsize:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"no free connection after {self.timeout}s "
+                                          f"({self.maxsize} in use)")
+                    self._cond.wait(remaining)
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                return PooledConnection(self, raw)
+
+            # Only ping connections that sat around long enough to have been
+            # dropped by the server or a firewall
+            if time.monotonic() - idle_since < self.check_after or self._healthy(raw):
+                return PooledConnection(self, raw)
+            self._discard(raw)
+
+    def release(self, raw):
+        try:
+            # Never hand out a connection that is still inside a transaction
+            raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(raw)
+            else:
+                self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Close every idle connection, borrowed ones are closed when returned."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                raw, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(raw)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'size': self._size,
+                    'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle),
+                    'maxsize': self.maxsize}
+
+    def _reap_idle(self):
+        # The oldest connections sit on the left. Caller holds the lock.
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.minsize and self._idle[0][1] < cutoff:
+            raw, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_quietly(raw)
+
+    def _healthy(self, raw):
+        try:
+            cur = raw.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            cur.close()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process wide pool, creating it from the settings on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(open_connection, **get_settings().pool_options())
+                try:
+                    pool.fill()
+                except Exception as e:
+                    # Not fatal, database_connect() reports it on first use
+                    logger.warning("Could not pre-open pool connections: %s", e)
+                _pool = pool
+    return _pool
+
+def close_pool():
+    """Close the pool, e.g. on shutdown. The next database_connect() opens a new one."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+atexit.register(close_pool)
+
+def forget_pool():
+    '''
+    Drop the pool without closing its connections. For a freshly forked
+    worker: the sockets belong to the parent, closing them here would end
+    the parent's sessions. The worker opens its own pool on first use.
+    '''
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+def _pool_stats():
+    pool = _pool
+    stats = pool.stats() if pool is not None else {'idle': 0, 'in_use': 0}
+    return {'idle': stats['idle'], 'in_use': stats['in_use']}
+
+register_gauge('airline_db_pool_connections', 'Open pooled database connections', _pool_stats)
+
+@on_reload
+def _settings_changed(old, new):
+    # Connections made with the old credentials or pool sizes are dropped,
+    # the next database_connect() builds a pool from the new settings
+    if (old.database_target() != new.database_target()
+            or old.pool_options() != new.pool_options()):
+        close_pool()
+
+
+@timed
+def database_connect():
+    # Borrow a connection from the pool, callers hand it back with conn.close()
+    connection = None
+    try:
+        connection = get_pool().acquire()
     except pg8000.OperationalError as e:
-        print("""Error, you haven't updated your config.ini or you have a bad
-        connection, please try again. (Update your files first, then check
-        internet connection)
-        """)
-        print(e)
+        logger.error("Error, you haven't updated your config.ini or you have a bad "
+                     "connection, please try again. (Update your files first, then check "
+                     "internet connection): %s", e)
     except pg8000.ProgrammingError as e:
-        print("""Error, config file incorrect: check your password and username""")
-        print(e)
+        logger.error("Error, config file incorrect: check your password and username: %s", e)
     except Exception as e:
-        print(e)
+        logger.error("Could not get a database connection: %s", e)
 
     # Return the connection to use
     return connection
@@ -70,134 +328,357 @@ def database_connect():
 ######################################
 # Database Helper Functions
 ######################################
+
+class Row(tuple):
+    """
+    One result row. It is a plain tuple (row[0], unpacking, comparison) that
+    also allows row['name'], row.name and row.get('name'). The column names
+    are stored once on a class shared by every row of the same result shape,
+    so a row costs no more memory than a tuple.
+
+    row.count or row.index give the column of that name when there is one,
+    not the tuple method. Columns called get, keys or items, or starting with
+    an underscore, are only reachable as row['name'].
+    """
+    __slots__ = ()
+    _columns = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._columns
+
+    def items(self):
+        return zip(self._columns, self)
+
+    def _asdict(self):
+        return dict(zip(self._columns, self))
+
+    def __repr__(self):
+        return 'Row(' + ', '.join(f'{c}={v!r}' for c, v in zip(self._columns, self)) + ')'
+
+
+# Row's own methods, a column of the same name does not hide them
+_ROW_METHODS = frozenset(('get', 'keys', 'items'))
+
+@functools.lru_cache(maxsize=256)
+def row_class(columns):
+    """The Row subclass for a tuple of column names, made once per result shape."""
+    # with duplicate names (e.g. the join column of SELECT *) the first one wins
+    index = {}
+    for i, name in enumerate(columns):
+        index.setdefault(name, i)
+    namespace = {'__slots__': (), '_columns': columns, '_index': index}
+    # one property per column, found before tuple attributes such as count
+    # (__getattr__ is only asked when normal lookup fails)
+    for name, i in index.items():
+        if name.isidentifier() and not name.startswith('_') and name not in _ROW_METHODS:
+            namespace[name] = property(operator.itemgetter(i))
+    return type('Row', (Row,), namespace)
+
+def fetch_rows(cursor):
+    """ Returns the rows of an executed query as a list of Row."""
+    if cursor.description is None:
+        return []
+    make = row_class(tuple(a[0] for a in cursor.description))
+    return [make(row) for row in cursor.fetchall()]
+
+def fetch_row(cursor):
+    """ Returns the next row of an executed query as a Row, or None."""
+    if cursor.description is None:
+        return None
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row_class(tuple(a[0] for a in cursor.description))(row)
+
 def dictfetchall(cursor,sqltext,params=[]):
-    """ Returns query results as list of dictionaries."""
+    """ Returns query results as a list of Row (index, key or attribute access)."""
     """ Useful for read queries that return 1 or more rows"""
 
-    result = []
-    
     cursor.execute(sqltext,params)
-    if cursor.description is not None:
-        cols = [a[0] for a in cursor.description]
-        
-        returnres = cursor.fetchall()
-        if returnres is not None or len(returnres > 0):
-            for row in returnres:
-                result.append({a:b for a,b in zip(cols, row)})
-
-    print("returning result: ",result)
-    return result
+    return fetch_rows(cursor)
 
 def dictfetchone(cursor,sqltext,params=None):
-    """ Returns query results as list of dictionaries."""
+    """ Returns query results as a list holding at most one Row."""
     """ Useful for create, update and delete queries that only need to return one row"""
 
-    result = []
     cursor.execute(sqltext,params)
-    if (cursor.description is not None):
-        print("cursor description", cursor.description)
-        cols = [a[0] for a in cursor.description]
-        returnres = cursor.fetchone()
-        print("returnres: ", returnres)
-        if (returnres is not None):
-            result.append({a:b for a,b in zip(cols, returnres)})
-    return result
+    row = fetch_row(cursor)
+    return [] if row is None else [row]
+
+def stream_rows(sqltext, params=(), batch_size=1000):
+    """ Yields (column names, list of rows) one batch at a time."""
+    """ Uses a server-side cursor, so only one batch is ever held in memory"""
+
+    conn = database_connect()
+    if conn is None:
+        raise pg8000.InterfaceError("Failed to connect to the database.")
+    cur = conn.cursor()
+    try:
+        # DECLARE only works inside a transaction, which pg8000 starts for us
+        cur.execute("DECLARE stream_cursor NO SCROLL CURSOR FOR " + sqltext, params)
+        while True:
+            cur.execute("FETCH FORWARD %s FROM stream_cursor" % int(batch_size))
+            rows = fetch_rows(cur)
+            if not rows:
+                break
+            yield rows[0].keys(), rows
+    finally:
+        # also runs when the consumer stops early (e.g. the client went away);
+        # returning the connection rolls back, which closes the cursor
+        cur.close()
+        conn.close()
+
+# Optional parts of the schema added by manage.py migrate, and how to tell
+# whether they are there
+SCHEMA_FEATURES = {
+    'pg_trgm': "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')",
+    'summary_tables': """SELECT to_regclass('airline.airport_country_counts') IS NOT NULL
+                            AND to_regclass('airline.user_role_counts') IS NOT NULL""",
+}
+
+# name -> (present, time checked)
+_schema_feature_cache = {}
+
+def has_schema_feature(cur, name):
+    """True if the migration that adds this feature was run, checked once per [CACHE] catalogue_ttl."""
+    cached = _schema_feature_cache.get(name)
+    if cached is not None and time.monotonic() - cached[1] < get_settings().cache_catalogue_ttl:
+        return cached[0]
+    cur.execute(SCHEMA_FEATURES[name])
+    present = cur.fetchone()[0]
+    _schema_feature_cache[name] = (present, time.monotonic())
+    return present
+
 
 ##################################################
-# Print a SQL string to see how it would insert  #
+# Query logging                                  #
+#   - Every query goes through TimedCursor, which #
+#     only logs slow or failing statements        #
+#   - Full SQL text (with parameters) is only     #
+#     built when query debugging is switched on   #
 ##################################################
 
-def print_sql_string(inputstring, params=None):
+class SqlText:
     """
-    Prints out a string as a SQL string parameterized assuming all strings
+    Formats a statement with its parameters filled in, but only when it is
+    actually written to the log.
     """
-    if params is not None:
-        if params != []:
-           inputstring = inputstring.replace("%s","'%s'")
-    
-    print(inputstring % params)
+
+    def __init__(self, sqltext, params=None):
+        self.sqltext = sqltext
+        self.params = params
+
+    def __str__(self):
+        text = " ".join(self.sqltext.split())
+        if self.params:
+            try:
+                return text.replace("%s", "'%s'") % tuple(self.params)
+            except (TypeError, ValueError):
+                return f"{text} -- params {self.params!r}"
+        return text
+
+
+_query_debug = threading.local()
+
+@contextlib.contextmanager
+def debug_queries():
+    """Log every statement run by this thread inside the with block."""
+    previous = getattr(_query_debug, 'enabled', False)
+    _query_debug.enabled = True
+    try:
+        yield
+    finally:
+        _query_debug.enabled = previous
+
+def query_debug_enabled():
+    return getattr(_query_debug, 'enabled', False) or get_settings().log_queries
+
+def log_sql(sqltext, params=None):
+    """
+    Logs a SQL string parameterized assuming all strings, if query debugging is on
+    """
+    if query_debug_enabled():
+        sql_logger.info("SQL: %s", SqlText(sqltext, params))
+
+
+class TimedCursor:
+    """Wraps a pg8000 cursor and logs statements that fail or are slow."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def execute(self, operation, args=(), stream=None):
+        start = time.perf_counter()
+        try:
+            if stream is None:
+                return self._raw.execute(operation, args)
+            return self._raw.execute(operation, args, stream=stream)
+        except Exception as e:
+            elapsed = (time.perf_counter() - start) * 1000
+            # parameters may hold passwords, they are only logged when debugging
+            logger.error("Query failed after %.1f ms: %s (%s)", elapsed,
+                         SqlText(operation, args if query_debug_enabled() else None), e)
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            if elapsed >= get_settings().log_slow_query_ms:
+                logger.warning("Slow query (%.1f ms): %s", elapsed, SqlText(operation))
+            if query_debug_enabled():
+                sql_logger.info("SQL (%.1f ms): %s", elapsed, SqlText(operation, args))
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
 
 ###############
 # Login       #
 ###############
 
+@timed
 def check_login(username, password):
     '''
     Check Login given a username and password
     '''
     # Ask for the database connection, and get the cursor set up
     conn = database_connect()
-    print("checking login")
 
     if conn is None:
         return None
     cur = conn.cursor()
 
     try:
+        # Only the user row comes from the database, the role is cached
         sql = """SELECT *
                 FROM Users
-                    JOIN UserRoles ON
-                        (Users.userroleid = UserRoles.userroleid)
                 WHERE userid = %s"""
-        print_sql_string(sql, (username,))
+        log_sql(sql, (username,))
         
         result = dictfetchone(cur, sql, (username,))  # Fetch the first row
-        
-        if result:
-            # part changed from
-            user_data = result[0]  # Get the first (and only) dictionary from the list
-            stored_password = user_data['password']  # Access password using key
-            
-            # Check if the entered password matches the stored hashed password
-            if bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
-                return result 
-            # part changed ended 
-            else:
-                print("Invalid password")
-                return None
-        else:
-            print("User not found")
-            return None
-
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print("Error Invalid Login")
+        logger.exception("Error Invalid Login")
+        return None
     finally:
+        # give the connection back before the (slow) password check
         cur.close()                     
         conn.close()                    
-    
-    return None
 
+    if not result:
+        logger.debug("User not found: %s", username)
+        return None
+
+    user_data = result[0]  # Get the first (and only) row from the list
+    role = None
+    for item in list_userroles() or []:
+        if item['userroleid'] == user_data['userroleid']:
+            role = item
+    if role is None:
+        logger.error("User %s has unknown userroleid %s", username, user_data['userroleid'])
+        return None
 
-# helper function to hash
+    # Check if the entered password matches the stored hashed password,
+    # on the hashing pool rather than in this request thread
+    try:
+        matches = check_password(password, user_data['password'])
+    except (HashingBusy, HashingTimeout) as e:
+        logger.warning("Login for %s was not checked: %s", username, e)
+        return None
+    except Exception:
+        logger.exception("Error Invalid Login")
+        return None
 
-def hash_and_update_all_passwords():
+    if not matches:
+        logger.debug("Invalid password for %s", username)
+        return None
+
+    # Same columns as the old Users JOIN UserRoles row
+    return [row_class(user_data.keys() + role.keys())(user_data + role)]
+
+
+# helpers for the password rehash job (rehash.py)
+
+@timed
+def get_password_batch(after_userid, limit):
+    '''
+    The next users by userid, for walking the whole table in batches.
+    Returns a list of (userid, password) or None.
+    '''
     conn = database_connect()
     if conn is None:
-        return
+        return None
     cur = conn.cursor()
-
     try:
-        cur.execute("SELECT userid, password FROM Users;")
-        users = cur.fetchall()
-
-        for userid, old_password in users:
-            hashed_password = bcrypt.hashpw(old_password.encode('utf-8'), bcrypt.gensalt())
-            
-            cur.execute("UPDATE Users SET password = %s WHERE userid = %s;", (hashed_password.decode('utf-8'), userid))
-        
-        conn.commit()  
-        print("All passwords updated successfully.")
+        if after_userid is None:
+            cur.execute("SELECT userid, password FROM Users ORDER BY userid LIMIT %s", (limit,))
+        else:
+            cur.execute("SELECT userid, password FROM Users WHERE userid > %s ORDER BY userid LIMIT %s",
+                        (after_userid, limit))
+        return fetch_rows(cur)
+    except Exception:
+        logger.exception("Error fetching users to rehash")
+        return None
+    finally:
+        cur.close()
+        conn.close()
 
-    except Exception as e:
+@timed
+def update_password_batch(changes):
+    '''
+    Store new password hashes in one statement and commit.
+    changes is a list of (userid, old password, new hash); a row is left
+    alone if its password changed since it was read.
+    Returns the number of users updated, or an error string.
+    '''
+    conn = database_connect()
+    if conn is None:
+        return "Failed to connect to the database."
+    cur = conn.cursor()
+    try:
+        sql = """
+        UPDATE Users
+        SET password = v.newpassword
+        FROM (SELECT unnest(%s::text[]) AS userid,
+                     unnest(%s::text[]) AS oldpassword,
+                     unnest(%s::text[]) AS newpassword) v
+        WHERE Users.userid = v.userid AND Users.password = v.oldpassword
+        """
+        cur.execute(sql, ([c[0] for c in changes], [c[1] for c in changes], [c[2] for c in changes]))
+        updated = cur.rowcount
+        conn.commit()
+        return updated
+    except Exception:
         conn.rollback()
-        print("An error occurred:", e)
-    
+        logger.exception("Error storing rehashed passwords")
+        return "Unexpected error storing rehashed passwords"
     finally:
         cur.close()
         conn.close()
 
+def hash_and_update_all_passwords():
+    # Kept for web_app.py, the work is done by the resumable job in rehash.py
+    import rehash
+    return rehash.rehash_passwords()
+
 
 
     
@@ -206,6 +687,7 @@ def hash_and_update_all_passwords():
 ########################
 
 # Get all the rows of users and return them as a dict
+@timed
 def list_users():
     # Get the database connection and set up the cursor
     conn = database_connect()
@@ -223,14 +705,9 @@ def list_users():
         
         # Retrieve all the information we need from the query
         returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
     except:
-        # If there are any errors, we print something nice and return a null value
-        import traceback
-        traceback.print_exc()
-        print("Error Fetching from Database", sys.exc_info()[0])
+        # If there are any errors, we log something nice and return a null value
+        logger.exception("Error Fetching from Database")
 
     # Close our connections to prevent saturation
     cur.close()
@@ -240,7 +717,16 @@ def list_users():
     return returndict
     
 
+# (rows, time fetched) for list_userroles(), roles hardly ever change
+_userroles_cache = None
+
+@timed
 def list_userroles():
+    global _userroles_cache
+    cached = _userroles_cache
+    if cached is not None and time.monotonic() - cached[1] < get_settings().cache_role_ttl:
+        return cached[0]
+
     # Get the database connection and set up the cursor
     conn = database_connect()
     if(conn is None):
@@ -257,12 +743,10 @@ def list_userroles():
         
         # Retrieve all the information we need from the query
         returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
+        _userroles_cache = (returndict, time.monotonic())
     except:
-        # If there are any errors, we print something nice and return a null value
-        print("Error Fetching from Database", sys.exc_info()[0])
+        # If there are any errors, we log something nice and return a null value
+        logger.exception("Error Fetching from Database")
 
     # Close our connections to prevent saturation
     cur.close()
@@ -279,9 +763,10 @@ def list_userroles():
 # Define a set of allowed attribute names to prevent SQL injection
 ALLOWED_ATTRIBUTES = {"firstname", "lastname", "userroleid", "password", "userid"}  # Add all valid attributes here
 
+@timed
 def list_users_equifilter(attributename, filterval):
     if attributename.lower().strip() not in ALLOWED_ATTRIBUTES:
-        print(f"Invalid attribute name: {attributename}")
+        logger.warning("Invalid attribute name: %s", attributename)
         return None
     
     conn = database_connect()
@@ -299,7 +784,7 @@ def list_users_equifilter(attributename, filterval):
         val = dictfetchall(cur, sql, (filterval,))
     
     except Exception:
-        print("Error Fetching from Database: ")
+        logger.exception("Error Fetching from Database")
 
     finally:
         cur.close()
@@ -310,12 +795,67 @@ def list_users_equifilter(attributename, filterval):
     # Return the resul
     
 
+# Columns the JSON API gives out for users, never the password
+USER_PUBLIC_COLUMNS = ('userid', 'firstname', 'lastname', 'userroleid', 'rolename', 'isadmin')
+
+_USER_PUBLIC_SQL = """SELECT users.userid, users.firstname, users.lastname, users.userroleid,
+                             userroles.rolename, userroles.isadmin
+                      FROM users
+                          JOIN userroles ON (users.userroleid = userroles.userroleid)"""
+
+@timed
+def get_users_by_ids(userids):
+    '''
+    The users with any of these userids, in one query, without passwords.
+    Returns a list of Row (USER_PUBLIC_COLUMNS) or None.
+    '''
+    conn = database_connect()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    try:
+        sql = _USER_PUBLIC_SQL + " WHERE users.userid = ANY(%s) ORDER BY users.userid"
+        return dictfetchall(cur, sql, (list(userids),))
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+@timed
+def get_users_page(after=None, limit=100):
+    '''
+    Up to limit users by userid, starting after the given userid (keyset,
+    as get_airports_page()), without passwords.
+    Returns (rows, has_more) or None.
+    '''
+    conn = database_connect()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    try:
+        if after is None:
+            rows = dictfetchall(cur, _USER_PUBLIC_SQL + " ORDER BY users.userid LIMIT %s", (limit + 1,))
+        else:
+            rows = dictfetchall(cur, _USER_PUBLIC_SQL + " WHERE users.userid > %s ORDER BY users.userid LIMIT %s",
+                                (after, limit + 1))
+        return rows[:limit], len(rows) > limit
+    except Exception:
+        logger.exception("Error Fetching from Database")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
 
 ########################### 
 #List Report Items #
 ###########################
     
 # # A report with the details of Users, Userroles
+@timed
 def list_consolidated_users():
     # Get the database connection and set up the cursor
     conn = database_connect()
@@ -335,12 +875,9 @@ def list_consolidated_users():
         
         # Retrieve all the information we need from the query
         returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
     except:
-        # If there are any errors, we print something nice and return a null value
-        print("Error Fetching from Database", sys.exc_info()[0])
+        # If there are any errors, we log something nice and return a null value
+        logger.exception("Error Fetching from Database")
 
     # Close our connections to prevent saturation
     cur.close()
@@ -349,6 +886,7 @@ def list_consolidated_users():
     # return our struct
     return returndict
 
+@timed
 def list_user_stats():
     # Get the database connection and set up the cursor
     conn = database_connect()
@@ -360,20 +898,22 @@ def list_user_stats():
     returndict = None
 
     try:
-        # Set-up our SQL query
-        sql = """SELECT userroleid, COUNT(*) as count
-                FROM users 
-                    GROUP BY userroleid
-                    ORDER BY userroleid ASC ;"""
+        # Set-up our SQL query, from the trigger maintained counts if they exist
+        if has_schema_feature(cur, 'summary_tables'):
+            sql = """SELECT userroleid, users as count
+                    FROM airline.user_role_counts
+                        ORDER BY userroleid ASC ;"""
+        else:
+            sql = """SELECT userroleid, COUNT(*) as count
+                    FROM users 
+                        GROUP BY userroleid
+                        ORDER BY userroleid ASC ;"""
         
         # Retrieve all the information we need from the query
         returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
     except:
-        # If there are any errors, we print something nice and return a null value
-        print("Error Fetching from Database", sys.exc_info()[0])
+        # If there are any errors, we log something nice and return a null value
+        logger.exception("Error Fetching from Database")
 
     # Close our connections to prevent saturation
     cur.close()
@@ -383,57 +923,143 @@ def list_user_stats():
     return returndict
     
 
-####################################
-##  Search Items - inexact matches #
-####################################
+################################################################################
+# Search
+#   - Matches a term anywhere in the whitelisted columns, case-insensitive,
+#     and also close misspellings, ranked by trigram similarity
+#   - With pg_trgm installed (manage.py migrate) the GIN indexes on
+#     lower(column) answer both the LIKE and the % (similar to) tests, so a
+#     search does not scan the whole table
+#   - Without it the search still works with LIKE only, on a full scan
+#   - Only column names from the whitelists below ever reach the SQL text
+################################################################################
+
+USER_SEARCH_FIELDS = ('userid', 'firstname', 'lastname')
+AIRPORT_SEARCH_FIELDS = ('name', 'city')
 
-# Search for users with a custom filter
-# filtertype can be: '=', '<', '>', '<>', '~', 'LIKE'
-def search_users_customfilter(attributename, filtertype, filterval):
-    # Get the database connection and set up the cursor
-    conn = database_connect()
-    if(conn is None):
-        # If a connection cannot be established, send an Null object
+def _like_pattern(term):
+    # the term is matched literally, its own % and _ are not wildcards
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def _search_sql(cur, table, fields, term, extra_rank=None):
+    '''
+    The WHERE test and rank expression for a search over fields.
+    Returns (where, where_params, rank, rank_params).
+    '''
+    term = term.strip().lower()
+    pattern = _like_pattern(term)
+    trigram = has_schema_feature(cur, 'pg_trgm')
+
+    tests, test_params = [], []
+    ranks, rank_params = [], []
+    for field in fields:
+        tests.append(f"lower({table}.{field}) LIKE %s")
+        test_params.append(pattern)
+        if trigram:
+            tests.append(f"lower({table}.{field}) %% %s")
+            test_params.append(term)
+            ranks.append(f"similarity(lower({table}.{field}), %s)")
+            rank_params.append(term)
+        # exact and prefix matches go first either way
+        ranks.append(f"CASE WHEN lower({table}.{field}) = %s THEN 2 "
+                     f"WHEN lower({table}.{field}) LIKE %s THEN 1 ELSE 0 END")
+        rank_params.extend([term, _like_pattern(term)[1:]])
+    if extra_rank is not None:
+        ranks.append(extra_rank[0])
+        rank_params.extend(extra_rank[1])
+    return " OR ".join(tests), test_params, " + ".join(ranks), rank_params
+
+
+@timed
+def search_users(term, fields=None, limit=50, offset=0):
+    '''
+    Users whose userid, firstname or lastname (or just the given fields)
+    contain or resemble term, best matches first.
+    Returns (users, has_more), or None on error.
+    '''
+    fields = [f.lower().strip() for f in (fields or USER_SEARCH_FIELDS)]
+    if not term or not term.strip() or any(f not in USER_SEARCH_FIELDS for f in fields):
+        logger.warning("Invalid search: %r in %s", term, fields)
         return None
 
-    # Set up the rows as a dictionary
+    conn = database_connect()
+    if conn is None:
+        return None
     cur = conn.cursor()
-    val = None
-
-    # arrange like filter
-    filtervalprefix = ""
-    filtervalsuffix = ""
-    if str.lower(filtertype) == "like":
-        filtervalprefix = "'%"
-        filtervalsuffix = "%'"
-        
     try:
-        # Retrieve all the information we need from the query
-        sql = f"""SELECT *
-                    FROM users
-                    WHERE lower({attributename}) {filtertype} {filtervalprefix}lower(%s){filtervalsuffix} """
-        print_sql_string(sql, (filterval,))
-        val = dictfetchall(cur,sql,(filterval,))
-    except:
-        # If there are any errors, we print something nice and return a null value
-        import traceback
-        traceback.print_exc()
-        print("Error Fetching from Database: ", sys.exc_info()[0])
+        where, where_params, rank, rank_params = _search_sql(cur, 'users', fields, term)
+        sql = f"""SELECT users.*, {rank} AS rank
+                  FROM users
+                  WHERE {where}
+                  ORDER BY rank DESC, users.userid
+                  LIMIT %s OFFSET %s"""
+        users = dictfetchall(cur, sql, rank_params + where_params + [limit + 1, offset])
+        return users[:limit], len(users) > limit
+    except Exception:
+        logger.exception("Error searching users")
+        return None
+    finally:
+        cur.close()
+        conn.close()
 
-    # Close our connections to prevent saturation
-    cur.close()
-    conn.close()
 
-    # return our struct
-    return val
+@timed
+def search_airports(term, limit=50, offset=0):
+    '''
+    Airports whose name or city contain or resemble term; an exact IATA
+    code match comes first. Returns (airports, has_more), or None on error.
+    '''
+    if not term or not term.strip():
+        return None
+    conn = database_connect()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    try:
+        code = term.strip().upper()
+        where, where_params, rank, rank_params = _search_sql(
+            cur, 'airports', AIRPORT_SEARCH_FIELDS, term,
+            extra_rank=("CASE WHEN airports.iatacode = %s THEN 3 ELSE 0 END", [code]))
+        sql = f"""SELECT airportid, name, iatacode, city, country, {rank} AS rank
+                  FROM airline.airports
+                  WHERE {where} OR airports.iatacode = %s
+                  ORDER BY rank DESC, airports.name
+                  LIMIT %s OFFSET %s"""
+        cur.execute(sql, rank_params + where_params + [code, limit + 1, offset])
+        airports = fetch_rows(cur)
+        return airports[:limit], len(airports) > limit
+    except Exception:
+        logger.exception("Error searching airports")
+        return None
+    finally:
+        cur.close()
+        conn.close()
 
 
 #####################################
 ##  Update Single Items by PK       #
 #####################################
 
+def users_changed():
+    """Called after any write to the users table."""
+    data_versions.bump('users')
+
+
 
+@timed
 def update_single_user(userid, firstname, lastname, userroleid, password):
+    # Hash the password before storing it, before taking a connection
+    # so the pool is not held up while bcrypt runs
+    hashed_password = None
+    if password is not None:
+        try:
+            hashed_password = hash_password(password)
+        except (HashingBusy, HashingTimeout) as e:
+            logger.warning("Password for %s not updated: %s", userid, e)
+            return None
+
     # Get the database connection and set up the cursor
     conn = database_connect()
     if conn is None:
@@ -459,10 +1085,8 @@ def update_single_user(userid, firstname, lastname, userroleid, password):
         if userroleid is not None:
             setitems.append("userroleid = %s::bigint")
             values.append(userroleid)
-        if password is not None:
+        if hashed_password is not None:
             #change made from
-            # Hash the password before storing it
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
             setitems.append("password = %s")
             values.append(hashed_password)
             # changes finished
@@ -473,15 +1097,16 @@ def update_single_user(userid, firstname, lastname, userroleid, password):
                         WHERE userid = %s;"""
             values.append(userid)  # Append the userid for the WHERE clause
             # changes end
-            print_sql_string(sql, tuple(values))  # Pass values as a tuple
+            log_sql(sql, tuple(values))  # Pass values as a tuple
             cur.execute(sql, tuple(values))  # Execute with parameters
             conn.commit()
+            users_changed()
             val = cur.fetchone()  # Assuming you want to return the updated user
 
     except Exception:
         conn.rollback()
-        # If there are any errors, we print something nice and return a null value
-        print("Error Fetching from Database: ")
+        # If there are any errors, we log something nice and return a null value
+        logger.exception("Error updating user %s", userid)
 
     # Close our connections to prevent saturation
     cur.close()
@@ -493,40 +1118,44 @@ def update_single_user(userid, firstname, lastname, userroleid, password):
 
 ##  Insert / Add
 
+@timed
 def add_user_insert(userid, firstname, lastname, userroleid, password):
     """
     Add a new User to the system
     """
     # Data validation checks are assumed to have been done in route processing
 
+    # Hash the password before storing it, before taking a connection
+    # so the pool is not held up while bcrypt runs
+    try:
+        hashed_password = hash_password(password)
+    except (HashingBusy, HashingTimeout) as e:
+        logger.warning("User %s not added: %s", userid, e)
+        return None
+
     conn = database_connect()
     if conn is None:
         return None
     cur = conn.cursor()
 
-    # Hash the password before storing it
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    # end of change
-
     sql = """
         INSERT into Users(userid, firstname, lastname, userroleid, password)
         VALUES (%s, %s, %s, %s, %s);
     """
-    print_sql_string(sql, (userid, firstname, lastname, userroleid, hashed_password))
+    log_sql(sql, (userid, firstname, lastname, userroleid, hashed_password))
     try:
         # Try executing the SQL and get from the database
         cur.execute(sql, (userid, firstname, lastname, userroleid, hashed_password))
         
         r = []
         conn.commit()                   # Commit the transaction
-        print("return val is:")
-        print(r)
+        users_changed()
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
         return r
     except Exception:
         conn.rollback()
-        print("Unexpected error adding a user:")
+        logger.exception("Unexpected error adding a user")
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
         raise
@@ -534,6 +1163,7 @@ def add_user_insert(userid, firstname, lastname, userroleid, password):
 
 ##  Delete
 ###     delete_user(userid)
+@timed
 def delete_user(userid):
     """
     Remove a user from your system
@@ -553,16 +1183,14 @@ def delete_user(userid):
 
         cur.execute(sql,())
         conn.commit()                   # Commit the transaction
+        users_changed()
         r = []
-        # r = cur.fetchone()
-        # print("return val is:")
-        # print(r)
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
         return r
     except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error deleting  user with id ",userid, sys.exc_info()[0])
+        # If there were any errors, return a NULL row logging an error to the debug
+        logger.exception("Unexpected error deleting user with id %s", userid)
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
         raise
@@ -570,16 +1198,50 @@ def delete_user(userid):
 #####################################
 # ALL METHODS BELOW WERE CREATED BY THE STUDENT
 
-def get_airports_paginated(offset=0, limit=50):
+@timed
+def get_airports_page(after=None, before=None, last=False, limit=50):
+    '''
+    One page of airports ordered by airportid, using keyset (seek) pagination
+    so the cost does not grow with how deep the page is.
+
+    after  - airportid of the last row on the previous page (next page)
+    before - airportid of the first row on the following page (previous page)
+    last   - return the final page
+
+    Returns (airports, has_prev, has_next), or an error string.
+    '''
     conn = database_connect()
     if conn is None:
         return None
     cur = conn.cursor()
     try:
-        sql = "SELECT * FROM airports ORDER BY airportid OFFSET %s LIMIT %s"
-        cur.execute(sql, (offset, limit))
-        airports = cur.fetchall()
-        return airports
+        # One extra row tells us whether there is anything beyond this page
+        if after is not None:
+            sql = """SELECT airportid, name, iatacode, city, country FROM airports
+                     WHERE airportid > %s ORDER BY airportid LIMIT %s"""
+            cur.execute(sql, (after, limit + 1))
+        elif before is not None:
+            sql = """SELECT airportid, name, iatacode, city, country FROM airports
+                     WHERE airportid < %s ORDER BY airportid DESC LIMIT %s"""
+            cur.execute(sql, (before, limit + 1))
+        elif last:
+            sql = """SELECT airportid, name, iatacode, city, country FROM airports
+                     ORDER BY airportid DESC LIMIT %s"""
+            cur.execute(sql, (limit + 1,))
+        else:
+            sql = """SELECT airportid, name, iatacode, city, country FROM airports
+                     ORDER BY airportid LIMIT %s"""
+            cur.execute(sql, (limit + 1,))
+        airports = fetch_rows(cur)
+
+        more = len(airports) > limit
+        airports = airports[:limit]
+        if before is not None or last:
+            # walked backwards, put the page back in ascending order; the
+            # extra row was before this page, so it means there is a previous one
+            airports.reverse()
+            return airports, more, not last
+        return airports, after is not None, more
     except pg8000.DatabaseError:
         return f"Database Error"
     except pg8000.DataError:
@@ -587,43 +1249,186 @@ def get_airports_paginated(offset=0, limit=50):
     except pg8000.OperationalError:
         return f"Operational Error"
     except Exception as e:
-        return f"Unexpected error adding airport"
+        return f"Unexpected error fetching airports"
     finally:
         cur.close()
         conn.close()
 
-def get_airport_count():
+
+# exact -> (count, is_exact, time fetched, airports version) for get_airport_count()
+_airport_count_cache = {}
+
+
+def _cached_airport_count(exact):
+    # a write in any worker bumps the shared airports version, see data_versions.py
+    cached = _airport_count_cache.get(exact)
+    if (cached is not None and cached[3] == _airports_version()
+            and time.monotonic() - cached[2] < get_settings().cache_count_ttl):
+        return cached[0], cached[1]
+    return None
+
+
+@timed
+def get_airport_count(exact=False):
+    '''
+    Number of airports, cached for [CACHE] count_ttl seconds.
+    Unless exact is asked for, the planner estimate from pg_class is used so
+    no COUNT(*) over the whole table is needed.
+    Returns (count, is_exact) or None.
+    '''
+    cached = _cached_airport_count(exact)
+    if cached is not None:
+        return cached
+    shared_version = _airports_version()
+
     conn = database_connect()
     if conn is None:
         return None
     cur = conn.cursor()
     try:
-        sql = """SELECT COUNT(*) FROM airline.airports"""
-        cur.execute(sql)
-        count = cur.fetchone()[0]
-        return count
+        count = None
+        if not exact:
+            sql = """SELECT reltuples::bigint FROM pg_class WHERE oid = 'airline.airports'::regclass"""
+            cur.execute(sql)
+            count = cur.fetchone()[0]
+            # -1 (or 0) means the table was never analyzed, count it instead
+            if count is not None and count <= 0:
+                count = None
+        is_exact = count is None
+        if count is None:
+            sql = """SELECT COUNT(*) FROM airline.airports"""
+            cur.execute(sql)
+            count = cur.fetchone()[0]
+        _airport_count_cache[exact] = (count, is_exact, time.monotonic(), shared_version)
+        return count, is_exact
     except Exception:
-        print(f"Error fetching airports")
+        logger.exception("Error fetching airports")
         return None
     finally:
         cur.close()
         conn.close()
 
+def invalidate_airport_count():
+    """Forget the cached airport count, called after airports are added or removed."""
+    _airport_count_cache.clear()
+
+
+################################################################################
+# Airport catalogue cache
+#   - The airports table is small and mostly read (the type-ahead, lookups
+#     by IATA code), so one snapshot of it is kept in memory
+#   - Every function that writes airports calls airports_changed(), which
+#     drops the snapshot and bumps the shared airports version
+#     (data_versions.py); a snapshot taken at an older version is not used,
+#     so a write in one gunicorn worker is seen by all of them at once
+#   - It is also reloaded after [CACHE] catalogue_ttl seconds to pick up
+#     changes made by other programs
+################################################################################
+
+def _airports_version():
+    """The airports version shared by all worker processes."""
+    return data_versions.current(('airports',))[0][0]
+
+
+class CatalogueSnapshot:
+    """An immutable copy of the airports table with lookup indexes."""
+
+    def __init__(self, version, airports, shared_version=None):
+        self.version = version
+        self.shared_version = shared_version
+        # (airportid, name, iatacode, city, country) ordered by name
+        self.airports = tuple(airports)
+        self.by_id = {a[0]: a for a in self.airports}
+        self.by_code = {a[2].strip().upper(): a for a in self.airports}
+        self.loaded_at = time.monotonic()
 
-def get_all_airports_alphabetic():
+
+class AirportCatalogue:
+
+    def __init__(self, load):
+        self._load = load
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def current(self):
+        """The snapshot if it is still current, without loading one. Otherwise None."""
+        snap = self._snapshot
+        if (snap is not None and snap.shared_version == _airports_version()
+                and time.monotonic() - snap.loaded_at < get_settings().cache_catalogue_ttl):
+            return snap
+        return None
+
+    def snapshot(self):
+        """Return the current snapshot, loading it if needed. None if loading failed."""
+        snap = self.current()
+        if snap is not None:
+            return snap
+        with self._lock:
+            # someone else may have loaded it while we waited
+            snap = self.current()
+            if snap is not None:
+                return snap
+            version = self._version
+            # taken before the load, so a write in another worker during it
+            # leaves this copy behind and it is loaded again next time
+            shared_version = _airports_version()
+            rows = self._load()
+            if rows is None:
+                return None
+            snap = CatalogueSnapshot(version, rows, shared_version)
+            # a write that happened during the load makes this copy stale
+            if version == self._version:
+                self._snapshot = snap
+            return snap
+
+    def invalidate(self):
+        self._version += 1
+        self._snapshot = None
+
+
+@timed
+def _load_airport_catalogue():
     conn = database_connect()
+    if conn is None:
+        return None
     cur = conn.cursor()
     try:
         cur.execute("SELECT airportid, name, iatacode, city, country FROM airline.airports ORDER BY name")
-        return cur.fetchall()  
+        return fetch_rows(cur)
     except Exception:
-        print(f"Error fetching airports")
-        return []
+        logger.exception("Error loading the airport catalogue")
+        return None
     finally:
         cur.close()
         conn.close()
 
+airport_catalogue = AirportCatalogue(_load_airport_catalogue)
+
+
+def airports_changed():
+    """Called after any write to the airports table."""
+    airport_catalogue.invalidate()
+    invalidate_airport_count()
+    data_versions.bump('airports')
+
+
+@timed
 def get_airport_by_id(airport_id):
+    # Served from the catalogue when possible, the database is only asked on a miss
+    snap = airport_catalogue.snapshot()
+    if snap is not None:
+        try:
+            airport = snap.by_id.get(int(airport_id))
+        except (TypeError, ValueError):
+            airport = None
+        if airport is not None:
+            return airport
+
     conn = database_connect()
     if conn is None:
         return None
@@ -631,28 +1436,59 @@ def get_airport_by_id(airport_id):
     try:
         sql = """SELECT airportid, name, iatacode, city, country FROM airports WHERE airportid = %s"""
         cur.execute(sql, (airport_id,))
-        airport = cur.fetchone()
+        airport = fetch_row(cur)
         return airport
     except Exception:
-        print(f"Error fetching airport by ID")
+        logger.exception("Error fetching airport by ID")
         return None
     finally:
         cur.close()
         conn.close()
 
-def add_airport(airport_id, name, iatacode, city, country):
+@timed
+def add_airport(name, iatacode, city, country):
+    '''
+    Insert an airport unless its name or IATA code is already taken.
+    The uniqueness check, the new airportid (MAX + 1) and the insert all run
+    in one statement on one connection. The table lock stops two concurrent
+    inserts from picking the same id (plain reads are not blocked by it).
+
+    Returns {'airportid': new id or None, 'conflicts': [...]} where conflicts
+    lists 'name' and/or 'iatacode', or an error string.
+    '''
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
     cur = conn.cursor()
     try:
+        cur.execute("LOCK TABLE airline.airports IN SHARE ROW EXCLUSIVE MODE")
         insert_sql = """
-        INSERT INTO airports (airportid, name, iatacode, city, country)
-        VALUES (%s, %s, %s, %s, %s)
+        WITH taken AS (
+            SELECT COALESCE(bool_or(name = %s), false) AS name_taken,
+                   COALESCE(bool_or(iatacode = %s), false) AS code_taken
+            FROM airline.airports
+            WHERE name = %s OR iatacode = %s
+        ), inserted AS (
+            INSERT INTO airline.airports (airportid, name, iatacode, city, country)
+            SELECT nextid.airportid, %s, %s, %s, %s
+            FROM (SELECT COALESCE(MAX(airportid), 0) + 1 AS airportid FROM airline.airports) nextid, taken
+            WHERE NOT taken.name_taken AND NOT taken.code_taken
+            RETURNING airportid
+        )
+        SELECT (SELECT airportid FROM inserted), name_taken, code_taken FROM taken
         """
-        cur.execute(insert_sql, (airport_id, name, iatacode, city, country))
+        cur.execute(insert_sql, (name, iatacode, name, iatacode, name, iatacode, city, country))
+        airport_id, name_taken, code_taken = cur.fetchone()
         conn.commit()
-        return True
+
+        conflicts = []
+        if name_taken:
+            conflicts.append('name')
+        if code_taken:
+            conflicts.append('iatacode')
+        if airport_id is not None:
+            airports_changed()
+        return {'airportid': airport_id, 'conflicts': conflicts}
     except pg8000.DatabaseError:
         conn.rollback()
         return f"Database Error"
@@ -673,98 +1509,155 @@ def add_airport(airport_id, name, iatacode, city, country):
         conn.close()
 
 
-def airport_exists_name(name):
+@timed
+def bulk_insert_airports(rows):
+    '''
+    Load many airports in one transaction.
+    rows is a list of (lineno, name, iatacode, city, country), already
+    validated and without duplicates among themselves. They are streamed
+    into a temporary table with COPY and inserted with one INSERT ... SELECT
+    that skips names and IATA codes that already exist and numbers the new
+    airports after the current MAX(airportid).
+
+    Returns {'inserted': count, 'conflicts': [(lineno, [fields]), ...]}
+    or an error string.
+    '''
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
-    
     cur = conn.cursor()
     try:
+        cur.execute("""CREATE TEMP TABLE airport_import (
+                           lineno integer, name text, iatacode text, city text, country text
+                       ) ON COMMIT DROP""")
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        cur.execute("COPY airport_import FROM STDIN WITH (FORMAT csv)", stream=buf)
+
+        cur.execute("LOCK TABLE airline.airports IN SHARE ROW EXCLUSIVE MODE")
         sql = """
-        SELECT COUNT(*)
-        FROM airports
-        WHERE name = %s;
+        WITH candidates AS (
+            SELECT s.*,
+                   EXISTS (SELECT 1 FROM airline.airports a WHERE a.name = s.name) AS name_taken,
+                   EXISTS (SELECT 1 FROM airline.airports a WHERE a.iatacode = s.iatacode) AS code_taken
+            FROM airport_import s
+        ), inserted AS (
+            INSERT INTO airline.airports (airportid, name, iatacode, city, country)
+            SELECT base.maxid + row_number() OVER (ORDER BY c.lineno), c.name, c.iatacode, c.city, c.country
+            FROM candidates c,
+                 (SELECT COALESCE(MAX(airportid), 0) AS maxid FROM airline.airports) base
+            WHERE NOT c.name_taken AND NOT c.code_taken
+            RETURNING airportid
+        )
+        SELECT lineno, name_taken, code_taken FROM candidates
+        WHERE name_taken OR code_taken
+        ORDER BY lineno
         """
-        cur.execute(sql, (name,))
-        count = cur.fetchone()[0]
-        return count > 0  
+        cur.execute(sql)
+        conflicts = []
+        for lineno, name_taken, code_taken in cur.fetchall():
+            fields = []
+            if name_taken:
+                fields.append('name')
+            if code_taken:
+                fields.append('iatacode')
+            conflicts.append((lineno, fields))
+        conn.commit()
+
+        inserted = len(rows) - len(conflicts)
+        if inserted:
+            airports_changed()
+        return {'inserted': inserted, 'conflicts': conflicts}
+    except pg8000.DatabaseError as e:
+        conn.rollback()
+        return f"Database Error: {e}"
     except Exception:
-        return f"Error checking for existing airport"
+        conn.rollback()
+        return f"Unexpected error importing airports"
     finally:
         cur.close()
         conn.close()
 
-def airport_exists_code(iatacode):
+
+@timed
+def delete_airports(codes, all_or_nothing=False):
+    '''
+    Delete the airports with the given IATA codes in one transaction,
+    together with their past flights. An airport that still has a flight
+    arriving in the future (by the database clock) is kept; with
+    all_or_nothing, a kept or missing airport means none are deleted.
+
+    Flights are matched on departureairportid and arrivalairportid in two
+    separate branches, so each side can use its own index instead of an
+    OR over the whole flights table.
+
+    Returns {'deleted': [(iatacode, airportid, past flights removed)],
+             'blocked': [iatacode], 'missing': [iatacode], 'committed': bool}
+    or an error string.
+    '''
+    codes = sorted({str(code).strip().upper() for code in codes if code})
+    if not codes:
+        return {'deleted': [], 'blocked': [], 'missing': [], 'committed': True}
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
-    
     cur = conn.cursor()
     try:
         sql = """
-        SELECT COUNT(*)
-        FROM airports
-        WHERE iatacode = %s;
-        """
-        cur.execute(sql, (iatacode,))
-        count = cur.fetchone()[0]
-        return count > 0  
-    except Exception as e:
-        return f"Error checking for existing airport"
-    finally:
-        cur.close()
-        conn.close()
-
-
-def delete_airport(code):
-    conn = database_connect()
-    if conn is None:
-        return None
-    cur = conn.cursor()
-    try:
-        # Step 1: Check for any future flights involving the airport
-        current_time = datetime.now()
-        current_time = current_time.strftime("%Y-%m-%d %H:%M:%S")
-        sql_check_flights = """
-            SELECT flightid FROM airline.flights
-            WHERE (departureairportid = %s OR arrivalairportid = %s)
-            AND (arrivaltime > %s)
-        """
-        sql_get_airportid = """
-            SELECT airportid
+        WITH targets AS (
+            SELECT airportid, iatacode
             FROM airline.airports
-            WHERE iatacode = %s
+            WHERE iatacode = ANY(%s)
+            FOR UPDATE
+        ), involved AS (
+            SELECT f.flightid, t.airportid, f.arrivaltime
+            FROM airline.flights f JOIN targets t ON f.departureairportid = t.airportid
+            UNION ALL
+            SELECT f.flightid, t.airportid, f.arrivaltime
+            FROM airline.flights f JOIN targets t ON f.arrivalairportid = t.airportid
+        ), blocked AS (
+            SELECT DISTINCT airportid FROM involved WHERE arrivaltime > LOCALTIMESTAMP
+        ), removed AS (
+            DELETE FROM airline.flights f
+            USING involved i
+            WHERE f.flightid = i.flightid
+              AND i.airportid NOT IN (SELECT airportid FROM blocked)
+            RETURNING f.flightid
+        )
+        SELECT t.airportid, t.iatacode,
+               t.airportid IN (SELECT airportid FROM blocked) AS is_blocked,
+               (SELECT COUNT(DISTINCT r.flightid) FROM removed r
+                    JOIN involved i ON i.flightid = r.flightid
+                WHERE i.airportid = t.airportid) AS flights_removed
+        FROM targets t
+        ORDER BY t.iatacode
         """
-        cur.execute(sql_get_airportid, (code.upper(),))
-        airport_id = cur.fetchone()[0]
-        print(f'attempting to print aiport id {airport_id}')
-        cur.execute(sql_check_flights, (int(airport_id), int(airport_id), current_time))
-        future_flights = cur.fetchall()
-
-
-        if future_flights:
-            return "Cannot delete airport. There are upcoming flights associated with this airport."
-
-
+        cur.execute(sql, (codes,))
+        found = cur.fetchall()
 
-
-        # Step 2: Proceed with flight and airport deletion if no future flights found
-        sql_delete_flight = """
-        DELETE FROM airline.flights
-        WHERE ((arrivalairportid = %s) AND (%s > arrivaltime)) OR ((departureairportid = %s) AND (%s > departuretime))
-        """
-        sql_delete_airport = """DELETE FROM airline.airports WHERE iatacode = %s"""
-        cur.execute(sql_delete_flight,(airport_id,current_time,airport_id, current_time))
-        cur.execute(sql_delete_airport, (code,))
+        result = {'deleted': [], 'blocked': [], 'missing': [], 'committed': True}
+        for airport_id, iatacode, is_blocked, flights_removed in found:
+            if is_blocked:
+                result['blocked'].append(iatacode.strip())
+            else:
+                result['deleted'].append((iatacode.strip(), airport_id, flights_removed))
+        seen = {iatacode.strip() for _, iatacode, _, _ in found}
+        result['missing'] = [code for code in codes if code not in seen]
+        if all_or_nothing and (result['blocked'] or result['missing']):
+            # the flights removed above go back as well
+            conn.rollback()
+            result['deleted'] = []
+            result['committed'] = False
+            return result
+
+        deletable = [airport_id for airport_id, _, is_blocked, _ in found if not is_blocked]
+        if deletable:
+            cur.execute("DELETE FROM airline.airports WHERE airportid = ANY(%s)", (deletable,))
         conn.commit()
-
-
-        if cur.rowcount > 0:
-            return airport_id  # Deletion successful
-        else:
-            return "No airport found with the specified IATA code."
-
-
+        if deletable:
+            airports_changed()
+        return result
     except pg8000.DatabaseError:
         conn.rollback()
         return f"Database Error"
@@ -785,25 +1678,33 @@ def delete_airport(code):
         conn.close()
 
 
+@timed
+def delete_airport(code):
+    '''
+    Delete one airport and its past flights, see delete_airports().
+    Returns {'airportid': id, 'flights_removed': n} or an error string.
+    '''
+    result = delete_airports([code])
+    if isinstance(result, str):
+        return result
+    if result['blocked']:
+        return "Cannot delete airport. There are upcoming flights associated with this airport."
+    if not result['deleted']:
+        return "No airport found with the specified IATA code."
+    _, airport_id, flights_removed = result['deleted'][0]
+    return {'airportid': airport_id, 'flights_removed': flights_removed}
 
-def get_next_airport_id():
-    conn = database_connect()
-    if conn is None:
-        return None
-    cur = conn.cursor()
-    try:
-        sql = """SELECT MAX(airportid) FROM airline.airports"""
-        cur.execute(sql)
-        max_id = cur.fetchone()[0]
-        return max_id + 1 if max_id is not None else 1 
-    except Exception as e:
-        print(f"Error Retrieving max id")
-        return None
-    finally:
-        cur.close()
-        conn.close()
 
+
+@timed
 def get_airport_by_iatacode(code):
+    # Served from the catalogue when possible, the database is only asked on a miss
+    snap = airport_catalogue.snapshot()
+    if snap is not None and code is not None:
+        airport_info = snap.by_code.get(str(code).strip().upper())
+        if airport_info is not None:
+            return airport_info
+
     conn = database_connect()  
     if conn is None:
         return None
@@ -811,7 +1712,7 @@ def get_airport_by_iatacode(code):
     try:
         sql = "SELECT airportid, name, iatacode, city, country FROM airline.airports WHERE iatacode = %s"
         cur.execute(sql, (code,))  
-        airport_info = cur.fetchone()  
+        airport_info = fetch_row(cur)
         
         if airport_info is None:  
             return None 
@@ -825,124 +1726,267 @@ def get_airport_by_iatacode(code):
         conn.close()  
 
     
-def airport_summary():
-    conn = database_connect()
-    if conn is None:
-        return None
-    cur = conn.cursor()
-    try:
-        sql = """SELECT country, COUNT(country) FROM airline.airports 
-        GROUP BY country ORDER BY COUNT(*) DESC"""
-        cur.execute(sql)
-        summary = cur.fetchall()
-        return summary
-    except Exception:
-        result = f"Error retrieving summary max"
-        return result
-    finally:
-        cur.close()
-        conn.close()
+@timed
+def get_airports_by_iatacodes(codes):
+    '''
+    The airports with any of these IATA codes, from the catalogue, with one
+    query for any the catalogue does not have.
+    Returns {iatacode: row} for the codes found, or an error string.
+    '''
+    codes = [str(code).strip().upper() for code in codes]
+    found = {}
+    snap = airport_catalogue.snapshot()
+    if snap is not None:
+        for code in codes:
+            if code in snap.by_code:
+                found[code] = snap.by_code[code]
+    missing = [code for code in codes if code not in found]
+    if not missing:
+        return found
 
-def update_airport_name(airport_id, new_name):
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
     cur = conn.cursor()
     try:
-        sql = """
-        UPDATE airline.airports  
-        SET name = %s 
-        WHERE airportid = %s
-        """
-        cur.execute(sql, (new_name, airport_id))
-        conn.commit()
-        if cur.rowcount == 0:
-            return False
-        return True
+        cur.execute("""SELECT airportid, name, iatacode, city, country FROM airline.airports
+                       WHERE iatacode = ANY(%s)""", (missing,))
+        for row in fetch_rows(cur):
+            found[row[2].strip().upper()] = row
+        return found
     except pg8000.DatabaseError:
-        conn.rollback()
         return f"Database Error"
     except Exception:
-        conn.rollback()
-        return f"Unexpected error updating airport name"
+        return f"Unexpected error retrieving airport information"
     finally:
         cur.close()
         conn.close()
 
-def update_airport_iatacode(airport_id, new_iatacode):
+
+@timed
+def airport_summary():
     conn = database_connect()
     if conn is None:
-        return "Failed to connect to the database."
+        return None
     cur = conn.cursor()
     try:
-        sql = """
-        UPDATE airline.airports 
-        SET iatacode = %s 
-        WHERE airportid = %s
-        """
-        cur.execute(sql, (new_iatacode, airport_id))
-        conn.commit()
-        if cur.rowcount == 0:
-            return False
-        return True
-    except pg8000.DatabaseError:
-        conn.rollback()
-        return f"Database Error"
+        if has_schema_feature(cur, 'summary_tables'):
+            # kept up to date by triggers, one row per country
+            sql = """SELECT country, airports AS count FROM airline.airport_country_counts
+            ORDER BY airports DESC"""
+        else:
+            sql = """SELECT country, COUNT(country) FROM airline.airports 
+            GROUP BY country ORDER BY COUNT(*) DESC"""
+        cur.execute(sql)
+        summary = fetch_rows(cur)
+        return summary
     except Exception:
-        conn.rollback()
-        return f"Unexpected error updating airport IATA code"
+        result = f"Error retrieving summary max"
+        return result
     finally:
         cur.close()
         conn.close()
 
-def update_airport_city(airport_id, new_city):
+# collapses whitespace and case, so 'sydney  airport' counts as the current 'Sydney Airport'
+_SAME_TEXT = "lower(regexp_replace(btrim(t.{0}), '\\s+', ' ', 'g')) = lower(regexp_replace(btrim(%s), '\\s+', ' ', 'g'))"
+
+
+def _clean_airport_changes(changes, result):
+    # Validated values of the known fields; problems go to result['errors']
+    values = {}
+    for field in AIRPORT_FIELDS:
+        if field in changes:
+            value, error = clean_airport_field(field, changes[field])
+            if error is not None:
+                result['errors'].append(error)
+            values[field] = value
+    unknown = set(changes) - set(AIRPORT_FIELDS)
+    if unknown:
+        result['errors'].append(f"Unknown airport fields: {', '.join(sorted(unknown))}")
+    if not values and not result['errors']:
+        result['errors'].append("No fields to update.")
+    return values
+
+
+def _patch_one(cur, iatacode, values, result):
+    # Look up, check and update one airport in the current transaction,
+    # filling in result. Returns True if the row was changed.
+
+    # field names come from AIRPORT_FIELDS only, never from the caller
+    fields = list(values)
+    checks, check_params = [], []
+    for field in fields:
+        checks.append(_SAME_TEXT.format(field) + f" AS {field}_same")
+        check_params.append(values[field])
+    for field in ('name', 'iatacode'):
+        if field in values:
+            checks.append(f"""EXISTS (SELECT 1 FROM airline.airports a
+                                     WHERE a.{field} = %s AND a.airportid <> t.airportid) AS {field}_taken""")
+            check_params.append(values[field])
+        else:
+            checks.append(f"false AS {field}_taken")
+    assignments, set_params = [], []
+    for field in fields:
+        assignments.append(f"{field} = CASE WHEN c.{field}_same THEN a.{field} ELSE %s END")
+        set_params.append(values[field])
+    all_same = " AND ".join(f"c.{field}_same" for field in fields)
+
+    sql = f"""
+    WITH target AS (
+        SELECT airportid, name, iatacode, city, country
+        FROM airline.airports
+        WHERE iatacode = %s
+        FOR UPDATE
+    ), checks AS (
+        SELECT t.airportid, {", ".join(checks)}
+        FROM target t
+    ), updated AS (
+        UPDATE airline.airports a
+        SET {", ".join(assignments)}
+        FROM checks c
+        WHERE a.airportid = c.airportid
+          AND NOT c.name_taken AND NOT c.iatacode_taken
+          AND NOT ({all_same})
+        RETURNING a.airportid, a.name, a.iatacode, a.city, a.country
+    )
+    SELECT {", ".join(f"c.{field}_same" for field in fields)}, c.name_taken, c.iatacode_taken,
+           u.airportid, u.name, u.iatacode, u.city, u.country
+    FROM checks c LEFT JOIN updated u ON true
+    """
+    cur.execute(sql, [str(iatacode).strip().upper()] + check_params + set_params)
+    row = cur.fetchone()
+    if row is None:
+        return False
+
+    result['found'] = True
+    same = row[:len(fields)]
+    name_taken, code_taken = row[len(fields):len(fields) + 2]
+    result['unchanged'] = [field for field, s in zip(fields, same) if s]
+    if name_taken:
+        result['conflicts'].append('name')
+    if code_taken:
+        result['conflicts'].append('iatacode')
+    updated = row[len(fields) + 2:]
+    if updated[0] is None:
+        return False
+    result['airport'] = row_class(('airportid',) + AIRPORT_FIELDS)(updated)
+    return True
+
+
+@timed
+def patch_airport(iatacode, changes):
+    '''
+    Change any of name, iatacode, city and country of the airport with the
+    given IATA code. changes maps field names to the new (raw) values.
+
+    Values are validated first. The lookup, the checks that a new name or
+    code is not taken by another airport and the update then run as one
+    statement in one transaction, and the updated row comes back through
+    RETURNING. Fields whose new value only differs in case or spacing are
+    left alone.
+
+    Returns {'airport': updated row or None, 'found': bool,
+             'unchanged': [fields], 'conflicts': [fields], 'errors': [messages]}
+    or an error string.
+    '''
+    result = {'airport': None, 'found': False, 'unchanged': [], 'conflicts': [], 'errors': []}
+    values = _clean_airport_changes(changes, result)
+    if result['errors']:
+        return result
+
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
     cur = conn.cursor()
     try:
-        sql = """
-        UPDATE airline.airports 
-        SET city = %s 
-        WHERE airportid = %s
-        """
-        cur.execute(sql, (new_city, airport_id))
+        if 'name' in values or 'iatacode' in values:
+            # same lock as add_airport(), so two edits can not take one name at once
+            cur.execute("LOCK TABLE airline.airports IN SHARE ROW EXCLUSIVE MODE")
+        changed = _patch_one(cur, iatacode, values, result)
         conn.commit()
-        if cur.rowcount == 0:
-            return False
-        return True
+        if changed:
+            airports_changed()
+        return result
     except pg8000.DatabaseError:
         conn.rollback()
         return f"Database Error"
     except Exception:
         conn.rollback()
-        return f"Unexpected error updating airport city"
+        return f"Unexpected error updating airport"
     finally:
         cur.close()
         conn.close()
 
-def update_airport_country(airport_id, new_country):
+
+@timed
+def patch_airports(patches):
+    '''
+    patch_airport() for many airports in one transaction, all or nothing.
+    patches is a list of (iatacode, changes), applied in order, so a later
+    one sees the earlier ones (a code given up by one airport can be taken
+    by the next; a name or code still held by another airport can not).
+
+    If any patch has invalid values, names an airport that does not exist
+    or would take a name or code already in use, nothing is changed.
+
+    Returns {'committed': bool, 'results': [patch_airport() result, ...]}
+    or an error string.
+    '''
+    results, all_values = [], []
+    for iatacode, changes in patches:
+        result = {'iatacode': str(iatacode).strip().upper(), 'airport': None, 'found': False,
+                  'unchanged': [], 'conflicts': [], 'errors': []}
+        all_values.append(_clean_airport_changes(changes, result))
+        results.append(result)
+    if not results or any(r['errors'] for r in results):
+        return {'committed': False, 'results': results}
+
     conn = database_connect()
     if conn is None:
         return "Failed to connect to the database."
     cur = conn.cursor()
     try:
-        sql = """
-        UPDATE airline.airports  
-        SET country = %s 
-        WHERE airportid = %s
-        """
-        cur.execute(sql, (new_country, airport_id))
+        if any('name' in values or 'iatacode' in values for values in all_values):
+            cur.execute("LOCK TABLE airline.airports IN SHARE ROW EXCLUSIVE MODE")
+        changed = False
+        for result, values in zip(results, all_values):
+            changed = _patch_one(cur, result['iatacode'], values, result) or changed
+            if not result['found'] or result['conflicts']:
+                conn.rollback()
+                for r in results:
+                    r['airport'] = None
+                return {'committed': False, 'results': results}
         conn.commit()
-        if cur.rowcount == 0:
-            return False
-        return True
+        if changed:
+            airports_changed()
+        return {'committed': True, 'results': results}
     except pg8000.DatabaseError:
         conn.rollback()
         return f"Database Error"
     except Exception:
         conn.rollback()
-        return f"Unexpected error updating airport country"
+        return f"Unexpected error updating airports"
     finally:
         cur.close()
         conn.close()
+
+
+#####################################
+##  Export                          #
+#####################################
+
+# Columns are listed explicitly, password hashes are never exported
+
+def iter_airports(batch_size=1000):
+    sql = """SELECT airportid, name, iatacode, city, country
+             FROM airline.airports
+             ORDER BY airportid"""
+    return stream_rows(sql, (), batch_size)
+
+def iter_users(batch_size=1000):
+    sql = """SELECT users.userid, users.firstname, users.lastname, users.userroleid,
+                    userroles.rolename, userroles.isadmin
+             FROM users
+                 JOIN userroles ON (users.userroleid = userroles.userroleid)
+             ORDER BY users.userid"""
+    return stream_rows(sql, (), batch_size)
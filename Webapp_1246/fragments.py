@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Imports
+import threading
+from collections import OrderedDict
+import data_versions
+from metrics import register_gauge
+from settings import get_settings
+
+################################################################################
+# Rendered fragment cache
+#   - Keeps the HTML of the big tables (every user, a page of airports) once
+#     rendered, so the next visitor to the same page gets it without a
+#     query or a template render
+#   - Entries are keyed by the data versions they were built from
+#     (data_versions.stamp()); after a write they are simply never asked
+#     for again and age out of the LRU
+#   - At most [CACHE] fragment_max_bytes of HTML per process, least
+#     recently used dropped first; a fragment bigger than a quarter of that
+#     is not kept at all
+################################################################################
+
+
+class FragmentCache:
+    """An LRU of (html, extra) bounded by the total length of the html."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, html, extra, max_bytes):
+        size = len(html)
+        if size > max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (html, extra)
+            self._bytes += size
+            while self._bytes > max_bytes:
+                _, (dropped, _) = self._entries.popitem(last=False)
+                self._bytes -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+fragment_cache = FragmentCache()
+
+register_gauge('airline_fragment_cache', 'Rendered fragment cache entries, size and lookups', fragment_cache.stats)
+
+
+def cached(name, kinds, build, *variant):
+    '''
+    The fragment called name, for the current versions of kinds of data.
+    build() renders it and returns (html, extra) or None if it could not
+    (nothing is cached then); variant is whatever else the html depends on.
+    Returns (html, extra), or None from a failed build.
+    '''
+    max_bytes = get_settings().cache_fragment_max_bytes
+    if max_bytes <= 0:
+        return build()
+    key = (name, data_versions.stamp(kinds)) + variant
+    entry = fragment_cache.get(key)
+    if entry is None:
+        entry = build()
+        if entry is not None:
+            fragment_cache.put(key, entry[0], entry[1], max_bytes)
+    return entry
+
+
+async def cached_async(name, kinds, build, *variant):
+    """cached() for an async build(), used by asgi_app.py."""
+    max_bytes = get_settings().cache_fragment_max_bytes
+    if max_bytes <= 0:
+        return await build()
+    key = (name, data_versions.stamp(kinds)) + variant
+    entry = fragment_cache.get(key)
+    if entry is None:
+        entry = await build()
+        if entry is not None:
+            fragment_cache.put(key, entry[0], entry[1], max_bytes)
+    return entry
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Imports
+import concurrent.futures
+import logging
+import threading
+import bcrypt
+from settings import get_settings
+
+################################################################################
+# Password hashing
+#   - bcrypt is deliberately slow (tens of ms of CPU per call), so it runs
+#     on a bounded worker pool instead of inside the request thread
+#   - bcrypt releases the GIL while hashing, so threads already spread over
+#     all cores; [LOGIN] hash_pool = process is there for other builds
+#   - When too many hashes are queued the caller gets HashingBusy straight
+#     away instead of piling up, and a slow hash gives up after the timeout
+################################################################################
+
+logger = logging.getLogger('airline.hashing')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class HashingTimeout(Exception):
+    """Raised when a hash did not finish within [LOGIN] hash_timeout seconds."""
+
+
+# Top level so they can be sent to a process pool
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+class HashPool:
+
+    def __init__(self, workers, kind='thread', max_queue=64, timeout=5.0):
+        if kind == 'process':
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                                   thread_name_prefix='bcrypt')
+        # running + waiting jobs
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self.timeout = timeout
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("too many password checks in progress")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise HashingTimeout(f"password hashing took longer than {self.timeout}s")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_hash_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = get_settings()
+                _pool = HashPool(config.hash_workers, config.hash_pool,
+                                 config.hash_max_queue, config.hash_timeout)
+    return _pool
+
+def reset_hash_pool():
+    """Drop the pool, e.g. in a freshly forked worker. A new one is made on next use."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def check_password(password, hashed):
+    """True if password matches the stored bcrypt hash."""
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    return get_hash_pool().run(_checkpw, password.encode('utf-8'), hashed)
+
+def hash_password(password):
+    """A new bcrypt hash for password, as a str ready to store."""
+    hashed = get_hash_pool().run(_hashpw, password.encode('utf-8'), get_settings().hash_rounds)
+    return hashed.decode('utf-8')
+
+def hash_password_now(password, rounds):
+    '''
+    A bcrypt hash of password with the given cost, as a str, computed in the
+    calling thread rather than on the pool; for batch jobs (rehash.py, the
+    bench seeder) that bring their own workers.
+    '''
+    return _hashpw(password.encode('utf-8'), rounds).decode('utf-8')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Imports
+import datetime
+import functools
+import hashlib
+from flask import request, session, make_response, get_flashed_messages, Response
+import data_versions
+
+################################################################################
+# Conditional GETs for the read only pages
+#   - A page's ETag is made from the versions of the data it shows
+#     (data_versions.py) and the parts of the session that change how it
+#     looks (who is logged in, admin or not)
+#   - When the browser sends that ETag back in If-None-Match the page is
+#     answered with 304 Not Modified before any query or template runs
+#   - Pages showing flash messages get no ETag, and none is answered with
+#     304 while a message is waiting to be shown
+#   - Writes made outside the app are not counted, so ETags also change
+#     every [CACHE] catalogue_ttl seconds (see data_versions.stamp())
+################################################################################
+
+# Session keys that change how a page is rendered
+SESSION_VIEW_KEYS = ('logged_in', 'userid', 'name', 'isadmin')
+
+
+def page_etag(kinds, session):
+    '''
+    The ETag for a page built from kinds of data, as seen by this session.
+    Returns (etag, last_modified).
+    '''
+    _, changed_at = data_versions.current(kinds)
+    view = tuple(session.get(key) for key in SESSION_VIEW_KEYS)
+    digest = hashlib.sha1(repr((kinds, data_versions.stamp(kinds), view)).encode('utf-8')).hexdigest()
+    return digest[:20], datetime.datetime.fromtimestamp(int(changed_at), datetime.timezone.utc)
+
+
+def cacheable(request, session):
+    return request.method == 'GET' and '_flashes' not in session
+
+
+def is_fresh(request, etag):
+    """True if the browser's copy (If-None-Match) is still current."""
+    return request.if_none_match.contains_weak(etag)
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # the browser may keep the page, but has to ask before showing it again
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(*kinds):
+    '''
+    Decorator for Flask views that only read kinds of data: answers 304
+    when the browser's copy is current, otherwise adds the ETag.
+    '''
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not cacheable(request, session):
+                return view(*args, **kwargs)
+            etag, last_modified = page_etag(kinds, session)
+            if is_fresh(request, etag):
+                return add_validators(Response(status=304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            # a page that showed messages must not be shown again from cache
+            if response.status_code == 200 and not get_flashed_messages():
+                add_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorate
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Command line tasks, run from this folder so config.ini is found:
+#   python3 manage.py import-airports airports.csv
+#   python3 manage.py rehash-passwords
+#   python3 manage.py migrate
+import argparse
+import sys
+
+
+def cmd_import_airports(args):
+    import airport_import
+    fmt = args.format or airport_import.detect_format(args.file)
+    with open(args.file, newline='', encoding='utf-8') as f:
+        report = airport_import.import_airports(f, fmt, chunk_size=args.chunk_size)
+    for lineno, message in report['errors']:
+        print(f"line {lineno}: {message}")
+    print(f"{report['rows']} rows read, {report['inserted']} airports added, {report['rejected']} rejected")
+    return 1 if report['rejected'] else 0
+
+
+def cmd_rehash_passwords(args):
+    import rehash
+
+    def progress(state):
+        print(f"{state['scanned']} users scanned, {state['rehashed']} rehashed, "
+              f"{state['skipped']} already hashed (last userid {state['last_userid']})")
+
+    try:
+        state = rehash.rehash_passwords(batch_size=args.batch_size, workers=args.workers,
+                                        checkpoint=args.checkpoint, restart=args.restart,
+                                        progress=progress)
+    except rehash.RehashError as e:
+        print(f"Stopped: {e}. Run the command again to resume from {args.checkpoint}.")
+        return 1
+    print(f"Done: {state['rehashed']} passwords rehashed out of {state['scanned']} users")
+    return 0
+
+
+def cmd_migrate(args):
+    import migrations
+    if args.status:
+        for version, name, applied_at in migrations.status():
+            print(f"{version:4d}  {'applied ' + str(applied_at) if applied_at else 'pending':30s}  {name}")
+        return 0
+
+    def progress(version, name, statement):
+        print(f"[{version}] {' '.join(statement.split())}")
+
+    try:
+        done = migrations.migrate(target=args.to, progress=progress)
+    except migrations.MigrationError as e:
+        print(e)
+        return 1
+    print(f"{len(done)} migration(s) applied" if done else "Nothing to do, the schema is up to date")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Airline web app maintenance tasks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('import-airports', help='bulk load airports from CSV or JSON Lines')
+    p.add_argument('file')
+    p.add_argument('--format', choices=['csv', 'jsonl'], help='default: guessed from the file name')
+    p.add_argument('--chunk-size', type=int, default=1000, help='rows per transaction')
+    p.set_defaults(func=cmd_import_airports)
+
+    p = commands.add_parser('rehash-passwords', help='bcrypt every plain text password, resumable')
+    p.add_argument('--batch-size', type=int, default=1000, help='users per transaction')
+    p.add_argument('--workers', type=int, help='hashing processes, default: one per CPU')
+    p.add_argument('--checkpoint', default='rehash.checkpoint', help='file that records progress')
+    p.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    p.set_defaults(func=cmd_rehash_passwords)
+
+    p = commands.add_parser('migrate', help='create the indexes and other schema changes')
+    p.add_argument('--status', action='store_true', help='list the migrations and whether they were applied')
+    p.add_argument('--to', type=int, help='stop after this version')
+    p.set_defaults(func=cmd_migrate)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
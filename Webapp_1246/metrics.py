@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Imports
+import collections
+import functools
+import inspect
+import threading
+import time
+
+################################################################################
+# Metrics
+#   - Every database call and every Flask request is timed into a Series:
+#     call count, error count, rows returned and the latest latencies
+#   - p50/p95/p99 are worked out from the last SAMPLES timings when
+#     /metrics is scraped, so recording a call stays cheap
+#   - render() writes everything in the Prometheus text format
+################################################################################
+
+# How many recent timings are kept per series for the percentiles
+SAMPLES = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Series:
+    """Timings for one function or route."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.recent = collections.deque(maxlen=SAMPLES)
+
+    def quantiles(self):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return [(q, 0.0) for q in QUANTILES]
+        return [(q, ordered[min(len(ordered) - 1, int(q * len(ordered)))]) for q in QUANTILES]
+
+
+class Family:
+    """A set of Series sharing a metric name, keyed by their label values."""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def record(self, labelvalues, seconds, rows=None, error=False):
+        with self._lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = Series()
+            series.count += 1
+            series.total += seconds
+            series.recent.append(seconds)
+            if error:
+                series.errors += 1
+            if rows:
+                series.rows += rows
+
+    def render(self, out):
+        with self._lock:
+            items = [(labelvalues, s.count, s.errors, s.rows, s.total, s.quantiles())
+                     for labelvalues, s in sorted(self.series.items())]
+        out.append(f"# HELP {self.name}_seconds {self.help}")
+        out.append(f"# TYPE {self.name}_seconds summary")
+        for labelvalues, count, errors, rows, total, quantiles in items:
+            labels = _labels(zip(self.labels, labelvalues))
+            for q, value in quantiles:
+                out.append(f'{self.name}_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            out.append(f"{self.name}_seconds_sum{{{labels}}} {total:.6f}")
+            out.append(f"{self.name}_seconds_count{{{labels}}} {count}")
+        out.append(f"# HELP {self.name}_errors_total Calls that failed or returned an error")
+        out.append(f"# TYPE {self.name}_errors_total counter")
+        for labelvalues, count, errors, rows, total, quantiles in items:
+            out.append(f"{self.name}_errors_total{{{_labels(zip(self.labels, labelvalues))}}} {errors}")
+        out.append(f"# HELP {self.name}_rows_total Rows returned")
+        out.append(f"# TYPE {self.name}_rows_total counter")
+        for labelvalues, count, errors, rows, total, quantiles in items:
+            out.append(f"{self.name}_rows_total{{{_labels(zip(self.labels, labelvalues))}}} {rows}")
+
+
+def _labels(pairs):
+    return ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in pairs)
+
+
+db_calls = Family('airline_db_call', 'Time spent in database.py functions', ('function',))
+http_requests = Family('airline_http_request', 'Time spent handling requests', ('route', 'method'))
+
+# name -> (help, function returning {labelvalue: number}, label name)
+_gauges = {}
+
+
+def register_gauge(name, help, read, label='state'):
+    """Expose a value read at scrape time, e.g. the connection pool size."""
+    _gauges[name] = (help, read, label)
+
+
+def count_rows(result):
+    """Best guess at how many rows a database function returned."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result:
+        if isinstance(result[0], list):
+            # (rows, has_prev, has_next) from get_airports_page()
+            return len(result[0])
+        if isinstance(result[0], tuple):
+            return len(result)
+        # a single row
+        return 1
+    return None
+
+
+def timed(func):
+    '''
+    Decorator for database functions. Counts the call, its latency and the
+    rows it returned. Exceptions and error strings (the way the database
+    functions report failures) count as errors. Works on async functions
+    (async_database.py) too.
+    '''
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = None
+            error = True
+            try:
+                result = await func(*args, **kwargs)
+                error = isinstance(result, str)
+                return result
+            finally:
+                db_calls.record((func.__name__,), time.perf_counter() - start, count_rows(result), error)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = None
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = isinstance(result, str)
+            return result
+        finally:
+            db_calls.record((func.__name__,), time.perf_counter() - start, count_rows(result), error)
+    return wrapper
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    out = []
+    db_calls.render(out)
+    http_requests.render(out)
+    for name, (help, read, label) in sorted(_gauges.items()):
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} gauge")
+        for key, value in sorted(read().items()):
+            out.append(f"{name}{{{_labels([(label, key)])}}} {value}")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# Imports
+import logging
+import re
+import database
+
+################################################################################
+# Schema migrations
+#   - MIGRATIONS below is the ordered list of schema changes; the versions
+#     already applied are recorded in airline.schema_migrations
+#   - Run with: python3 manage.py migrate   (--status to only list them)
+#   - Indexes are built CONCURRENTLY so the app keeps reading and writing
+#     while they are created. That can not run inside a transaction, so
+#     migrations run in autocommit mode, one statement at a time
+#   - Every statement is safe to run twice (IF NOT EXISTS). A migration is
+#     only recorded once all of its statements went through, so after a
+#     failure it is simply run again; an index left INVALID by an aborted
+#     CONCURRENTLY build is dropped and rebuilt
+################################################################################
+
+logger = logging.getLogger('airline.migrations')
+
+# Any number, just has to be the same for every copy of this script so two
+# of them never run at the same time
+LOCK_ID = 1246_0017
+
+# (version, name, [statements])
+MIGRATIONS = [
+    (1, 'airports: unique iatacode and name', [
+        # add_airport(), patch_airport() and the catalogue look airports up by these
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS airports_iatacode_key ON airline.airports (iatacode)",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS airports_name_key ON airline.airports (name)",
+    ]),
+    (2, 'flights: airport and time indexes', [
+        # delete_airports() and the flight checks go in from either end
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS flights_departure_idx "
+        "ON airline.flights (departureairportid, departuretime)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS flights_arrival_idx "
+        "ON airline.flights (arrivalairportid, arrivaltime)",
+    ]),
+    (3, 'users: userroleid index', [
+        # list_user_stats() and the Users JOIN UserRoles reports
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_userroleid_idx ON airline.users (userroleid)",
+    ]),
+    (4, 'trigram indexes for searching users and airports', [
+        # pg_trgm lets a GIN index answer ~, LIKE '%...%' and similarity()
+        # on lower(column), which a B-tree can not
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_userid_trgm_idx "
+        "ON airline.users USING gin (lower(userid) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_firstname_trgm_idx "
+        "ON airline.users USING gin (lower(firstname) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_lastname_trgm_idx "
+        "ON airline.users USING gin (lower(lastname) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS airports_name_trgm_idx "
+        "ON airline.airports USING gin (lower(name) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS airports_city_trgm_idx "
+        "ON airline.airports USING gin (lower(city) gin_trgm_ops)",
+    ]),
+    (5, 'summary tables for the airport and user reports', [
+        # airport_summary() and list_user_stats() read these instead of
+        # grouping the whole table; statement level triggers with transition
+        # tables keep them current, so a bulk import costs one update per
+        # country rather than one per row
+        """CREATE TABLE IF NOT EXISTS airline.airport_country_counts (
+               country text PRIMARY KEY,
+               airports bigint NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS airline.user_role_counts (
+               userroleid integer PRIMARY KEY,
+               users bigint NOT NULL
+           )""",
+        """CREATE OR REPLACE FUNCTION airline.airport_country_counts_sync() RETURNS trigger
+           LANGUAGE plpgsql AS $$
+           BEGIN
+               IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                   INSERT INTO airline.airport_country_counts AS c (country, airports)
+                   SELECT country, COUNT(*) FROM new_rows WHERE country IS NOT NULL GROUP BY country
+                   ON CONFLICT (country) DO UPDATE SET airports = c.airports + EXCLUDED.airports;
+               END IF;
+               IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                   UPDATE airline.airport_country_counts c SET airports = c.airports - d.n
+                   FROM (SELECT country, COUNT(*) AS n FROM old_rows GROUP BY country) d
+                   WHERE c.country = d.country;
+                   DELETE FROM airline.airport_country_counts WHERE airports <= 0;
+               END IF;
+               RETURN NULL;
+           END $$""",
+        """CREATE OR REPLACE FUNCTION airline.user_role_counts_sync() RETURNS trigger
+           LANGUAGE plpgsql AS $$
+           BEGIN
+               IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                   INSERT INTO airline.user_role_counts AS c (userroleid, users)
+                   SELECT userroleid, COUNT(*) FROM new_rows WHERE userroleid IS NOT NULL GROUP BY userroleid
+                   ON CONFLICT (userroleid) DO UPDATE SET users = c.users + EXCLUDED.users;
+               END IF;
+               IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                   UPDATE airline.user_role_counts c SET users = c.users - d.n
+                   FROM (SELECT userroleid, COUNT(*) AS n FROM old_rows GROUP BY userroleid) d
+                   WHERE c.userroleid = d.userroleid;
+                   DELETE FROM airline.user_role_counts WHERE users <= 0;
+               END IF;
+               RETURN NULL;
+           END $$""",
+        # a trigger with transition tables can only be for one event
+        "DROP TRIGGER IF EXISTS airport_country_counts_ins ON airline.airports",
+        """CREATE TRIGGER airport_country_counts_ins AFTER INSERT ON airline.airports
+           REFERENCING NEW TABLE AS new_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.airport_country_counts_sync()""",
+        "DROP TRIGGER IF EXISTS airport_country_counts_upd ON airline.airports",
+        """CREATE TRIGGER airport_country_counts_upd AFTER UPDATE ON airline.airports
+           REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.airport_country_counts_sync()""",
+        "DROP TRIGGER IF EXISTS airport_country_counts_del ON airline.airports",
+        """CREATE TRIGGER airport_country_counts_del AFTER DELETE ON airline.airports
+           REFERENCING OLD TABLE AS old_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.airport_country_counts_sync()""",
+        "DROP TRIGGER IF EXISTS user_role_counts_ins ON airline.users",
+        """CREATE TRIGGER user_role_counts_ins AFTER INSERT ON airline.users
+           REFERENCING NEW TABLE AS new_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.user_role_counts_sync()""",
+        "DROP TRIGGER IF EXISTS user_role_counts_upd ON airline.users",
+        """CREATE TRIGGER user_role_counts_upd AFTER UPDATE ON airline.users
+           REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.user_role_counts_sync()""",
+        "DROP TRIGGER IF EXISTS user_role_counts_del ON airline.users",
+        """CREATE TRIGGER user_role_counts_del AFTER DELETE ON airline.users
+           REFERENCING OLD TABLE AS old_rows
+           FOR EACH STATEMENT EXECUTE FUNCTION airline.user_role_counts_sync()""",
+        # Fill them in with writes blocked, so no change is counted twice
+        # or missed while the triggers are already in place
+        """DO $$
+           BEGIN
+               LOCK TABLE airline.airports, airline.users IN SHARE MODE;
+               DELETE FROM airline.airport_country_counts;
+               INSERT INTO airline.airport_country_counts (country, airports)
+               SELECT country, COUNT(*) FROM airline.airports WHERE country IS NOT NULL GROUP BY country;
+               DELETE FROM airline.user_role_counts;
+               INSERT INTO airline.user_role_counts (userroleid, users)
+               SELECT userroleid, COUNT(*) FROM airline.users WHERE userroleid IS NOT NULL GROUP BY userroleid;
+           END $$""",
+    ]),
+]
+
+_index_name = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.I)
+
+
+class MigrationError(Exception):
+    """Raised when a migration statement fails; nothing after it is applied."""
+
+
+def _connect():
+    # A connection of its own rather than one from the pool: it is switched
+    # to autocommit and holds a session lock for the whole run
+    conn = database.open_connection()
+    conn.autocommit = True
+    return conn
+
+
+def _ensure_table(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS airline.schema_migrations (
+                       version integer PRIMARY KEY,
+                       name text NOT NULL,
+                       applied_at timestamp NOT NULL DEFAULT LOCALTIMESTAMP
+                   )""")
+
+
+def _applied(cur):
+    cur.execute("SELECT version, applied_at FROM airline.schema_migrations ORDER BY version")
+    return dict(cur.fetchall())
+
+
+def _drop_if_invalid(cur, statement):
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+    # which IF NOT EXISTS would then skip over
+    match = _index_name.match(statement)
+    if match is None:
+        return
+    cur.execute("""SELECT NOT i.indisvalid
+                   FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE c.relname = %s AND c.relnamespace = 'airline'::regnamespace""",
+                (match.group(1),))
+    row = cur.fetchone()
+    if row is not None and row[0]:
+        logger.warning("Rebuilding invalid index %s", match.group(1))
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS airline.{match.group(1)}")
+
+
+def status():
+    '''
+    Every known migration with the time it was applied (None if pending).
+    Returns [(version, name, applied_at)].
+    '''
+    conn = _connect()
+    cur = conn.cursor()
+    try:
+        _ensure_table(cur)
+        applied = _applied(cur)
+        return [(version, name, applied.get(version)) for version, name, _ in MIGRATIONS]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def migrate(target=None, progress=None):
+    '''
+    Apply every pending migration up to target (default: all of them).
+    progress(version, name, statement) is called before each statement.
+    Returns the list of versions applied. Raises MigrationError.
+    '''
+    conn = _connect()
+    cur = conn.cursor()
+    done = []
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+        _ensure_table(cur)
+        applied = _applied(cur)
+        for version, name, statements in MIGRATIONS:
+            if version in applied or (target is not None and version > target):
+                continue
+            for statement in statements:
+                if progress is not None:
+                    progress(version, name, statement)
+                try:
+                    _drop_if_invalid(cur, statement)
+                    cur.execute(statement)
+                except Exception as e:
+                    raise MigrationError(f"Migration {version} ({name}) failed: {e}") from e
+            cur.execute("INSERT INTO airline.schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name))
+            logger.info("Applied migration %d: %s", version, name)
+            done.append(version)
+        return done
+    finally:
+        try:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+        except Exception:
+            pass
+        cur.close()
+        conn.close()
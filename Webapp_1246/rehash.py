@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Imports
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import time
+import database
+from hashing import hash_password_now
+from settings import get_settings
+
+################################################################################
+# Password rehash job
+#   - Walks the users table by userid in batches, hashes every password that
+#     is not a bcrypt hash yet on a process pool (one process per core) and
+#     writes each batch back with a single UPDATE, committed per batch
+#   - After every batch the last userid is written to a checkpoint file, so
+#     an interrupted run carries on where it stopped instead of starting over
+#   - Rows that already hold a bcrypt hash are skipped, so running it again
+#     (or redoing a batch after a crash) is harmless
+################################################################################
+
+logger = logging.getLogger('airline.rehash')
+
+DEFAULT_CHECKPOINT = 'rehash.checkpoint'
+DEFAULT_BATCH_SIZE = 1000
+
+# $2a$ / $2b$ / $2y$, two digit cost, 53 characters of salt and hash
+bcrypt_pattern = re.compile(r'^\$2[abxy]\$\d{2}\$[./A-Za-z0-9]{53}$')
+
+
+class RehashError(Exception):
+    """Raised when a batch could not be read or stored; the checkpoint is kept."""
+
+
+def is_bcrypt_hash(value):
+    return value is not None and bcrypt_pattern.match(value) is not None
+
+
+def _hash_one(args):
+    password, rounds = args
+    return hash_password_now(password, rounds)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, state):
+    # write then rename, so a crash never leaves half a checkpoint behind
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def rehash_passwords(batch_size=DEFAULT_BATCH_SIZE, workers=None, checkpoint=DEFAULT_CHECKPOINT,
+                     restart=False, progress=None):
+    '''
+    Hash every plain text password in Users with bcrypt.
+    progress(state) is called after every batch with the running totals.
+    Returns the final state: {'last_userid', 'scanned', 'rehashed', 'skipped'}.
+    '''
+    state = None if restart else read_checkpoint(checkpoint)
+    if state is None:
+        state = {'last_userid': None, 'scanned': 0, 'rehashed': 0, 'skipped': 0}
+    else:
+        logger.info("Resuming after userid %s", state['last_userid'])
+    rounds = get_settings().hash_rounds
+    workers = workers or os.cpu_count() or 1
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            started = time.perf_counter()
+            batch = database.get_password_batch(state['last_userid'], batch_size)
+            if batch is None:
+                raise RehashError(f"could not read users after {state['last_userid']}")
+            if not batch:
+                break
+
+            todo = [(userid, password) for userid, password in batch
+                    if password is not None and not is_bcrypt_hash(password)]
+            if todo:
+                # spread the batch over every worker in a few chunks each
+                chunksize = max(1, len(todo) // (workers * 4))
+                hashes = pool.map(_hash_one, [(password, rounds) for _, password in todo],
+                                  chunksize=chunksize)
+                changes = [(userid, password, new) for (userid, password), new in zip(todo, hashes)]
+                updated = database.update_password_batch(changes)
+                if isinstance(updated, str):
+                    raise RehashError(updated)
+                state['rehashed'] += updated
+
+            state['last_userid'] = batch[-1][0]
+            state['scanned'] += len(batch)
+            state['skipped'] += len(batch) - len(todo)
+            write_checkpoint(checkpoint, state)
+            logger.info("%d users scanned, %d rehashed, %d already hashed (%.0f users/s)",
+                        state['scanned'], state['rehashed'], state['skipped'],
+                        len(batch) / max(time.perf_counter() - started, 1e-9))
+            if progress is not None:
+                progress(dict(state))
+
+    # finished, the next run starts from the beginning again
+    try:
+        os.remove(checkpoint)
+    except FileNotFoundError:
+        pass
+    return state
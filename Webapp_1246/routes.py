@@ -1,42 +1,57 @@
 # Importing the Flask Framework
 
 from flask import *
+import api
 import database
-import configparser
-import re
+import fragments
+import http_cache
+import airport_import
+import airport_suggest
+import base64
+import csv
+import io
+import itertools
+import json
+import logging
+import metrics
+import sessions
+import time
+from markupsafe import Markup
+from settings import get_settings
+# Defined regex patterns for validation (shared with the bulk import)
+from validation import alphabetic_pattern, iata_pattern
 
 # appsetup
 
-page = {}
-session = {}
+log = logging.getLogger('airline.routes')
 
-# Defined regex patterns for validation
-alphabetic_pattern = re.compile(r'^[A-Za-z\s]+$')  # Allow letters and spaces
-iata_pattern = re.compile(r'^[A-Z]{3}$')  # Exactly 3 uppercase letters
+page = {}
 
 # Initialise the FLASK applicationf
 app = Flask(__name__)
 app.secret_key = 'SoMeSeCrEtKeYhErE'
 
-with app.test_request_context('/'):
-    session['key'] = 'value'
-    print(session['key'])  # This will print 'value'
+# Flask's session, kept on the server per visitor (see sessions.py); the
+# cookie only carries the session id
+app.session_interface = sessions.ServerSessionInterface()
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+
+# The JSON API under /api/v1 (see api.py)
+app.register_blueprint(api.api_v1)
 
 # Debug = true if you want debug output on error ; change to false if you dont
 app.debug = False
 
 
 # Read my unikey to show me a personalised app
-config = configparser.ConfigParser()
-config.read('config.ini')
-dbuser = config['DATABASE']['user']
-portchoice = config['FLASK']['port']
+# (config.ini is parsed once by the settings module and shared with database.py)
+settings = get_settings()
+dbuser = settings.db_user
+portchoice = str(settings.flask_port)
 if portchoice == '10000':
     print('ERROR: Please change config.ini as in the comments or Lab instructions')
     exit(0)
 
-session['isadmin'] = False
-
 ###########################################################################################
 ###########################################################################################
 ####                                 Database operative routes                         ####
@@ -45,6 +60,39 @@ session['isadmin'] = False
 
 
 
+#####################################################
+##  Metrics
+#####################################################
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_time(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    # the url rule rather than the path, so /users/<userid> is one series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    error = exc is not None or g.get('response_status', 500) >= 500
+    metrics.http_requests.record((route, request.method), time.perf_counter() - start, error=error)
+
+@app.route('/metrics')
+def show_metrics():
+    config = get_settings()
+    if not config.metrics_enabled:
+        abort(404)
+    if config.metrics_local_only and request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 #####################################################
 ##  INDEX
 #####################################################
@@ -70,8 +118,6 @@ def login():
     if(request.method == 'POST'):
         # Get our login value
         val = database.check_login(request.form['userid'], request.form['password'])
-        print(val)
-        print(request.form)
         # If our database connection gave back an error
         if(val == None):
             errortext = "Error with the database connection."
@@ -86,10 +132,15 @@ def login():
             return redirect(url_for('login'))
 
         # If it was successful, then we can log them in :)
-        print(val[0])
+        log.debug("Logged in %s", request.form['userid'])
+        # a new session id for the logged in user
+        session.regenerate()
         session['name'] = val[0]['firstname']
         session['userid'] = request.form['userid']
         session['logged_in'] = True
+        # the role is kept in the session, pages never look it up again
+        session['userroleid'] = val[0]['userroleid']
+        session['rolename'] = val[0]['rolename']
         session['isadmin'] = val[0]['isadmin']
         return redirect(url_for('index'))
     else:
@@ -101,7 +152,7 @@ def login():
 # logout
 @app.route('/logout')
 def logout():
-    session['logged_in'] = False
+    session.clear()
     flash('You have been logged out')
     return redirect(url_for('index'))
 
@@ -112,20 +163,27 @@ def logout():
 ########################
 
 @app.route('/users')
+@http_cache.conditional('users')
 def list_users():
     '''
     List all rows in users by calling the relvant database calls and pushing to the appropriate template
     '''
-    # connect to the database and call the relevant function
-    users_listdict = database.list_users()
+    # The table is rendered once per version of the users table (and for
+    # admins / everyone else), the database is only asked on a miss
+    def build():
+        users_listdict = database.list_users()
+        if users_listdict is None:
+            return None
+        return Markup(render_template('users_table.html', session=session, users=users_listdict)), None
+    table = fragments.cached('users_table', ('users',), build, session.get('isadmin') == True)
 
     # Handle the null condition
-    if (users_listdict is None):
-        # Create an empty list and show error message
-        users_listdict = []
+    if (table is None):
+        # Show an empty table and an error message
         flash('Error, there are no rows in users')
     page['title'] = 'List Contents of users'
-    return render_template('list_users.html', page=page, session=session, users=users_listdict)
+    return render_template('list_users.html', page=page, session=session, users=[],
+                           users_table=table and table[0])
     
 
 ########################
@@ -158,23 +216,31 @@ def list_single_users(userid):
 ########################
 
 @app.route('/consolidated/users')
+@http_cache.conditional('users')
 def list_consolidated_users():
     '''
     List all rows in users join userroles 
     by calling the relvant database calls and pushing to the appropriate template
     '''
-    # connect to the database and call the relevant function
-    users_userroles_listdict = database.list_consolidated_users()
+    # Rendered once per version of the users table, as in list_users()
+    def build():
+        users_userroles_listdict = database.list_consolidated_users()
+        if users_userroles_listdict is None:
+            return None
+        return Markup(render_template('consolidated_users_table.html', session=session,
+                                      users=users_userroles_listdict)), None
+    table = fragments.cached('consolidated_users_table', ('users',), build, session.get('isadmin') == True)
 
     # Handle the null condition
-    if (users_userroles_listdict is None):
-        # Create an empty list and show error message
-        users_userroles_listdict = []
+    if (table is None):
+        # Show an empty table and an error message
         flash('Error, there are no rows in users_userroles_listdict')
     page['title'] = 'List Contents of Users join Userroles'
-    return render_template('list_consolidated_users.html', page=page, session=session, users=users_userroles_listdict)
+    return render_template('list_consolidated_users.html', page=page, session=session, users=[],
+                           users_table=table and table[0])
 
 @app.route('/user_stats')
+@http_cache.conditional('users')
 def list_user_stats():
     '''
     List some user stats
@@ -190,42 +256,50 @@ def list_user_stats():
     page['title'] = 'User Stats'
     return render_template('list_user_stats.html', page=page, session=session, users=user_stats)
 
+SEARCH_PAGE_SIZE = 50
+
 @app.route('/users/search', methods=['POST', 'GET'])
 def search_users_byname():
     '''
-    List all rows in users that match a particular name
+    List the users that match a search term, best matches first,
     by calling the relevant database calls and pushing to the appropriate template
     '''
     if(request.method == 'POST'):
-
-        search = database.search_users_customfilter(request.form['searchfield'],"~",request.form['searchterm'])
-        print(search)
-        
-        users_listdict = None
-
-        if search == None:
-            errortext = "Error with the database connection."
-            errortext += "Please check your terminal and make sure you updated your INI files."
-            flash(errortext)
-            return redirect(url_for('index'))
-        if search == None or len(search) < 1:
-            flash(f"No items found for search: {request.form['searchfield']}, {request.form['searchterm']}")
-            return redirect(url_for('index'))
-        else:
-            
-            users_listdict = search
-            # Handle the null condition'
-            print(users_listdict)
-            if (users_listdict is None or len(users_listdict) == 0):
-                # Create an empty list and show error message
-                users_listdict = []
-                flash('Error, there are no rows in users that match the searchterm '+request.form['searchterm'])
-            page['title'] = 'Users search by name'
-            return render_template('list_users.html', page=page, session=session, users=users_listdict)
-            
-
-    else:
-        return render_template('search_users.html', page=page, session=session)
+        # Redirect so the results (and their next pages) have a plain URL
+        return redirect(url_for('search_users_byname', searchfield=request.form.get('searchfield', 'any'),
+                                searchterm=request.form['searchterm']))
+
+    searchterm = request.args.get('searchterm', '').strip()
+    searchfield = request.args.get('searchfield', 'any').lower().strip()
+    if not searchterm:
+        return render_template('search_users.html', page=page, session=session,
+                               fields=database.USER_SEARCH_FIELDS)
+    if searchfield != 'any' and searchfield not in database.USER_SEARCH_FIELDS:
+        flash(f"Can not search by {searchfield}")
+        return redirect(url_for('search_users_byname'))
+
+    current_page = max(1, request.args.get('page', 1, type=int))
+    fields = None if searchfield == 'any' else [searchfield]
+    search = database.search_users(searchterm, fields, limit=SEARCH_PAGE_SIZE,
+                                   offset=(current_page - 1) * SEARCH_PAGE_SIZE)
+    if search is None:
+        errortext = "Error with the database connection."
+        errortext += "Please check your terminal and make sure you updated your INI files."
+        flash(errortext)
+        return redirect(url_for('index'))
+    users_listdict, has_more = search
+    if len(users_listdict) < 1:
+        flash(f"No items found for search: {searchfield}, {searchterm}")
+        return redirect(url_for('search_users_byname'))
+
+    results = {'title': 'Users search by name'}
+    if current_page > 1:
+        results['prev_url'] = url_for('search_users_byname', searchfield=searchfield,
+                                      searchterm=searchterm, page=current_page - 1)
+    if has_more:
+        results['next_url'] = url_for('search_users_byname', searchfield=searchfield,
+                                      searchterm=searchterm, page=current_page + 1)
+    return render_template('list_users.html', page=results, session=session, users=users_listdict)
         
 @app.route('/users/delete/<userid>')
 def delete_user(userid):
@@ -253,9 +327,8 @@ def update_user():
 
     userslist = None
 
-    print("request form is:")
+    log.debug("request form fields: %s", list(request.form))
     newdict = {}
-    print(request.form)
 
     validupdate = False
     # Check your incoming parameters
@@ -268,38 +341,32 @@ def update_user():
             return redirect(url_for('list_users'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = None
         else:
             validupdate = True
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = None
         else:
             validupdate = True
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = None
         else:
             validupdate = True
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = None
         else:
             validupdate = True
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Update dict is:')
-        print(newdict, validupdate)
+        log.debug("Update for user %s, valid update: %s", newdict['userid'], validupdate)
 
         if validupdate:
             #forward to the database to manage update
@@ -339,9 +406,8 @@ def edit_user(userid):
         flash('Error, there are no rows in users that match the attribute "userid" for the value '+userid)
 
     userslist = None
-    print("request form is:")
+    log.debug("request form fields: %s", list(request.form))
     newdict = {}
-    print(request.form)
     user = users_listdict[0]
     validupdate = False
 
@@ -355,38 +421,32 @@ def edit_user(userid):
             return redirect(url_for('list_users'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = None
         else:
             validupdate = True
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = None
         else:
             validupdate = True
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = None
         else:
             validupdate = True
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = None
         else:
             validupdate = True
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Update dict is:')
-        print(newdict, validupdate)
+        log.debug("Update for user %s, valid update: %s", newdict['userid'], validupdate)
 
         if validupdate:
             #forward to the database to manage update
@@ -425,9 +485,8 @@ def add_user():
     page['title'] = 'Add user details'
 
     userslist = None
-    print("request form is:")
+    log.debug("request form fields: %s", list(request.form))
     newdict = {}
-    print(request.form)
 
     # Check your incoming parameters
     if(request.method == 'POST'):
@@ -439,38 +498,34 @@ def add_user():
             return redirect(url_for('add_user'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = 'Empty firstname'
         else:
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = 'Empty lastname'
         else:
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = 1 # default is traveler
         else:
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = 'blank'
         else:
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Insert parametesrs are:')
-        print(newdict)
+        log.debug("Adding user %s", newdict['userid'])
 
-        database.add_user_insert(newdict['userid'], newdict['firstname'],newdict['lastname'],newdict['userroleid'],newdict['password'])
+        added = database.add_user_insert(newdict['userid'], newdict['firstname'],newdict['lastname'],newdict['userroleid'],newdict['password'])
+        if added is None:
+            flash('Error adding user. Please try again.')
+            return redirect(url_for('add_user'))
         # Should redirect to your newly updated user
-        print("did it go wrong here?")
         return redirect(url_for('list_consolidated_users'))
     else:
         # assuming GET request, need to setup for this
@@ -496,21 +551,25 @@ def add_airport():
         if not validate_airport_data(name, iatacode, city, country):
             return redirect(url_for('add_airport'))
 
-        # Get the next airport_id
-        airport_id = database.get_next_airport_id()
-
         # Convert IATA code to uppercase, to ensure uniformity and easier to query for equality
         iatacode = iatacode.upper().strip()
         name = name.title().strip()
         city = city.title().strip()
         country = country.title().strip()
 
-        result = database.add_airport(airport_id, name, iatacode, city, country)
+        # Uniqueness checks, id assignment and insert happen in one go
+        result = database.add_airport(name, iatacode, city, country)
         
-        if result is True: 
-            flash(f'Airport with ID {airport_id} added successfully!')
+        if isinstance(result, dict) and result['airportid'] is not None: 
+            flash(f"Airport with ID {result['airportid']} added successfully!")
             flash('Specified airport is the last row')
-            return redirect(url_for('list_airports'))
+            return redirect(url_for('list_airports', last=1))
+        elif isinstance(result, dict):
+            if 'name' in result['conflicts']:
+                flash('An airport with this name already exists.')
+            if 'iatacode' in result['conflicts']:
+                flash('An airport with this IATA code already exists.')
+            return redirect(url_for('add_airport'))
         else:
             flash(f'Error adding airport: {result}')
 
@@ -518,6 +577,7 @@ def add_airport():
 
 
 def validate_airport_data(name, iatacode, city, country):
+    # Only the format is checked here, uniqueness is checked by database.add_airport
     name = name.title()
     iatacode = iatacode.upper()
     # Validate Name
@@ -530,15 +590,6 @@ def validate_airport_data(name, iatacode, city, country):
         flash('Invalid IATA code. It must be exactly 3 letters.')
         return False
 
-    # Check for existing records
-    if database.airport_exists_name(name):
-        flash('An airport with this name already exists.')
-        return False
-    
-    # Check for existing records
-    if database.airport_exists_code(iatacode):
-        flash('An airport with this IATA code already exists.')
-        return False
     # Validate City
     if not alphabetic_pattern.match(city):
         flash('Invalid city name. Only alphabetic characters are allowed.')
@@ -552,72 +603,218 @@ def validate_airport_data(name, iatacode, city, country):
     return True
 
 
+@app.route('/airports/import', methods=['GET', 'POST'])
+def import_airports():
+    # # Check if the user is logged in, if not: back to login.
+    if('logged_in' not in session or not session['logged_in']):
+        return redirect(url_for('login'))
+
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            flash('Please choose a CSV or JSON Lines file to import.')
+            return redirect(url_for('import_airports'))
+
+        fmt = request.form.get('format') or airport_import.detect_format(upload.filename)
+        # Read the upload as a stream instead of loading it into memory first
+        textfile = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        try:
+            report = airport_import.import_airports(textfile, fmt)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flash(f'Error importing airports: {e}')
+            return redirect(url_for('import_airports'))
+        flash(f"{report['inserted']} airports added, {report['rejected']} rows rejected.")
+
+    return render_template('import_airports.html', page={'title': 'Import Airports'},
+                           report=report, session=session)
+
+
+def encode_cursor(airportid):
+    # Opaque page token so the URL does not invite editing ids by hand
+    return base64.urlsafe_b64encode(str(airportid).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    if token is None:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid page token: {token}')
+
+
 @app.route('/airports', methods=['GET'])
+@http_cache.conditional('airports')
 def list_airports():
-    page = request.args.get('page', 1, type=int)  # Get the current page number from the query parameters
     limit = 50
-    offset = (page - 1) * limit
+    current_page = request.args.get('page', 1, type=int)  # only used for display
+    exact = request.args.get('exact', 0, type=int) == 1
+    last = request.args.get('last', 0, type=int) == 1
+    try:
+        after = decode_cursor(request.args.get('after'))
+        before = decode_cursor(request.args.get('before'))
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('list_airports'))
 
-    airports = database.get_airports_paginated(offset=offset, limit=limit)
+    # Seek straight to the page instead of skipping over OFFSET rows. The
+    # rows come with the ids of the first and last airport for the links;
+    # the whole lot is rendered once per version of the airports table
+    def build():
+        result = database.get_airports_page(after=after, before=before, last=last, limit=limit)
+        if result is None or isinstance(result, str):
+            return None
+        airports, has_prev, has_next = result
+        bounds = (airports[0][0], airports[-1][0]) if airports else None
+        return Markup(render_template('airports_table.html', airports=airports)), (bounds, has_prev, has_next)
+    table = fragments.cached('airports_table', ('airports',), build, after, before, last, limit)
 
     # Check if the list is empty
-    if airports is None:
+    if table is None:
         flash('Error fetching airports. Please try again.')
-        return redirect(url_for('list_airports')) 
-
-    # Fetch total count of airports for pagination
-    total_airports = database.get_airport_count()  
-
-    if total_airports is None:
+        return render_template('list_airports.html', airports=[],
+                               page={'title': 'View Airports', 'current_page': 1, 'total_airports': 0,
+                                     'total_pages': 1, 'exact': True},
+                               session=session)
+    airports_table, (bounds, has_prev, has_next) = table
+
+    # Total for display only, estimated unless ?exact=1 and cached either way
+    count = database.get_airport_count(exact=exact)
+    if count is None:
         flash('Error fetching total count of airports. Please try again.')
-        return redirect(url_for('list_airports'))
+        count = (0, False)
+    total_airports, is_exact = count
 
     # Calculate total pages
-    total_pages = (total_airports // limit) + (1 if total_airports % limit > 0 else 0)
-
+    total_pages = max(1, (total_airports // limit) + (1 if total_airports % limit > 0 else 0))
+    if last:
+        current_page = total_pages
+    current_page = max(1, current_page)
+
+    page = {'title': 'View Airports', 'current_page': current_page, 'total_airports': total_airports,
+            'total_pages': total_pages, 'exact': is_exact}
+    if bounds:
+        if has_prev:
+            page['prev_url'] = url_for('list_airports', before=encode_cursor(bounds[0]),
+                                       page=max(1, current_page - 1))
+        if has_next:
+            page['next_url'] = url_for('list_airports', after=encode_cursor(bounds[1]),
+                                       page=current_page + 1)
     return render_template('list_airports.html', 
-                           airports=airports, 
-                           page={'title': 'View Airports', 'current_page': page, 'total_airports': total_airports, 'total_pages': total_pages}, 
+                           airports_table=airports_table, 
+                           page=page, 
                            session=session)
 
 
 
 
 
+#####################################################
+##  Export (streamed, never built up in memory)
+#####################################################
+
+def export_response(batches, fmt, filename):
+    '''
+    Stream batches of rows from database.stream_rows() as CSV or JSON Lines.
+    The first batch is fetched up front so a database error can still be
+    shown as a normal page instead of a cut-off download.
+    '''
+    if fmt not in ('csv', 'jsonl'):
+        flash(f'Unknown export format: {fmt}')
+        return None
+    try:
+        first = next(batches, None)
+    except Exception as e:
+        flash(f'Error exporting data: {e}')
+        return None
+
+    def generate():
+        if first is None:
+            return
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == 'csv':
+            writer.writerow(first[0])
+        for cols, rows in itertools.chain([first], batches):
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(zip(cols, row)), default=str))
+                    buf.write('\n')
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'})
+
+
+@app.route('/airports/export')
+def export_airports():
+    if('logged_in' not in session or not session['logged_in']):
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'csv')
+    response = export_response(database.iter_airports(), fmt, 'airports')
+    if response is None:
+        return redirect(url_for('list_airports'))
+    return response
+
+
+@app.route('/users/export')
+def export_users():
+    if('logged_in' not in session or not session['logged_in']):
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'csv')
+    response = export_response(database.iter_users(), fmt, 'users')
+    if response is None:
+        return redirect(url_for('list_consolidated_users'))
+    return response
+
+
 @app.route('/airports/remove/', methods=['GET', 'POST'])
 def remove_airport():
-    # Fetch all airports for dropdown
-    airports = database.get_all_airports_alphabetic()  
-    selected_airport = None  
+    # Airports are picked with the type-ahead, the page does not list them all
+    selected_airports = []
 
     if request.method == 'POST':
-        iatacode = request.form.get('iatacode')
-
-        # Fetch selected airport details for confirmation
-        selected_airport = database.get_airport_by_iatacode(iatacode)
-        if selected_airport:
+        # One or more airports can be picked, they are removed together
+        for iatacode in request.form.getlist('iatacode'):
+            if not iatacode.strip():
+                continue
+            selected_airport = database.get_airport_by_iatacode(iatacode.strip().upper())
+            if selected_airport and not isinstance(selected_airport, str):
+                selected_airports.append(selected_airport)
+        if selected_airports:
             return render_template('remove_airport.html', 
                                    page={'title': 'Remove Airport'}, 
-                                   airports=airports, 
-                                   selected_airport=selected_airport,
+                                   selected_airports=selected_airports,
                                    session=session)
 
         flash('No airport found with the given IATA code.')
         return redirect(url_for('list_airports'))
 
-    return render_template('remove_airport.html', page={'title': 'Remove Airport'}, airports=airports, session=session)
+    return render_template('remove_airport.html', page={'title': 'Remove Airport'}, session=session)
 
 @app.route('/airports/remove/final/', methods=['POST'])
 def remove_airport_final():
-    iatacode = request.form.get('iatacode')
+    codes = request.form.getlist('iatacode')
 
-    # Attempt to delete the airport
-    result = database.delete_airport(str(iatacode).upper())
-    result = str(result)
-    if (len(result) == 1):
-        flash(f'Airport removed successfully! Removed airport with ID originally {result}') 
-    else:
+    # Attempt to delete the airports, all in one transaction
+    result = database.delete_airports(codes)
+    if isinstance(result, str):
         flash(f'Error removing airport: {result}')
+        return redirect(url_for('list_airports'))
+
+    for iatacode, airport_id, flights_removed in result['deleted']:
+        flash(f'Airport removed successfully! Removed airport {iatacode} with ID originally {airport_id} '
+              f'and {flights_removed} past flight(s).')
+    for iatacode in result['blocked']:
+        flash(f'Error removing airport {iatacode}: Cannot delete airport. '
+              'There are upcoming flights associated with this airport.')
+    for iatacode in result['missing']:
+        flash(f'Error removing airport {iatacode}: No airport found with the specified IATA code.')
 
     return redirect(url_for('list_airports'))
 
@@ -640,224 +837,113 @@ def get_airport_by_id():
                            airport=airport_data, 
                            session = session)  
 
+@app.route('/airports/search')
+def search_airports():
+    searchterm = request.args.get('q', '').strip()
+    current_page = max(1, request.args.get('page', 1, type=int))
+    airports = []
+    page = {'title': 'Search Airports', 'searchterm': searchterm}
+    if searchterm:
+        result = database.search_airports(searchterm, limit=SEARCH_PAGE_SIZE,
+                                          offset=(current_page - 1) * SEARCH_PAGE_SIZE)
+        if result is None:
+            flash('Error searching airports. Please try again.')
+        else:
+            airports, has_more = result
+            if not airports:
+                flash(f'No airports found for: {searchterm}')
+            if current_page > 1:
+                page['prev_url'] = url_for('search_airports', q=searchterm, page=current_page - 1)
+            if has_more:
+                page['next_url'] = url_for('search_airports', q=searchterm, page=current_page + 1)
+    return render_template('search_airports.html', page=page, airports=airports, session=session)
+
+@app.route('/api/airports/suggest')
+def suggest_airports():
+    # Type-ahead for the airport pickers (static/js/airport_autocomplete.js)
+    prefix = request.args.get('q', '')
+    limit = request.args.get('limit', airport_suggest.DEFAULT_LIMIT, type=int)
+    airports = airport_suggest.suggest(prefix, limit)
+    if airports is None:
+        return jsonify(error='Airports are not available right now.'), 503
+    return jsonify([{'airportid': a[0], 'name': a[1].strip(), 'iatacode': a[2].strip(),
+                     'city': a[3].strip(), 'country': a[4].strip()} for a in airports])
+
 @app.route('/airports/get_summary')
+@http_cache.conditional('airports')
 def get_summary():
     data = database.airport_summary()
+    if data is None or isinstance(data, str):
+        # not a 200, so the error page never gets an ETag (http_cache.conditional)
+        flash(f'Error retrieving the airport summary: {data or "Failed to connect to the database."}')
+        return render_template('airport_summary.html', page = {'title': 'Airport Summary'}, airport = [], session = session), 503
     return render_template('airport_summary.html', page = {'title': 'Airport Summary'}, airport = data, session = session)
 
 
-@app.route('/airports/update_name/', methods=['GET', 'POST'])
-def update_airport_name():
-    airport_info = None  
-    # Fetch all airports for dropdown
-    airports = database.get_all_airports_alphabetic()  
+# Labels used in the messages of the update pages
+FIELD_LABELS = {'name': 'name', 'iatacode': 'IATA code', 'city': 'city', 'country': 'country'}
+
+def update_airport_page(field, template, title):
+    '''
+    Shared by the update_airport_* pages. The first POST (just an IATA code
+    from the dropdown) shows the airport; the second sends new_<field> and
+    is handed to database.patch_airport(). Any other new_<field> values in
+    the same form are changed along with it.
+    '''
+    airport_info = None
     if request.method == 'POST':
-        # Update the name based on selected IATA code
-        if 'iatacode' in request.form and 'new_name' not in request.form:
-            iatacode = request.form.get('iatacode')
-            airport_info = database.get_airport_by_iatacode(iatacode)  # Fetch airport info
+        iatacode = request.form.get('iatacode')
+        changes = {f: request.form[f'new_{f}'] for f in FIELD_LABELS if f'new_{f}' in request.form}
 
-            if airport_info is None:
+        if not changes:
+            # Served from the airport catalogue, no query in the common case
+            airport_info = database.get_airport_by_iatacode(str(iatacode).strip().upper())
+            if airport_info is None or isinstance(airport_info, str):
+                airport_info = None
                 flash('No airport found with the given IATA code.', 'danger')
+        else:
+            result = database.patch_airport(iatacode, changes)
+            if isinstance(result, str):
+                flash(f'Error updating airport {FIELD_LABELS[field]}: {result}', 'danger')
+            elif result['errors']:
+                for error in result['errors']:
+                    flash(error)
+            elif not result['found']:
+                flash('No airport found with the given IATA code.', 'danger')
+            elif result['conflicts']:
+                for conflict in result['conflicts']:
+                    flash(f'An airport with this {FIELD_LABELS[conflict]} already exists.')
+            elif result['airport'] is None:
+                flash(f'Attempting to change the {FIELD_LABELS[field]} to the current {FIELD_LABELS[field]}. '
+                      'No changes made.', 'warning')
             else:
-                # Render to display current name
-                return render_template('update_airport_name.html', 
-                                       page={'title': 'Update Airport Name'}, 
-                                       airport_info=airport_info, 
-                                       airports=airports,  
-                                       session=session)
-
-        # Update airport name
-        elif 'new_name' in request.form:
-            iatacode = request.form.get('iatacode')  
-            airport_info = database.get_airport_by_iatacode(iatacode)  
-            
-            new_name = request.form.get('new_name')
-
-            if airport_info is not None:
-                airport_id = airport_info[0]
-                current_name = airport_info[1].strip()
-                if current_name.casefold().split() == new_name.casefold().split():
-                    flash('Attempting to change the name to the current name. No changes made.', 'warning')
-                    return redirect(url_for('update_airport_name'))
-                new_name = new_name.title().strip() # case & whitespace insensitivity
-                if database.airport_exists_name(new_name):
-                    flash('An airport with this name already exists.')
-                    return redirect(url_for('update_airport_name'))
-                if not alphabetic_pattern.match(new_name):
-                     flash('Invalid airport name. Only alphabetic characters are allowed.')
-                     return redirect(url_for('update_airport_name'))
-                result = database.update_airport_name(airport_id, new_name)  
-                if result is True:
-                    flash(f'Airport name updated successfully for airport ID {airport_id}', 'success')
-                    return redirect(url_for('list_airports'))
-                else:
-                    flash(f'Error updating airport name: {result}', 'danger')
-
-    return render_template('update_airport_name.html', 
-                           page={'title': 'Update Airport Name'}, 
-                           airport_info=airport_info, 
-                           airports=airports,  
+                airport = result['airport']
+                changed = [FIELD_LABELS[f] for f in changes if f not in result['unchanged']]
+                flash(f'Airport {" and ".join(changed)} updated successfully for airport ID {airport[0]}', 'success')
+                return redirect(url_for('list_airports'))
+            return redirect(url_for(request.endpoint))
+
+    return render_template(template,
+                           page={'title': title},
+                           airport_info=airport_info,
                            session=session)
 
 
+@app.route('/airports/update_name/', methods=['GET', 'POST'])
+def update_airport_name():
+    return update_airport_page('name', 'update_airport_name.html', 'Update Airport Name')
+
 
 @app.route('/airports/update_iatacode/', methods=['GET', 'POST'])
 def update_airport_iatacode():
-    airport_info = None 
-    # Fetch all airports for dropdown
-    airports = database.get_all_airports_alphabetic()  
-    if request.method == 'POST':
-        # Update the IATA code based on selected IATA code
-        if 'iatacode' in request.form and 'new_iatacode' not in request.form:
-            iatacode = request.form.get('iatacode')
-            airport_info = database.get_airport_by_iatacode(iatacode)  
-            if airport_info is None:
-                flash('No airport found with the given IATA code.', 'danger')
-            else:
-                # Render to display current IATA code
-                return render_template('update_airport_iatacode.html', 
-                                       page={'title': 'Update Airport IATA Code'}, 
-                                       airport_info=airport_info, 
-                                       airports=airports,  
-                                       session=session)
-
-        # Update airport IATA code
-        elif 'new_iatacode' in request.form:
-            iatacode = request.form.get('iatacode')  
-            airport_info = database.get_airport_by_iatacode(iatacode) 
-            
-            new_iatacode = request.form.get('new_iatacode')
-
-            if airport_info is not None:
-                airport_id = airport_info[0]
-                current_iatacode = airport_info[2].strip()
-                if current_iatacode.casefold().split() == new_iatacode.casefold().split():
-                    flash('Attempting to change the iatacode to the current code. No changes made.', 'warning')
-                    return redirect(url_for('update_airport_iatacode'))  
-                new_iatacode = new_iatacode.upper().strip()
-                if not iata_pattern.match(new_iatacode):
-                    flash(f'Length of IATA Code should be exactly 3 letters and alphabetic!')
-                    return redirect(url_for('update_airport_iatacode')) 
-                if database.airport_exists_code(new_iatacode):
-                    flash('An airport with this IATA code already exists.')
-                    return redirect(url_for('update_airport_iatacode')) 
-                result = database.update_airport_iatacode(airport_id, new_iatacode)  
-                if result is True:
-                    flash(f'Airport IATA code updated successfully for airport ID {airport_id}', 'success')
-                    return redirect(url_for('list_airports'))
-                else:
-                    flash(f'Error updating airport IATA code: {result}', 'danger')
-                    return redirect(url_for('update_airport_iatacode')) 
-
-    return render_template('update_airport_iatacode.html', 
-                           page={'title': 'Update Airport IATA Code'}, 
-                           airport_info=airport_info, 
-                           airports=airports,  
-                           session=session)
-
+    return update_airport_page('iatacode', 'update_airport_iatacode.html', 'Update Airport IATA Code')
 
 
 @app.route('/airports/update_country/', methods=['GET', 'POST'])
 def update_airport_country():
-    airport_info = None  
-    airports = database.get_all_airports_alphabetic()  
-    
-    if request.method == 'POST':
-        # Check if only the IATA code is provided to display current info
-        if 'iatacode' in request.form and 'new_country' not in request.form:
-            iatacode = request.form.get('iatacode')
-            airport_info = database.get_airport_by_iatacode(iatacode)  
-
-            if airport_info is None:
-                flash('No airport found with the given IATA code.', 'danger')
-            else:
-                # Render to display current country
-                return render_template('update_airport_country.html', 
-                                       page={'title': 'Update Airport Country'}, 
-                                       airport_info=airport_info, 
-                                       airports=airports,  
-                                       session=session)
-
-        iatacode = request.form.get('iatacode')
-        airport_info = database.get_airport_by_iatacode(iatacode) 
-
-        if airport_info is None:
-            flash('No airport found with the given IATA code.', 'danger')
-        else:
-            if 'new_country' in request.form:
-                new_country = request.form.get('new_country')
-                airport_id = airport_info[0]
-                current_country = airport_info[4].strip()
-                if current_country.casefold().split() == new_country.casefold().split():
-                    flash('Attempting to change the country to the current country. No changes made.', 'warning')
-                    return redirect(url_for('update_airport_country'))
-                new_country = new_country.title().strip() 
-                if not alphabetic_pattern.match(new_country):
-                    flash('Invalid country name. Only alphabetic characters are allowed.')
-                    return redirect(url_for('update_airport_country'))
-                result = database.update_airport_country(airport_id, new_country)  
-                if result is True:
-                    flash(f'Airport country updated successfully for airport ID {airport_id}', 'success')
-                    return redirect(url_for('list_airports'))
-                else:
-                    flash(f'Error updating airport country: {result}', 'danger')
-    
-    return render_template('update_airport_country.html',
-                           page={'title': 'Update Airport Country'},
-                           airport_info=airport_info,
-                           airports=airports,
-                           session=session)
-
+    return update_airport_page('country', 'update_airport_country.html', 'Update Airport Country')
 
 
 @app.route('/airports/update_city/', methods=['GET', 'POST'])
 def update_airport_city():
-    airport_info = None  
-    airports = database.get_all_airports_alphabetic()  
-    
-    if request.method == 'POST':
-        # Check if only the IATA code is provided to display current info
-        if 'iatacode' in request.form and 'new_city' not in request.form:
-            iatacode = request.form.get('iatacode')
-            airport_info = database.get_airport_by_iatacode(iatacode)  
-
-            if airport_info is None:
-                flash('No airport found with the given IATA code.', 'danger')
-            else:
-                # Render to display current city
-                return render_template('update_airport_city.html', 
-                                       page={'title': 'Update Airport City'}, 
-                                       airport_info=airport_info, 
-                                       airports=airports,  
-                                       session=session)
-
-        iatacode = request.form.get('iatacode')
-        airport_info = database.get_airport_by_iatacode(iatacode)  
-
-        if airport_info is None:
-            flash('No airport found with the given IATA code.', 'danger')
-        else:
-            if 'new_city' in request.form:
-                new_city = request.form.get('new_city')
-                airport_id = airport_info[0]
-                current_city = airport_info[3].strip()
-                if current_city.casefold().split() == new_city.casefold().split():
-                    flash('Attempting to change the city to the current city. No changes made.', 'warning')
-                    return redirect(url_for('update_airport_city'))
-                new_city = new_city.title().strip()
-                if not alphabetic_pattern.match(new_city):
-                    flash('Invalid city name. Only alphabetic characters are allowed.')
-                    return redirect(url_for('update_airport_city'))
-                result = database.update_airport_city(airport_id, new_city) 
-                if result is True:
-                    flash(f'Airport city updated successfully for airport ID {airport_id}', 'success')
-                    return redirect(url_for('list_airports'))
-                else:
-                    flash(f'Error updating airport city: {result}', 'danger')
-    
-    return render_template('update_airport_city.html', 
-                           page={'title': 'Update Airport City'}, 
-                           airport_info=airport_info, 
-                           airports=airports,  
-                           session=session)
+    return update_airport_page('city', 'update_airport_city.html', 'Update Airport City')
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# Imports
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+from settings import get_settings
+
+################################################################################
+# Server side sessions
+#   - The browser's cookie only holds a random session id; the session
+#     itself (logged_in, userid, the user's role, flash messages) is kept
+#     in a store on the server, one per visitor
+#   - [SESSION] store = sqlite (default): one SQLite file that every worker
+#     process on the machine opens, so a login is seen by all gunicorn
+#     workers. store = memory: an LRU dict in the process, for the dev server
+#   - A session expires [SESSION] ttl seconds after it was last used. It is
+#     only written back when it changed or half of its time is used up
+#   - The id is replaced on login (session.regenerate()), so an id handed
+#     out before logging in is of no use afterwards
+################################################################################
+
+logger = logging.getLogger('airline.sessions')
+
+# secrets.token_urlsafe(32)
+_sid_pattern = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+# The SQLite store deletes expired sessions every this many writes
+PURGE_EVERY = 1000
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session whose content stays on the server, under self.sid."""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.new = sid is None
+        self.sid = sid or new_sid()
+        self.expires = expires
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = True
+
+    def regenerate(self):
+        """Move the session to a new id, the old one is dropped when it is saved."""
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = new_sid()
+        self.new = True
+        self.modified = True
+
+
+class MemoryStore:
+    """Sessions in this process only: an LRU of at most max_entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return entry
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._sessions[sid] = (data, expires)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SqliteStore:
+    """Sessions in a SQLite file shared by the worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # one connection per thread, and never one inherited over a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                            sid TEXT PRIMARY KEY,
+                            data TEXT NOT NULL,
+                            expires REAL NOT NULL
+                        )""")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        return self._conn().execute("SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?",
+                                    (sid, time.time())).fetchone()
+
+    def save(self, sid, data, expires):
+        conn = self._conn()
+        conn.execute("""INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?)
+                        ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires = excluded.expires""",
+                     (sid, data, expires))
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+# (settings the store was made from, store)
+_store = (None, None)
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The store [SESSION] asks for, made again if those settings changed."""
+    global _store
+    config = get_settings()
+    key = (config.session_store, config.session_path, config.session_max_entries)
+    if _store[0] != key:
+        with _store_lock:
+            if _store[0] != key:
+                if config.session_store == 'memory':
+                    store = MemoryStore(config.session_max_entries)
+                else:
+                    store = SqliteStore(config.session_path)
+                _store = (key, store)
+    return _store[1]
+
+
+class ServerSessionStorage:
+    '''
+    Loading and saving a ServerSession, shared by the Flask interface below
+    and the Quart one in asgi_app.py; they only differ in being async.
+    '''
+
+    def load_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _sid_pattern.match(sid):
+            try:
+                found = get_store().load(sid)
+            except Exception:
+                logger.exception("Could not read session")
+                found = None
+            if found is not None:
+                return ServerSession(session_json_serializer.loads(found[0]), sid=sid, expires=found[1])
+        return ServerSession()
+
+    def store_session(self, app, session, response):
+        store = get_store()
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            # logged out and nothing left to show: forget the session
+            if not session.new:
+                store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        ttl = get_settings().session_ttl
+        now = time.time()
+        if not session.modified and session.expires is not None and session.expires - now > ttl / 2:
+            return
+        store.save(session.sid, session_json_serializer.dumps(dict(session)), now + ttl)
+        response.set_cookie(name, session.sid, max_age=int(ttl), domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        response.vary.add('Cookie')
+
+
+class ServerSessionInterface(ServerSessionStorage, SessionInterface):
+    """app.session_interface for the Flask app."""
+
+    def open_session(self, app, request):
+        return self.load_session(app, request)
+
+    def save_session(self, app, session, response):
+        try:
+            self.store_session(app, session, response)
+        except Exception:
+            logger.exception("Could not save session")
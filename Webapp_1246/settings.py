@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Imports
+import configparser
+import logging
+import os
+import signal
+import threading
+import time
+
+################################################################################
+# Settings
+#   - config.ini is parsed and validated once and kept as a Settings object
+#   - get_settings() hands out the cached object; the file is only read
+#     again when its mtime changes or a reload was asked for (SIGHUP or
+#     request_reload()), so no request pays for disk I/O
+################################################################################
+
+CONFIG_FILE = 'config.ini'
+
+# How often (seconds) get_settings() may stat the file to look for changes
+CHECK_INTERVAL = 5
+
+
+class SettingsError(Exception):
+    """Raised when config.ini is missing or holds invalid values."""
+
+
+class Settings:
+    """
+    Validated values from config.ini. Everything except the [DATABASE]
+    credentials and the [FLASK] port has a default.
+    """
+
+    def __init__(self, config):
+        errors = []
+
+        def get(section, key, fallback=None, required=False):
+            if config.has_option(section, key):
+                return config.get(section, key).strip()
+            if required:
+                errors.append(f"[{section}] {key} is missing")
+            return fallback
+
+        def number(section, key, fallback, cast=int, minimum=0, maximum=None):
+            raw = get(section, key)
+            if raw is None:
+                return fallback
+            try:
+                value = cast(raw)
+            except ValueError:
+                errors.append(f"[{section}] {key} must be a number, got {raw!r}")
+                return fallback
+            if value < minimum or (maximum is not None and value > maximum):
+                errors.append(f"[{section}] {key} = {value} is out of range")
+            return value
+
+        def flag(section, key, fallback):
+            raw = get(section, key)
+            if raw is None:
+                return fallback
+            if raw.lower() in ('1', 'yes', 'true', 'on'):
+                return True
+            if raw.lower() in ('0', 'no', 'false', 'off'):
+                return False
+            errors.append(f"[{section}] {key} must be true or false, got {raw!r}")
+            return fallback
+
+        # [DATABASE]
+        self.db_host = get('DATABASE', 'host', required=True)
+        self.db_port = number('DATABASE', 'port', 5432, minimum=1, maximum=65535)
+        self.db_user = get('DATABASE', 'user', required=True)
+        self.db_password = get('DATABASE', 'password', required=True)
+        # the database defaults to the user name, as on the uni servers
+        self.db_name = get('DATABASE', 'database', self.db_user)
+
+        # [FLASK]
+        self.flask_port = number('FLASK', 'port', None, minimum=1, maximum=65535)
+        if self.flask_port is None:
+            errors.append("[FLASK] port is missing")
+
+        # [SERVER] how web_app.py runs the app, see the readme
+        self.server_mode = (get('SERVER', 'mode', 'dev') or 'dev').lower()
+        if self.server_mode not in ('dev', 'production'):
+            errors.append(f"[SERVER] mode must be dev or production, got {self.server_mode!r}")
+        self.server_workers = number('SERVER', 'workers', os.cpu_count() or 1, minimum=1)
+        self.server_threads = number('SERVER', 'threads', 4, minimum=1)
+        self.server_timeout = number('SERVER', 'timeout', 30.0, cast=float)
+        self.server_graceful_timeout = number('SERVER', 'graceful_timeout', 30.0, cast=float)
+        self.server_max_requests = number('SERVER', 'max_requests', 0)
+
+        # [POOL]
+        self.pool_min = number('POOL', 'minconn', 1)
+        self.pool_max = number('POOL', 'maxconn', 10, minimum=1)
+        self.pool_idle_timeout = number('POOL', 'idle_timeout', 300.0, cast=float)
+        self.pool_check_after = number('POOL', 'check_after', 30.0, cast=float)
+        self.pool_timeout = number('POOL', 'timeout', 10.0, cast=float)
+        if self.pool_min > self.pool_max:
+            errors.append(f"[POOL] minconn ({self.pool_min}) is larger than maxconn ({self.pool_max})")
+
+        # [LOGGING]
+        self.log_level = (get('LOGGING', 'level', 'WARNING') or 'WARNING').upper()
+        if self.log_level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+            errors.append(f"[LOGGING] level must be DEBUG, INFO, WARNING, ERROR or CRITICAL, got {self.log_level!r}")
+        self.log_queries = flag('LOGGING', 'log_queries', False)
+        self.log_slow_query_ms = number('LOGGING', 'slow_query_ms', 200.0, cast=float)
+
+        # [LOGIN] bcrypt worker pool, see hashing.py
+        self.hash_pool = (get('LOGIN', 'hash_pool', 'thread') or 'thread').lower()
+        if self.hash_pool not in ('thread', 'process'):
+            errors.append(f"[LOGIN] hash_pool must be thread or process, got {self.hash_pool!r}")
+        self.hash_workers = number('LOGIN', 'hash_workers', os.cpu_count() or 1, minimum=1)
+        self.hash_max_queue = number('LOGIN', 'hash_max_queue', 64)
+        self.hash_timeout = number('LOGIN', 'hash_timeout', 5.0, cast=float)
+        self.hash_rounds = number('LOGIN', 'hash_rounds', 12, minimum=4, maximum=31)
+
+        # [METRICS] /metrics in the Prometheus text format
+        self.metrics_enabled = flag('METRICS', 'enabled', True)
+        self.metrics_local_only = flag('METRICS', 'local_only', True)
+
+        # [SESSION] where the server side sessions are kept, see sessions.py
+        self.session_store = (get('SESSION', 'store', 'sqlite') or 'sqlite').lower()
+        if self.session_store not in ('sqlite', 'memory'):
+            errors.append(f"[SESSION] store must be sqlite or memory, got {self.session_store!r}")
+        self.session_path = get('SESSION', 'path', 'sessions.sqlite3')
+        self.session_ttl = number('SESSION', 'ttl', 28800.0, cast=float, minimum=60)
+        self.session_max_entries = number('SESSION', 'max_entries', 10000, minimum=1)
+
+        # [CACHE] time to live in seconds for the in-process caches
+        self.cache_catalogue_ttl = number('CACHE', 'catalogue_ttl', 300.0, cast=float)
+        self.cache_count_ttl = number('CACHE', 'count_ttl', 60.0, cast=float)
+        self.cache_role_ttl = number('CACHE', 'role_ttl', 300.0, cast=float)
+        # rendered tables kept by fragments.py, per process; 0 turns it off
+        self.cache_fragment_max_bytes = number('CACHE', 'fragment_max_bytes', 32 * 1024 * 1024)
+
+        if errors:
+            raise SettingsError("Invalid " + CONFIG_FILE + ": " + "; ".join(errors))
+
+    def database_target(self):
+        """The values that decide which database the pool connects to."""
+        return (self.db_host, self.db_port, self.db_name, self.db_user, self.db_password)
+
+    def pool_options(self):
+        """Keyword arguments for database.ConnectionPool."""
+        return {'minsize': self.pool_min,
+                'maxsize': self.pool_max,
+                'idle_timeout': self.pool_idle_timeout,
+                'check_after': self.pool_check_after,
+                'timeout': self.pool_timeout}
+
+
+def load_settings(path=CONFIG_FILE):
+    """Read and validate a config file, without touching the cache."""
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise SettingsError(f"Could not read {path}, please create it as in the Lab instructions")
+    return Settings(config)
+
+
+_settings = None
+_mtime = None
+_last_check = 0.0
+_reload_requested = False
+_listeners = []
+_lock = threading.Lock()
+
+
+def get_settings():
+    """Return the current settings, re-reading config.ini only if it changed."""
+    global _settings, _mtime, _last_check, _reload_requested
+    now = time.monotonic()
+    if _settings is not None and not _reload_requested and now - _last_check < CHECK_INTERVAL:
+        return _settings
+
+    with _lock:
+        if _settings is not None and not _reload_requested and now - _last_check < CHECK_INTERVAL:
+            return _settings
+        _last_check = now
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime
+        except OSError:
+            mtime = None
+        if _settings is not None and not _reload_requested and mtime == _mtime:
+            return _settings
+        _reload_requested = False
+
+        try:
+            new = load_settings()
+        except SettingsError as e:
+            if _settings is None:
+                raise
+            # Keep running on the last good settings
+            logging.getLogger('airline.settings').error("%s", e)
+            _mtime = mtime
+            return _settings
+
+        old, _settings, _mtime = _settings, new, mtime
+
+    if old is not None:
+        for listener in list(_listeners):
+            listener(old, new)
+    return new
+
+
+def request_reload():
+    """Make the next get_settings() call re-read config.ini."""
+    global _reload_requested
+    _reload_requested = True
+
+
+def on_reload(listener):
+    """Register listener(old, new), called after the settings were reloaded."""
+    _listeners.append(listener)
+    return listener
+
+
+def configure_logging():
+    """Set up log output from the [LOGGING] settings, and follow later changes."""
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger().setLevel(get_settings().log_level)
+    # only written to when query debugging is switched on, so always let it through
+    logging.getLogger('airline.sql').setLevel(logging.INFO)
+
+    @on_reload
+    def _update_level(old, new):
+        if old.log_level != new.log_level:
+            logging.getLogger().setLevel(new.log_level)
+
+
+def install_reload_signal():
+    """Re-read config.ini on SIGHUP. Must be called from the main thread."""
+    if hasattr(signal, 'SIGHUP'):
+        # Only set a flag here, the actual reading happens outside the handler
+        signal.signal(signal.SIGHUP, lambda signum, frame: request_reload())
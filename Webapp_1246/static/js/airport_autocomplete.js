@@ -0,0 +1,118 @@
+// Type-ahead for picking airports, replaces the <select> of every airport.
+//
+// <input data-airport-suggest="<suggest url>" name="iatacode"> gets a suggestion list as the
+// user types; picking one puts its IATA code in the input. Without
+// JavaScript the input still works, the IATA code is simply typed in.
+//
+// With data-multiple, each pick is added as a hidden iatacode field with a
+// remove button instead, so several airports can be chosen.
+(function () {
+  var SUGGEST_URL = '/api/airports/suggest';
+  var DELAY_MS = 150;
+
+  function label(airport) {
+    return airport.name + ' (' + airport.iatacode + '), ' + airport.city + ', ' + airport.country;
+  }
+
+  function attach(input) {
+    var url = input.getAttribute('data-airport-suggest') || SUGGEST_URL;
+    var multiple = input.hasAttribute('data-multiple');
+    var list = document.createElement('div');
+    list.className = 'list-group airport-suggestions';
+    list.style.position = 'absolute';
+    list.style.zIndex = 1000;
+    input.parentNode.style.position = 'relative';
+    input.parentNode.appendChild(list);
+
+    var chosen = null;
+    if (multiple) {
+      chosen = document.createElement('div');
+      chosen.className = 'mt-2';
+      input.parentNode.appendChild(chosen);
+    }
+
+    var timer = null;
+    var latest = 0;
+
+    function clear() {
+      list.innerHTML = '';
+    }
+
+    function pick(airport) {
+      clear();
+      if (!multiple) {
+        input.value = airport.iatacode;
+        return;
+      }
+      if (chosen.querySelector('input[value="' + airport.iatacode + '"]')) {
+        input.value = '';
+        return;
+      }
+      var tag = document.createElement('span');
+      tag.className = 'badge badge-secondary mr-2';
+      tag.textContent = label(airport) + ' ';
+      var hidden = document.createElement('input');
+      hidden.type = 'hidden';
+      hidden.name = input.name;
+      hidden.value = airport.iatacode;
+      var remove = document.createElement('a');
+      remove.href = '#';
+      remove.textContent = '×';
+      remove.onclick = function (e) {
+        e.preventDefault();
+        chosen.removeChild(tag);
+        input.required = chosen.children.length === 0;
+      };
+      tag.appendChild(hidden);
+      tag.appendChild(remove);
+      chosen.appendChild(tag);
+      input.value = '';
+      input.required = false;
+    }
+
+    function show(airports) {
+      clear();
+      airports.forEach(function (airport) {
+        var item = document.createElement('a');
+        item.href = '#';
+        item.className = 'list-group-item list-group-item-action';
+        item.textContent = label(airport);
+        item.onmousedown = function (e) {
+          e.preventDefault();
+          pick(airport);
+        };
+        list.appendChild(item);
+      });
+    }
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      var q = input.value.trim();
+      if (!q) {
+        clear();
+        return;
+      }
+      timer = setTimeout(function () {
+        var request = ++latest;
+        fetch(url + '?q=' + encodeURIComponent(q))
+          .then(function (response) { return response.ok ? response.json() : []; })
+          .then(function (airports) {
+            // answers can arrive out of order, only show the newest
+            if (request === latest) {
+              show(airports);
+            }
+          })
+          .catch(clear);
+      }, DELAY_MS);
+    });
+    input.addEventListener('blur', clear);
+    input.setAttribute('autocomplete', 'off');
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    var inputs = document.querySelectorAll('input[data-airport-suggest]');
+    for (var i = 0; i < inputs.length; i++) {
+      attach(inputs[i]);
+    }
+  });
+})();
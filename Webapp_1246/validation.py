@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# Imports
+import re
+
+# Defined regex patterns for validation, shared by the routes and the bulk import
+alphabetic_pattern = re.compile(r'^[A-Za-z\s]+$')  # Allow letters and spaces
+iata_pattern = re.compile(r'^[A-Z]{3}$')  # Exactly 3 uppercase letters
+
+# The editable airport columns, in table order
+AIRPORT_FIELDS = ('name', 'iatacode', 'city', 'country')
+
+
+def clean_airport_field(field, value):
+    '''
+    Normalise one airport value the way the Add Airport form does.
+    Returns (value, None) or (None, error message).
+    '''
+    if value is None or not str(value).strip():
+        return None, f"{field} is missing"
+    value = str(value).strip()
+    if field == 'iatacode':
+        value = value.upper()
+        if not iata_pattern.match(value):
+            return None, 'Invalid IATA code. It must be exactly 3 letters.'
+        return value, None
+    if field not in AIRPORT_FIELDS:
+        return None, f"{field} is not an airport field"
+    value = value.title()
+    if not alphabetic_pattern.match(value):
+        label = 'airport name' if field == 'name' else f'{field} name'
+        return None, f'Invalid {label}. Only alphabetic characters are allowed.'
+    return value, None
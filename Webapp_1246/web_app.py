@@ -1,9 +1,85 @@
+import argparse
 from routes import *
-import sys
+from settings import configure_logging, install_reload_signal, request_reload
+import hashing
+
+
+################################################################################
+# Production launcher
+#   - gunicorn with [SERVER] workers processes of [SERVER] threads each, so
+#     the app uses every core instead of one dev server process
+#   - The app, the settings and the compiled templates are loaded once in
+#     the master before forking, workers share them copy-on-write
+#   - Every worker opens its own connection pool after the fork, nothing
+#     that holds a socket or a thread is carried over from the master
+#   - kill -HUP <master pid> starts fresh workers and lets the old ones
+#     finish their requests (graceful reload); config.ini is re-read
+################################################################################
+
+def preload_templates():
+    # Compile every template now instead of on each worker's first request
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def post_fork(server, worker):
+    # The master never opened any, but never share a socket with it either way
+    database.forget_pool()
+    hashing.reset_hash_pool()
+    # pick up a config.ini that changed since the master loaded it
+    request_reload()
+
+
+def run_production(config):
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    preload_templates()
+    # The master loaded the settings, and maybe the pool, while importing
+    # routes; connections must not be inherited by the workers
+    database.close_pool()
+
+    ProductionServer({
+        'bind': f"0.0.0.0:{portchoice}",
+        'workers': config.server_workers,
+        'threads': config.server_threads,
+        'worker_class': 'gthread',
+        'timeout': int(config.server_timeout),
+        'graceful_timeout': int(config.server_graceful_timeout),
+        'max_requests': config.server_max_requests,
+        'max_requests_jitter': config.server_max_requests // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+        # request log and errors to stdout/stderr
+        'accesslog': '-',
+        'errorlog': '-',
+        'loglevel': config.log_level.lower(),
+    }).run()
 
 
 # Starting the python applicaiton
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the airline web app')
+    parser.add_argument('--production', action='store_const', const='production', dest='mode',
+                        help='multi-process server, default from [SERVER] mode in config.ini')
+    parser.add_argument('--dev', action='store_const', const='dev', dest='mode',
+                        help='single process development server')
+    args = parser.parse_args()
+    config = get_settings()
+    mode = args.mode or config.server_mode
+
     # database.hash_and_update_all_passwords()
     print("-"*70)
     print("""If you are on the server: Please open your browser to: http://soitpa10005.shared.sydney.edu.au:"""+portchoice+"""/""")
@@ -13,18 +89,16 @@ if __name__ == '__main__':
     print("-"*70)
     page = {'title' : 'ISYS2120 Assignment'}
 
- #######################################
- # Changes I made   
- # Redirect stdout and stderr to /dev/null
-    class NullWriter:
-        def write(self, arg):
-            pass
-
-        def flush(self):
-            pass
+    # Log output is controlled by the [LOGGING] section of config.ini,
+    # by default only warnings, errors and slow queries are written
+    configure_logging()
 
-    sys.stdout = NullWriter()  
-    sys.stderr = NullWriter()  
+    if mode == 'production':
+        # gunicorn handles HUP itself (graceful reload of the workers)
+        run_production(config)
+    else:
+        # kill -HUP <pid> makes the app re-read config.ini
+        install_reload_signal()
 
-    ###############################
-    app.run(debug=False, host='0.0.0.0', port=int(portchoice))
+        ###############################
+        app.run(debug=False, host='0.0.0.0', port=int(portchoice))